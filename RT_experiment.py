@@ -10,118 +10,326 @@ Created on Wed Feb 15 15:11:45 2023
 
 ### —————————————— Preamble —————————————— ###
 
-# Packages
-import pandas as pd
-import pathlib, glob
-import numpy as np
-from psychopy import visual, event, gui
-from scripts.funcs import run
-import datetime
+# Packages: only the light ones at launch, the others are imported when they are first needed, most of
+# them in the background while the participant dialog is shown
+import time
+launch = time.perf_counter()
+import argparse, datetime, os
+from concurrent.futures import ThreadPoolExecutor
+from scripts.startup import StartupClock
+startup = StartupClock(launch)
 
 # Information to collect at the start
 info= {'ID':'', 'Age':'','Gender':''} # 'ID':''(sona-system ID code), 'Age':'','Gender':''
 
-# Experimental stimuli
-stim_list = glob.glob(r'./stimuli/*.png') # main task stimuli
-stim_df = pd.DataFrame({
-    'stim_file': stim_list, # stimulus file
-    'exp_phase': [(pathlib.Path(file).stem).split('_')[0] for file in stim_list], # practice or main task
-    'stim_cat': [(pathlib.Path(file).stem).split('_')[1] for file in stim_list], # category in the image
-    'stim_nb' : [(pathlib.Path(file).stem).split('_')[2] for file in stim_list] # number of the image
-})
+# Options, e.g. from the station launcher (python -m scripts.stations)
+#   python RT_experiment.py --simulate  runs without a screen, with a simulated participant
+parser = argparse.ArgumentParser(description = 'Reaction time experiment')
+parser.add_argument('--config', default = r'./experiment.toml', help = 'description of the session (TOML or YAML)')
+parser.add_argument('--simulate', action = 'store_true', help = 'run without a screen, with a simulated participant')
+parser.add_argument('--id', help = 'participant ID, not asked in the dialog if given')
+parser.add_argument('--counterbalance', type = int, help = 'counterbalancing group, defaults to the ID')
+parser.add_argument('--out', help = 'prefix of the output files, defaults to <date>_ppt<ID>')
+parser.add_argument('--profile', help = 'calibration profile of the station (python -m scripts.calibration), '
+                                        'defaults to the one of this machine')
+parser.add_argument('--verify-frames', action = 'store_true', help = 'read back the frame of every stimulus and '
+                                                                    'check it shows the expected image')
+args = parser.parse_args()
+simulate = args.simulate
 
-# Window display parameters
-size = (1440,900)
-fullscr = False
-units = 'pix'
-screen_color = '#BABAB9'
+
+def prepare_session():
+    
+    # The session: window, task, timings, phases and runs, and the screens shown around them
+    with startup.stage('imports'):
+        from scripts.config import read_config, validate_config
+        from scripts.manifest import load_manifest
+        from scripts.calibration import load_profile
+        # the modules used once the window is open, none of which touches the display
+        import scripts.schedule, scripts.logger, scripts.session, scripts.scoring, scripts.adaptive, scripts.monitor
+    
+    with startup.stage('configuration'):
+        config = read_config(args.config)
+        # Experimental stimuli, checked against their manifest: refuse to run if the set was changed, or
+        # if there is no manifest to check it against
+        stim_df = load_manifest(config['stimuli']['folder']) # main task stimuli
+        # Check the whole configuration, and every screen it shows, before anything starts
+        validate_config(config, stim_df)
+        # the settings measured on this station, none for a simulated session unless given
+        profile = load_profile(args.profile) if args.profile is not None or not simulate else None
+    
+    return config, stim_df, profile
+
+
+def decode_session(setup):
+    
+    # Decode every image the session can show, except those pre-rendered for this window by
+    # 'python -m scripts.variants build' (if up to date), which are read straight from their store, and
+    # render the screens of the task (question, break and feedback screens)
+    config, stim_df, profile = setup.result()
+    with startup.stage('decoding'):
+        from scripts.config import plan_screens, plan_stimuli, session_screens
+        from scripts.variants import open_variant_store
+        from scripts.prefetch import decode_images
+        from scripts.verification import frame_references
+        window = config['window']
+        variants = open_variant_store(stim_df, window['size'], window['units'], window['color'])
+        # (a simulated window never shows them, and the stimuli are decoded during the session if
+        # the station can't keep them all)
+        files = plan_screens(config)
+        if profile is None or not profile['recommended']['prefetch']:
+            files = plan_stimuli(config, stim_df) + files
+        screens = session_screens(config)
+        files = [file for file in files if not simulate and file not in screens
+                 and (variants is None or file not in variants)]
+        images = decode_images(files)
+        screens.render_all()
+        # what each stimulus should look like on screen, to check the frames against
+        references = None
+        if args.verify_frames:
+            references = frame_references(plan_stimuli(config, stim_df), (500,500), window['color'], variants)
+    
+    return variants, images, screens, references
+
+
+# Prepare the session in the background, in order, meanwhile the window is only opened on the main
+# thread, which has to own its OpenGL context
+preparation = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'startup')
+setup = preparation.submit(prepare_session)
+decoding = preparation.submit(decode_session, setup)
 
 
 ### —————————————— Experiment —————————————— ###
 
-# Collect information at the start
-infoDlg=gui.DlgFromDict(dictionary=info)
-# Create the experiment window
-win = visual.Window(size = size, fullscr = fullscr, units = units, color = screen_color)
-
-# # Show general instructions
-visual.ImageStim(win, fr'instructions/general_instructions.png').draw()
-win.flip()
-event.waitKeys(keyList = ('space'))
-
-### Practice
-# Show the instructions for the practice sessions
-visual.ImageStim(win, fr'instructions/practice_start.png').draw()
-win.flip()
-event.waitKeys(keyList = ('space'))
-# start the practice phase
-practice_df = run(
-    win, # where to play the experiment
-    stimuli = stim_df, # which images to use
-    exp_phase = 'practice', # only use the practice images
-    categories = ['face', 'scene', 'body'], # all except objects
-    keys = ['f', 'j'], # which keys to use
-    interval_time=0.4, 
-    feedback_time=0.5)
-
-### Main task
-# Show the instructions for the main task
-visual.ImageStim(win, fr'instructions/main_start.png').draw()
-win.flip()
-event.waitKeys(keyList = ('space'))
-# Start run 1
-main_df1 = run(
-    win, # where to play the experiment
-    stimuli = stim_df, # which images to use
-    exp_phase = 'main', # only use the practice images
-    categories = ['face', 'scene', 'body'], # all except objects
-    keys = ['f', 'j'], # which keys to use
-    interval_time=0.4, 
-    feedback_time=0.5)
-
-# Start run 2
-main_df2 = run(
-    win, # where to play the experiment
-    stimuli = stim_df, # which images to use
-    exp_phase = 'main', # only use the practice images
-    categories = ['face', 'scene', 'body'], # all except objects
-    keys = ['f', 'j'], # which keys to use
-    interval_time=0.4, 
-    feedback_time=0.5)
-# Show the break instructions after run 2
-visual.ImageStim(win, fr'instructions/run02_finish.png').draw()
-win.flip()
-event.waitKeys(keyList = ('space'))
-
-# Start run 3
-main_df3 = run(
-    win, # where to play the experiment
-    stimuli = stim_df, # which images to use
-    exp_phase = 'main', # only use the practice images
-    categories = ['face', 'scene', 'body'], # all except objects
-    keys = ['f', 'j'], # which keys to use
-    interval_time=0.4, 
-    feedback_time=0.5)
+if simulate:
+    # no participant to ask
+    info.update({'ID': args.id or 'sim', 'Age': '', 'Gender': ''})
+else:
+    # Collect information at the start
+    with startup.stage('imports'):
+        from psychopy import gui
+    if args.id is not None:
+        info['ID'] = args.id
+    with startup.stage('dialog'):
+        infoDlg=gui.DlgFromDict(dictionary=info, fixed=['ID'] if args.id is not None else [])
+
+# The session, checked meanwhile (a mistake in the configuration is raised here)
+with startup.stage('waiting for the configuration'):
+    config, stim_df, profile = setup.result()
+window, task = config['window'], config['task']
+categories, keys = task['categories'], task['keys']
+
+with startup.stage('window'):
+    from scripts.funcs import run, show_screen
+    from scripts.config import session_runs, plan_screens, plan_stimuli, screen_file
+    from scripts.manifest import texture_bytes
+    from scripts.timing import TrialTimer, frame_summary
+    from scripts.keyboard import open_keyboard, read_keys, add_releases
+    from scripts.cache import StimulusCache
+    from scripts.logger import TrialLogger, read_log
+    from scripts.session import SessionState
+    from scripts.schedule import compile_schedule, schedule_blocks
+    from scripts.scoring import LOG_COLUMNS, score_trials
+    from scripts.adaptive import ImageEstimates
+    from scripts.monitor import PerformanceMonitor
+    from scripts.calibration import check_profile
+    from scripts.criterion import PracticeCriterion
+    from scripts.verification import FrameVerifier, read_frame_checks, add_frame_checks
+    if simulate:
+        # a window that is never shown
+        from scripts.simulated import SimulatedWindow
+        win = SimulatedWindow(size = window['size'], units = window['units'], color = window['color'])
+        keyboard = None
+    else:
+        # Create the experiment window
+        from psychopy import visual
+        win = visual.Window(size = window['size'], fullscr = window['fullscr'], units = window['units'],
+                            color = window['color'])
+        # Read the keyboard on its own thread, straight from the input device where possible
+        keyboard = open_keyboard()
+runs = session_runs(config)
+# Read all the key presses of the session from the same keyboard
+timer = TrialTimer(win, keyboard)
+
+# Keep track of the session, to resume it at the first unfinished block if it gets interrupted
+# (all the output files start with the same prefix, which includes the date)
+out = args.out or fr'{str(datetime.date.today())}_ppt{info["ID"]}'
+session_path = fr'{out}_session.json'
+state = SessionState(session_path)
+# the runs of the session, by their number in the output
+run_labels = {step['run']: step['label'] for step in runs}
+
+# Compile the whole plan of each phase from the seed of the session, counterbalancing the key order
+# across IDs
+if args.counterbalance is not None:
+    participant = args.counterbalance
+else:
+    participant = int(info['ID']) if info['ID'].isdigit() else 0
+schedules = {phase['exp_phase']: compile_schedule(stim_df, phase['exp_phase'], categories, keys,
+                                                  n_runs = phase['runs'], seed = state.seed,
+                                                  participant = participant,
+                                                  max_target_run = task['max_target_run'])
+             for phase in config['phases'] if phase['runs'] > 0}
+
+# Stream every trial to disk as it is played, with the participant and run info
+log_path = fr'{out}_log.csv'
+# (a resumed session starts from the trials it already logged)
+resumed_trials = read_log(log_path) if state.resumed and os.path.exists(log_path) else None
+logger = TrialLogger(log_path, columns = LOG_COLUMNS + ['ID', 'age', 'gender', 'attempt', 'run', 'block'])
+logger.set_context(ID = info['ID'], age = info['Age'], gender = info['Gender'], attempt = state.attempt)
+
+# Follow the performance live (python -m scripts.monitor <status file>), with alerts on poor blocks
+monitor = PerformanceMonitor(fr'{out}_status.json', alerts_path = fr'{out}_alerts.log')
+
+# Upload exactly the images the session can show, once, before the first screen, from the images decoded
+# (or pre-rendered) meanwhile, and draw them all once so that the first screens don't wait for the driver
+# (in the memory this station can spare, if it was calibrated, or else decoded in the background during
+# the runs)
+if profile is None and not simulate:
+    print('No calibration profile for this station (python -m scripts.calibration), using the defaults')
+# the timings are the same in every run, so the station is checked against them once
+if profile is not None:
+    for warning in check_profile(profile, win, task['interval_time'], task['feedback_time']):
+        print(f'Warning: {warning}')
+cache_max_mb = config['cache']['max_mb']
+if profile is not None:
+    cache_max_mb = min(cache_max_mb, profile['recommended']['cache_mb'])
+cache_max_bytes = int(cache_max_mb * 1024**2)
+session_stimuli = plan_stimuli(config, stim_df)
+if profile is not None and profile['recommended']['prefetch']:
+    session_stimuli = []
+elif texture_bytes(stim_df.loc[stim_df['stim_file'].isin(session_stimuli)]) > cache_max_bytes:
+    print(f'Warning: the stimuli need more texture memory than the cache holds ({cache_max_bytes / 1024**2:.0f} '
+          f'MB); some will be loaded again during the session')
+with startup.stage('waiting for the decoding'):
+    variants, images, screens, references = decoding.result()
+    preparation.shutdown()
+if variants is None:
+    print('No pre-rendered images for this window configuration, decoded the PNG files')
+with startup.stage('upload'):
+    cache = StimulusCache(win, max_bytes = cache_max_bytes,
+                          sizes = dict(zip(stim_df['stim_file'], zip(stim_df['width'], stim_df['height']))),
+                          variants = variants, screens = screens)
+    cache.preload(session_stimuli, size = (500,500), images = images)
+    cache.preload(plan_screens(config), images = images)
+# the decoded images are not needed anymore once uploaded
+images = decoding = None
+with startup.stage('warm-up'):
+    cache.warm_up()
+cache_report = cache.report()
+print(f"Preloaded {cache_report['n_stimuli']} images in {cache_report['load_time']:.2f} s "
+      f"({cache_report['resident_mb']:.1f} MB resident)")
+
+# Read back the frame of every stimulus as it is shown, and check it shows the expected image
+verifier = None
+if references is not None:
+    verifier = FrameVerifier(win, references)
+    verifier.set_context(attempt = state.attempt)
+
+# Keep running estimates of the RT of each main image, to choose the images of each block
+estimates = None
+if task['adaptive_block_size'] is not None:
+    main_images = ('main_' + stim_df['stim_cat'] + '_' + stim_df['stim_nb']).loc[stim_df['exp_phase'] == 'main']
+    if resumed_trials is not None and len(resumed_trials):
+        estimates = ImageEstimates.from_trials(score_trials(state.keep_completed(resumed_trials, run_labels)),
+                                               main_images, categories)
+    else:
+        estimates = ImageEstimates(main_images, categories)
+
+# Time from the launch to the first screen, e.g. to keep it short
+startup.mark('first_screen')
+print('\n'.join(startup.summary()))
+startup.save(fr'{out}_startup.json')
+
+# Show general instructions
+if config['screens']['start'] is not None:
+    show_screen(win, cache, timer, screen_file(config['screens']['start']))
+
+# Play the runs in order, skipping those completed before the session was interrupted
+for index, step in enumerate(runs):
+    
+    if not state.is_done(step['label']):
+        # Show the instructions of the phase before its first run
+        if step['intro'] is not None:
+            show_screen(win, cache, timer, screen_file(step['intro']))
+        logger.set_context(run = step['run'])
+        if verifier is not None:
+            verifier.set_context(run = step['run'])
+        run(
+            win, # where to play the experiment
+            stimuli = stim_df, # which images to use
+            exp_phase = step['exp_phase'], # only use the images of the phase
+            categories = categories, # all except objects
+            keys = keys, # which keys to use
+            interval_time = task['interval_time'],
+            feedback_time = task['feedback_time'],
+            response_window = task['response_window'], # trials without a response by then are misses
+            # adaptive choice of the images, in the main runs
+            estimates = estimates if step['exp_phase'] == 'main' else None,
+            block_size = task['adaptive_block_size'],
+            max_target_run = task['max_target_run'], # as in the schedule the blocks come from
+            cache = cache, # reuse the preloaded images
+            profile = profile, # settings measured on this station
+            keyboard = timer.keyboard, # the keyboard of the session
+            logger = logger, # stream the trials to disk
+            verifier = verifier, # check the frames shown, if asked
+            monitor = monitor, # live statistics and alerts
+            # end each practice block once the participant meets the criterion, if there is one
+            criterion = PracticeCriterion(**step['criterion']) if step['criterion'] is not None else None,
+            state = state, run_label = step['label'], # checkpoint each block
+            blocks = schedule_blocks(schedules[step['exp_phase']], stim_df, step['exp_phase'], categories, keys,
+                                     run = step['phase_run']),
+            report = print) # the timing and alerts of each block, for the experimenter
+    
+    # Show the break instructions after the run, unless the rest of the session was already played
+    if step['after'] is not None and not all(state.is_done(later['label']) for later in runs[index + 1:]):
+        show_screen(win, cache, timer, screen_file(step['after']))
 
 # Finish the experiment
-visual.ImageStim(win, fr'instructions/ending_text.png').draw()
-win.flip()
-event.waitKeys()
+if config['screens']['end'] is not None:
+    show_screen(win, cache, timer, screen_file(config['screens']['end']), keyList = None)
+# the last frames are checked before the window goes
+if verifier is not None:
+    verifier.close()
 win.close()
 
 
 ### —————————————— Collect data —————————————— ###
 
-# add some important info to the dataframes
-practice_df['run'] = 0
-main_df1['run'] = 1
-main_df2['run'] = 2
-main_df3['run'] = 3
-# create the main output dataframe
-df = pd.concat([practice_df, main_df1, main_df2, main_df3])
-df['age'] = info['Gender']
-df['gender'] = info['Age']
-df['ID'] = info['ID']
+# make sure every trial is on disk
+logger.close()
+monitor.close()
+if keyboard is not None:
+    keyboard.close()
+# create the main output dataframe from the log, which already holds the run and participant info,
+# keeping only the blocks that were completed (a block interrupted by a crash is played again in full),
+# and score all the trials at once
+df = score_trials(state.keep_completed(read_log(log_path), run_labels))
+# with the time each response key was released, when the keyboard was read directly
+if keyboard is not None:
+    keys_path = fr'{out}_keys.csv'
+    keyboard.save(keys_path)
+    df = add_releases(df, read_keys(keys_path))
+# with whether the frame of each stimulus showed the expected image, when checked
+if verifier is not None:
+    frames_path = fr'{out}_frames.csv'
+    verifier.save(frames_path)
+    df = add_frame_checks(df, read_frame_checks(frames_path))
 
 # Finally export the data
-df.to_csv(fr'{str(datetime.date.today())}_ppt{info["ID"]}.csv') # include the date in the file name
+df.to_csv(fr'{out}.csv') # include the date in the file name
+
+# the final estimates of each image, in adaptive mode
+if estimates is not None:
+    estimates.report().to_csv(fr'{out}_estimates.csv')
+
+# and the frame timing of each block, trials with dropped frames are flagged in the 'timing_ok' column
+frame_summary(df, by = ['run', 'block']).to_csv(fr'{out}_timing.csv')
+session_timing = frame_summary(df, by = []).iloc[0]
+print(f"Session: {session_timing['late_trials']} of {session_timing['trials']} trials with dropped frames, "
+      f"{session_timing['dropped_frames']} frames dropped, mean onset error "
+      f"{session_timing['mean_onset_error_ms']:.2f} ms, {df['timeout'].mean():.1%} of trials timed out")
+if verifier is not None:
+    frames = verifier.summary()
+    print(f"Frames: {frames['checked']} of {frames['frames']} stimulus frames checked, {frames['mismatches']} not "
+          f"showing the expected image, {frames['display_ms']:.3f} ms per trial on the display thread")
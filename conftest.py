@@ -0,0 +1 @@
+# Lets the tests import the 'scripts' package from the root of the repository (python -m pytest)
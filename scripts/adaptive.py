@@ -0,0 +1,175 @@
+# Running estimates of the RT and accuracy of each image, used by 'run' to choose the images of each block
+
+import numpy as np
+import pandas as pd
+from scripts.scoring import image_stems
+from scripts.schedule import limit_target_run
+
+
+class ImageEstimates:
+
+    '''
+    Keeps running estimates of the correct RT and the accuracy of every image, for every category to
+    detect, during the session. Each trial updates them in constant time (Welford's algorithm for the
+    mean and variance of the RTs, counts for the accuracy).
+
+    The uncertainty of the mean RT of an image is its posterior variance under a normal model whose
+    prior is the RT distribution pooled over all the images, worth 'prior_count' trials: images with
+    few correct responses so far, or with variable RTs, are uncertain. 'select' picks the images whose
+    next trial would reduce that uncertainty the most, so that the RT of every image gets estimated
+    with a similar precision in fewer trials.
+
+    Parameters
+    ——————————
+     • images : the names of the images, e.g. 'main_face_26'.
+     • tasks : the categories to detect.
+     • prior_count : weight of the pooled RT distribution in the estimate of each image, in trials.
+    '''
+
+    def __init__(self, images, tasks = ['face', 'scene', 'body'], prior_count = 2.):
+
+        self.images = {image: i for i, image in enumerate(images)}
+        self.tasks = {task: j for j, task in enumerate(tasks)}
+        self.prior_count = prior_count
+        shape = (len(self.images), len(self.tasks))
+        # trials and correct responses, and the mean and sum of squared deviations of the correct RTs
+        self.trials = np.zeros(shape, dtype = int)
+        self.correct = np.zeros(shape, dtype = int)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        # the same over all the images, per task, for the prior
+        self._pooled_n = np.zeros(len(self.tasks), dtype = int)
+        self._pooled_mean = np.zeros(len(self.tasks))
+        self._pooled_m2 = np.zeros(len(self.tasks))
+
+
+    @classmethod
+    def from_trials(cls, df, images, tasks = ['face', 'scene', 'body'], prior_count = 2.):
+
+        '''
+        Rebuilds the estimates from trials already played, e.g. from the log of a resumed session.
+
+        Parameters
+        ——————————
+         • df : the trials, with 'image', 'task', 'rt' and 'acc' columns, and 'timeout' if there
+           was a deadline.
+         • images, tasks, prior_count : see 'ImageEstimates'.
+        '''
+
+        estimates = cls(images, tasks, prior_count)
+        timeouts = df['timeout'].fillna(False).astype(bool) if 'timeout' in df else np.zeros(len(df), dtype = bool)
+        for image, task, rt, acc, timeout in zip(df['image'], df['task'], df['rt'], df['acc'], timeouts):
+            estimates.update(image, task, rt, bool(acc) and not timeout)
+
+        return estimates
+
+
+    def update(self, image, task, rt, correct):
+
+        '''
+        Adds a trial to the estimates. Images or tasks that are not tracked are ignored.
+
+        Parameters
+        ——————————
+         • image : name of the image.
+         • task : the category to detect.
+         • rt : the RT, in seconds.
+         • correct : bool. Whether the response was correct; only correct RTs are used.
+        '''
+
+        i, j = self.images.get(image), self.tasks.get(task)
+        if i is None or j is None:
+            return
+        self.trials[i, j] += 1
+        if not correct or np.isnan(rt):
+            return
+        self.correct[i, j] += 1
+
+        # Welford's update, for the image and for all the images
+        delta = rt - self.mean[i, j]
+        self.mean[i, j] += delta / self.correct[i, j]
+        self.m2[i, j] += delta * (rt - self.mean[i, j])
+        self._pooled_n[j] += 1
+        delta = rt - self._pooled_mean[j]
+        self._pooled_mean[j] += delta / self._pooled_n[j]
+        self._pooled_m2[j] += delta * (rt - self._pooled_mean[j])
+
+
+    def _variance(self):
+        # variance of the RTs of each image, shrunk towards the pooled variance of its task
+        pooled = np.where(self._pooled_n > 1, self._pooled_m2 / np.maximum(self._pooled_n - 1, 1), 0.01)
+        return (self.m2 + self.prior_count * pooled) / (self.correct + self.prior_count)
+
+
+    def rt_uncertainty(self):
+
+        '''
+        Returns the posterior variance of the mean RT of each image, as an (images × tasks) array.
+        '''
+
+        return self._variance() / (self.correct + self.prior_count)
+
+
+    def select(self, files, task, n, max_target_run = None):
+
+        '''
+        Chooses the images of a block: the 'n' images whose next trial would reduce the uncertainty of
+        their mean RT the most. Each category of image keeps its share of the block, so the proportion
+        of targets stays the same as with all the images.
+
+        Parameters
+        ——————————
+         • files : the images the block would show, in their order.
+         • task : the category to detect during the block.
+         • n : int. Number of images to keep.
+         • max_target_run : int. Maximum number of consecutive targets. Leaving images out can join
+           runs of targets, which are then split by moving targets later. None for no limit.
+
+         Returns
+        ——————————
+         • files : the images kept, in the same order but for the targets moved.
+        '''
+
+        files = list(files)
+        stems = image_stems(files)
+        j = self.tasks[task]
+        rows = np.array([self.images.get(stem, -1) for stem in stems])
+
+        # how much one more trial would shrink the posterior variance of each image; images not tracked
+        # are always kept
+        count = self.correct[rows, j] + self.prior_count
+        gain = np.where(rows >= 0, self._variance()[rows, j] / (count * (count + 1)), np.inf)
+
+        # the best images of each category, in proportion to the category
+        categories = stems.str.split('_').str[1].to_numpy()
+        keep = np.zeros(len(files), dtype = bool)
+        names, counts = np.unique(categories, return_counts = True)
+        quotas = np.floor(counts * n / len(files)).astype(int)
+        # the places left by the rounding go to the largest categories
+        quotas[np.argsort(-counts)[:n - quotas.sum()]] += 1
+        for name, quota in zip(names, quotas):
+            candidates = np.flatnonzero(categories == name)
+            keep[candidates[np.argsort(-gain[candidates], kind = 'stable')[:quota]]] = True
+
+        kept = np.flatnonzero(keep)
+        if max_target_run is not None:
+            kept = kept[limit_target_run(categories[kept] == task, max_target_run)]
+
+        return [files[i] for i in kept]
+
+
+    def report(self):
+
+        '''
+        Returns the estimates of every image and task: trials, accuracy, mean correct RT and its
+        standard error.
+        '''
+
+        index = pd.MultiIndex.from_product([list(self.images), list(self.tasks)], names = ['image', 'task'])
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return pd.DataFrame({
+                'trials': self.trials.ravel(),
+                'accuracy': (self.correct / self.trials).ravel(),
+                'mean_rt': np.where(self.correct > 0, self.mean, np.nan).ravel(),
+                'rt_sem': np.sqrt(self.rt_uncertainty()).ravel()
+            }, index = index)
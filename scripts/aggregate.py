@@ -0,0 +1,240 @@
+# Aggregation of the session files of a cohort into one dataset, and summaries over the cohort
+#
+#     python -m scripts.aggregate ingest ./data --dataset ./cohort
+#     python -m scripts.aggregate summary --dataset ./cohort
+#
+# Needs pyarrow for the Parquet files (pip install pyarrow).
+
+import argparse, json, os, re
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+
+# columns that are the same on every row of a session, kept once per session in the participants table
+DEMOGRAPHICS = ['ID', 'age', 'gender']
+
+# names of the data files of the sessions: '<date>_ppt<ID>', and '_<station>' for the sessions of the
+# station coordinator, station names being made of letters, digits and dashes
+SESSION_FILE = re.compile(r'^\d{4}-\d{2}-\d{2}_ppt[^_]+(?:_[A-Za-z0-9-]+)?\.csv$')
+# the other CSV files a session writes next to its data
+SIDE_FILE = re.compile(r'_(log|timing|keys|estimates|frames)\.csv$')
+
+
+def session_files(folder):
+
+    '''
+    Lists the data files of the sessions in a folder, e.g. '2023-02-15_ppt12.csv'. Every session keeps
+    a '<session>_session.json' next to its data file, which tells them apart from the other files it
+    writes, '<session>_<what>.csv', whatever they hold. Files of sessions run before there was one are
+    told apart by the names of the known side files.
+    '''
+
+    names = sorted(os.listdir(folder))
+    # the sessions that keep a session file
+    kept = {name[:-len('_session.json')] for name in names if name.endswith('_session.json')}
+    sessions = []
+    for name in names:
+        stem = os.path.splitext(name)[0]
+        if not SESSION_FILE.match(name):
+            continue
+        if stem in kept:
+            sessions.append(name)
+        # else a session without a session file, unless it's a known side file or extends the name of a
+        # session that keeps one
+        elif not SIDE_FILE.search(name) and not any(stem.startswith(session + '_') for session in kept):
+            sessions.append(name)
+
+    return [os.path.join(folder, name) for name in sessions]
+
+
+
+def _read_session(path):
+    # the trials of a session, keyed by the name of its file, and its demographics
+    df = pd.read_csv(path, index_col = 0, dtype = {'ID': str, 'response': str, 'late_cause': str})
+    session = os.path.splitext(os.path.basename(path))[0]
+    demographics = {'session': session, 'n_trials': len(df)}
+    demographics.update({column: df[column].iloc[0] if len(df) else None for column in DEMOGRAPHICS if column in df})
+    df = df.drop(columns = [column for column in DEMOGRAPHICS if column in df])
+    df.insert(0, 'session', session)
+    return df, demographics
+
+
+
+def _pyarrow():
+    # the Parquet engine, with a clear message where it is missing rather than an error deep in pandas
+    try:
+        import pyarrow, pyarrow.dataset
+    except ImportError:
+        raise ImportError('the cohort dataset is stored in Parquet files, which needs pyarrow: pip install pyarrow') from None
+    return pyarrow
+
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+
+def ingest(files, dataset = r'./cohort', workers = None):
+
+    '''
+    Adds session files to the dataset of the cohort. The files are read in parallel on several processes
+    and written in one go: the trials to a Parquet dataset partitioned by run and task, with a 'session'
+    column instead of the demographics, which go to a participants table with one row per session.
+
+    Ingesting is incremental: files already in the dataset are skipped, so it can be run again after
+    every batch of sessions. Files changed since they were ingested are reported but not read again.
+
+    Parameters
+    ——————————
+     • files : list of the session files, e.g. from 'session_files'.
+     • dataset : folder of the dataset, created if needed.
+     • workers : int. Number of processes reading the files. Defaults to the number of CPUs.
+
+     Returns
+    ——————————
+     • n_new : number of sessions added.
+    '''
+
+    _pyarrow()
+    os.makedirs(dataset, exist_ok = True)
+    index_path = os.path.join(dataset, 'ingested.json')
+    ingested = {}
+    if os.path.exists(index_path):
+        with open(index_path) as file:
+            ingested = json.load(file)
+
+    # only the files not ingested yet
+    names = {path: os.path.basename(path) for path in files}
+    changed = [name for path, name in names.items() if name in ingested and ingested[name] != _file_stat(path)]
+    if changed:
+        print(f'Changed since they were ingested, not read again: {changed}')
+    new = [path for path, name in names.items() if name not in ingested]
+    if not new:
+        return 0
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        sessions = list(pool.map(_read_session, new, chunksize = 8))
+
+    # all the trials at once, each run and task in its own folder
+    trials = pd.concat([df for df, _ in sessions], ignore_index = True)
+    trials.to_parquet(os.path.join(dataset, 'trials'), partition_cols = ['run', 'task'], index = False)
+
+    # one row per session for the demographics
+    participants = pd.DataFrame([demographics for _, demographics in sessions])
+    participants_path = os.path.join(dataset, 'participants.parquet')
+    if os.path.exists(participants_path):
+        participants = pd.concat([pd.read_parquet(participants_path), participants], ignore_index = True)
+    participants.to_parquet(participants_path, index = False)
+
+    # remember the files, last so that a crash while writing doesn't skip them next time
+    ingested.update({names[path]: _file_stat(path) for path in new})
+    with open(index_path, 'w') as file:
+        json.dump(ingested, file)
+
+    return len(new)
+
+
+
+def load_trials(dataset = r'./cohort', columns = None, filters = None, demographics = False):
+
+    '''
+    Reads the trials of the cohort. Batches ingested at different times may not have the same columns,
+    e.g. sessions from before a column was added: all the columns of all the batches are read, missing
+    ones as NA.
+
+    Parameters
+    ——————————
+     • dataset : folder of the dataset.
+     • columns : list of the columns to read. None for all of them.
+     • filters : Parquet filters, e.g. [('task', '==', 'face')] to read only the partitions needed.
+     • demographics : bool. Whether to add the demographics of each session.
+
+     Returns
+    ——————————
+     • trials : dataframe, one row per trial.
+    '''
+
+    pyarrow = _pyarrow()
+    # the columns of every batch, not only those of the first file found
+    path = os.path.join(dataset, 'trials')
+    source = pyarrow.dataset.dataset(path, format = 'parquet', partitioning = 'hive')
+    schema = pyarrow.unify_schemas([fragment.physical_schema for fragment in source.get_fragments()] + [source.schema],
+                                   promote_options = 'permissive')
+    trials = pd.read_parquet(path, columns = columns, filters = filters, schema = schema)
+    # partition columns are read back as categories
+    for column in ['run', 'task']:
+        if column in trials and isinstance(trials[column].dtype, pd.CategoricalDtype):
+            trials[column] = trials[column].astype(int if column == 'run' else str)
+    if demographics:
+        participants = pd.read_parquet(os.path.join(dataset, 'participants.parquet'))
+        trials = trials.merge(participants, on = 'session', how = 'left')
+
+    return trials
+
+
+
+def _summarise(trials, by):
+    # accuracy and timeouts over all the trials, RTs over the correct responses only
+    correct = trials['acc'] & ~trials['timeout']
+    rt = trials['rt'].where(correct)
+    grouped = trials.assign(correct_rt = rt).groupby(by)
+    return grouped.agg(
+        trials = ('acc', 'size'),
+        accuracy = ('acc', 'mean'),
+        timeout_rate = ('timeout', 'mean'),
+        mean_rt = ('correct_rt', 'mean'),
+        median_rt = ('correct_rt', 'median'),
+        sd_rt = ('correct_rt', 'std'))
+
+
+
+def summaries(dataset = r'./cohort', exp_phase = 'main'):
+
+    '''
+    Summarises the RTs and accuracy over the whole cohort, per participant, per category to detect and
+    per image, each in one grouped pass. Only the columns needed are read.
+
+    Parameters
+    ——————————
+     • dataset : folder of the dataset.
+     • exp_phase : phase of the trials to summarise, None for all of them.
+
+     Returns
+    ——————————
+     • summaries : dictionary of dataframes, 'participant', 'category' and 'image'.
+    '''
+
+    columns = ['session', 'task', 'image', 'category', 'exp_phase', 'rt', 'acc', 'timeout']
+    trials = load_trials(dataset, columns = columns)
+    if exp_phase is not None:
+        trials = trials.loc[trials['exp_phase'] == exp_phase]
+    # sessions from before the response deadline have no timeouts
+    trials = trials.assign(timeout = trials['timeout'].fillna(False).astype(bool), acc = trials['acc'].astype(bool))
+
+    return {
+        'participant': _summarise(trials, ['session']),
+        'category': _summarise(trials, ['task']),
+        'image': _summarise(trials, ['image', 'category'])
+    }
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Aggregate the session files of a cohort.')
+    parser.add_argument('command', choices = ['ingest', 'summary'])
+    parser.add_argument('folder', nargs = '?', default = r'.', help = 'folder of the session files to ingest')
+    parser.add_argument('--dataset', default = r'./cohort', help = 'folder of the dataset')
+    parser.add_argument('--workers', type = int, help = 'number of processes reading the files')
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        n_new = ingest(session_files(args.folder), args.dataset, args.workers)
+        print(f'{n_new} new sessions added to {args.dataset}')
+    else:
+        for name, summary in summaries(args.dataset).items():
+            path = os.path.join(args.dataset, f'summary_{name}.csv')
+            summary.to_csv(path)
+            print(f'Summary per {name} saved in {path} ({len(summary)} rows)')
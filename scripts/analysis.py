@@ -0,0 +1,223 @@
+# Per-image analysis of the RTs against the ANN predictions and fMRI responses of Ratan Murty et al. (2021)
+#
+#     python -m scripts.analysis source_data.csv --dataset ./cohort --boot 10000
+
+import argparse, os, re, warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+# the category to detect whose RTs go with each region
+REGIONS = {'FFA': 'face', 'EBA': 'body', 'PPA': 'scene'}
+
+MEASURES = ['median_rt', 'accuracy', 'inverse_efficiency']
+
+
+def load_source_data(path, stimuli, image_column = None, sheet_name = 0):
+
+    '''
+    Loads a table of the published source data (ANN predictions or fMRI responses, one row per image)
+    and indexes it by the names of our stimuli, 'main_<category>_<number>'.
+
+    Parameters
+    ——————————
+     • path : path of the table, CSV or Excel.
+     • stimuli : the stimuli, from the stimulus manifest; the images are matched on their number.
+     • image_column : column of the table holding the number of the image. If None, the rows are taken
+       to be in the order of the image numbers, starting at 1.
+     • sheet_name : sheet to read from an Excel file.
+
+     Returns
+    ——————————
+     • source : the numeric columns of the table, indexed by image name.
+    '''
+
+    if os.path.splitext(path)[1] in ('.xls', '.xlsx'):
+        source = pd.read_excel(path, sheet_name = sheet_name)
+    else:
+        source = pd.read_csv(path)
+
+    numbers = source[image_column].astype(int) if image_column is not None else np.arange(1, len(source) + 1)
+    main = stimuli.loc[stimuli['exp_phase'] == 'main']
+    names = pd.Series(('main_' + main['stim_cat'] + '_' + main['stim_nb'].astype(str)).to_numpy(),
+                      index = main['stim_nb'].astype(int).to_numpy())
+    source.index = pd.Index(names.reindex(numbers).to_numpy(), name = 'image')
+    if source.index.isna().any():
+        raise ValueError(f'{int(source.index.isna().sum())} rows of {path} match no stimulus')
+
+    return source.drop(columns = [image_column] if image_column is not None else []).select_dtypes('number')
+
+
+
+def participant_matrices(trials, task, images):
+
+    '''
+    Returns the median correct RT and the accuracy of every participant for every image, in blocks
+    where 'task' was the category to detect, as two (participants × images) arrays. NaN where a
+    participant has no correct response to an image.
+
+    Parameters
+    ——————————
+     • trials : the trials of the cohort, with 'session', 'image', 'task', 'rt', 'acc' and 'timeout'.
+     • task : the category to detect.
+     • images : the names of the images, in the order of the columns.
+    '''
+
+    trials = trials.loc[trials['task'] == task]
+    correct = trials['acc'].astype(bool) & ~trials['timeout'].fillna(False).astype(bool)
+    grouped = trials.assign(correct_rt = trials['rt'].where(correct), acc = trials['acc'].astype(float)) \
+                    .groupby(['session', 'image'])
+    rt = grouped['correct_rt'].median().unstack('image').reindex(columns = images)
+    acc = grouped['acc'].mean().unstack('image').reindex(columns = images)
+
+    return rt.to_numpy(), acc.to_numpy()
+
+
+
+def _image_measures(rt, acc):
+    # per-image measures across participants, the second to last axis; NaN for images no participant
+    # got right
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median_rt = np.nanmedian(rt, axis = -2)
+        accuracy = np.nanmean(acc, axis = -2)
+    return {'median_rt': median_rt, 'accuracy': accuracy, 'inverse_efficiency': median_rt / accuracy}
+
+
+
+def image_measures(trials, task, images):
+
+    '''
+    Returns the median RT (median over participants of their median correct RT), the accuracy and the
+    inverse efficiency (median RT / accuracy) of each image across participants, in blocks where 'task'
+    was the category to detect.
+    '''
+
+    return pd.DataFrame(_image_measures(*participant_matrices(trials, task, images)), index = images)
+
+
+
+def _correlate(x, y, method):
+    # correlation of each row of x with the same row of y, leaving out the NaN pairs
+    x, y = np.atleast_2d(x).astype(float), np.atleast_2d(y).astype(float)
+    missing = np.isnan(x) | np.isnan(y)
+    x, y = np.where(missing, np.nan, x), np.where(missing, np.nan, y)
+    if method == 'spearman':
+        # average ranks of ties, NaN kept
+        x = pd.DataFrame(x).rank(axis = 1).to_numpy()
+        y = pd.DataFrame(y).rank(axis = 1).to_numpy()
+    x = x - np.nanmean(x, axis = 1, keepdims = True)
+    y = y - np.nanmean(y, axis = 1, keepdims = True)
+    return np.nansum(x * y, axis = 1) / np.sqrt(np.nansum(x**2, axis = 1) * np.nansum(y**2, axis = 1))
+
+
+
+def _bootstrap_chunk(rt, acc, source, n_boot, seed, method, resample):
+    # correlations of 'n_boot' resamples, as an array of (resamples × measures × source columns)
+    rng = np.random.default_rng(seed)
+    n_participants, n_images = rt.shape
+    participants = rng.integers(n_participants, size = (n_boot, n_participants)) if 'participants' in resample \
+        else np.broadcast_to(np.arange(n_participants), (n_boot, n_participants))
+    images = rng.integers(n_images, size = (n_boot, n_images)) if 'images' in resample \
+        else np.broadcast_to(np.arange(n_images), (n_boot, n_images))
+
+    # (resamples × participants × images), all the resamples at once
+    rows, columns = participants[:, :, None], images[:, None, :]
+    measures = _image_measures(rt[rows, columns], acc[rows, columns])
+    # (resamples × images × source columns)
+    values = source[images]
+
+    return np.stack([np.stack([_correlate(measures[measure], values[:, :, k], method)
+                               for k in range(source.shape[1])], axis = -1) for measure in MEASURES], axis = 1)
+
+
+
+def bootstrap_correlations(trials, source, regions = None, n_boot = 10000, method = 'spearman',
+                           resample = ('participants', 'images'), seed = None, workers = None, chunk = 250):
+
+    '''
+    Correlates the per-image RT measures with the per-image predictions or responses of each region,
+    with bootstrap confidence intervals. Each resample draws participants and images with replacement
+    and recomputes the image measures and correlations, all in array operations; the resamples are
+    split in chunks run in parallel over the cores.
+
+    Parameters
+    ——————————
+     • trials : the trials of the cohort, e.g. from 'aggregate.load_trials'.
+     • source : the source data, from 'load_source_data'.
+     • regions : dictionary mapping the columns of the source data to the category to detect they go
+       with. Defaults to the columns whose name contains FFA, EBA or PPA.
+     • n_boot : int. Number of resamples.
+     • method : 'spearman' or 'pearson'.
+     • resample : what to draw with replacement, 'participants' and/or 'images'.
+     • seed : int. Seed of the resamples.
+     • workers : int. Number of processes. Defaults to the number of CPUs.
+     • chunk : int. Number of resamples per task sent to a process.
+
+     Returns
+    ——————————
+     • results : one row per source column and measure, with the correlation over all the data, the
+       95% confidence interval and the number of images.
+    '''
+
+    if regions is None:
+        regions = {column: task for column in source.columns for region, task in REGIONS.items()
+                   if re.search(region, str(column), re.IGNORECASE)}
+    if not regions:
+        raise ValueError('no column of the source data matches a region')
+
+    # images that were both shown and in the source data
+    images = source.index.intersection(pd.Index(trials['image'].unique())).tolist()
+    seeds = np.random.SeedSequence(seed).spawn(len(set(regions.values())) * (n_boot // chunk + 1))
+
+    results = []
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        for task in sorted(set(regions.values())):
+            columns = [column for column, column_task in regions.items() if column_task == task]
+            values = source.loc[images, columns].to_numpy(dtype = float)
+            rt, acc = participant_matrices(trials, task, images)
+
+            # the estimate over all the data
+            measures = _image_measures(rt, acc)
+            estimates = {(measure, column): _correlate(measures[measure], values[:, k], method)[0]
+                         for measure in MEASURES for k, column in enumerate(columns)}
+
+            # the resamples, in chunks
+            sizes = [chunk] * (n_boot // chunk) + ([n_boot % chunk] if n_boot % chunk else [])
+            futures = [pool.submit(_bootstrap_chunk, rt, acc, values, size, seeds.pop(), method, resample)
+                       for size in sizes]
+            boot = np.concatenate([future.result() for future in futures])
+
+            for m, measure in enumerate(MEASURES):
+                for k, column in enumerate(columns):
+                    low, high = np.nanpercentile(boot[:, m, k], [2.5, 97.5])
+                    results.append({'source': column, 'task': task, 'measure': measure,
+                                    'r': estimates[(measure, column)], 'ci_low': low, 'ci_high': high,
+                                    'n_images': len(images), 'n_participants': rt.shape[0]})
+
+    return pd.DataFrame(results)
+
+
+
+if __name__ == '__main__':
+
+    from scripts.aggregate import load_trials
+    from scripts.manifest import load_manifest
+
+    parser = argparse.ArgumentParser(description = 'Correlate the per-image RTs with the ANN/fMRI source data.')
+    parser.add_argument('source', help = 'table of the source data, one row per image')
+    parser.add_argument('--image-column', help = 'column holding the image numbers, rows in image order if not given')
+    parser.add_argument('--dataset', default = r'./cohort', help = 'folder of the cohort dataset')
+    parser.add_argument('--boot', type = int, default = 10000, help = 'number of bootstrap resamples')
+    parser.add_argument('--method', default = 'spearman', choices = ['spearman', 'pearson'])
+    parser.add_argument('--seed', type = int, help = 'seed of the resamples')
+    parser.add_argument('--out', default = r'./image_correlations.csv', help = 'where to save the results')
+    args = parser.parse_args()
+
+    source = load_source_data(args.source, load_manifest(r'./stimuli', verify = False), args.image_column)
+    trials = load_trials(args.dataset, columns = ['session', 'image', 'task', 'exp_phase', 'rt', 'acc', 'timeout'],
+                         filters = [('exp_phase', '==', 'main')])
+    results = bootstrap_correlations(trials, source, n_boot = args.boot, method = args.method, seed = args.seed)
+    results.to_csv(args.out, index = False)
+    print(results.to_string(index = False))
@@ -0,0 +1,123 @@
+# Benchmarks of the experiment loop, run headless with a simulated participant
+#
+#     python -m scripts.bench --runs 3 --phase main --profile
+
+import argparse, cProfile, os, pstats, tempfile, time, tracemalloc
+import pandas as pd
+from scripts.funcs import run, load_stimuli, preload_stimuli
+from scripts.cache import StimulusCache
+from scripts.screens import ScreenRenderer, task_screens
+from scripts.logger import TrialLogger
+from scripts.simulated import SimulatedWindow
+
+
+# files whose functions count as loading the stimuli, or as book-keeping, when called from the trial loop
+LOADING = ['cache.py', 'prefetch.py']
+BOOKKEEPING = ['scoring.py', 'logger.py', 'session.py', 'pandas']
+
+
+def _profile_time(stats, files):
+    # time spent in calls made by 'run' and 'run_block' to functions of the given files, including
+    # what they call in turn; only direct calls are counted so nothing is counted twice
+    return sum(caller_stat[3] for (file, _, _), stat in stats.stats.items() if any(part in file for part in files)
+               for (caller_file, _, _), caller_stat in stat[4].items() if caller_file.endswith('funcs.py'))
+
+
+
+def benchmark(stimuli, exp_phase = 'main', n_runs = 3, prefetch = 0, log = True, profile = False, seed = 0):
+
+    '''
+    Plays several runs in a row on a SimulatedWindow, with a SyntheticResponder, as fast as the machine
+    allows. Since all the waiting is simulated, the wall time is the overhead of the code itself.
+
+    Parameters
+    ——————————
+     • stimuli : a dataframe holding the images to present.
+     • exp_phase : either practice or main.
+     • n_runs : int. Number of runs to play.
+     • prefetch : int. Prefetch depth given to 'run'. 0 preloads all the images instead.
+     • log : bool. Whether to stream the trials to a (temporary) log file.
+     • profile : bool. Whether to split the time between stimulus loading and book-keeping. Profiling
+       slows the code down, so the overheads are then overestimated.
+     • seed : int. Seed of the simulated participant.
+
+     Returns
+    ——————————
+     • results : dataframe with one row per run.
+    '''
+
+    win = SimulatedWindow(seed = seed)
+    cache = StimulusCache(win, screens = ScreenRenderer(win.size, task_screens()))
+    log_dir = tempfile.TemporaryDirectory()
+    logger = TrialLogger(os.path.join(log_dir.name, 'bench_log.csv')) if log else None
+
+    tracemalloc.start()
+    results = []
+
+    # preloading is timed apart from the runs
+    start = time.perf_counter()
+    if not prefetch:
+        preload_stimuli(cache, stimuli.loc[stimuli['exp_phase']==exp_phase])
+    preload_time = time.perf_counter() - start
+
+    for run_nb in range(1, n_runs + 1):
+
+        profiler = cProfile.Profile() if profile else None
+        sim_start = win.now
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+
+        df = run(win, stimuli, exp_phase, cache = cache, prefetch = prefetch, logger = logger)
+
+        if profiler is not None:
+            profiler.disable()
+        wall_time = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+
+        result = {
+            'run': run_nb,
+            'n_trials': len(df),
+            'wall_time': wall_time,
+            'overhead_per_trial_ms': 1000 * wall_time / len(df),
+            'simulated_time': win.now - sim_start,
+            'speedup': (win.now - sim_start) / wall_time,
+            'preload_time': preload_time if run_nb == 1 else 0.,
+            'prefetch_wait': df['prefetch_wait'].sum(),
+            'memory_mb': current / 1024**2,
+            'peak_memory_mb': peak / 1024**2
+        }
+        if profiler is not None:
+            stats = pstats.Stats(profiler)
+            result['loading_time'] = _profile_time(stats, LOADING)
+            result['bookkeeping_time'] = _profile_time(stats, BOOKKEEPING)
+        results.append(result)
+
+    tracemalloc.stop()
+    if logger is not None:
+        logger.close()
+    log_dir.cleanup()
+
+    results = pd.DataFrame(results)
+    # memory growth across runs, from the end of the first one
+    results['memory_growth_mb'] = results['memory_mb'] - results['memory_mb'].iloc[0]
+
+    return results
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the experiment loop with a simulated participant.')
+    parser.add_argument('--phase', default = 'main', help = 'practice or main')
+    parser.add_argument('--runs', type = int, default = 3, help = 'number of runs to play')
+    parser.add_argument('--prefetch', type = int, default = 0, help = 'prefetch depth, 0 to preload')
+    parser.add_argument('--no-log', action = 'store_true', help = "don't stream the trials to a log")
+    parser.add_argument('--profile', action = 'store_true', help = 'split loading and book-keeping times')
+    parser.add_argument('--stimuli', default = r'./stimuli/*.png', help = 'glob pattern of the stimuli')
+    args = parser.parse_args()
+
+    results = benchmark(load_stimuli(args.stimuli), exp_phase = args.phase, n_runs = args.runs,
+                        prefetch = args.prefetch, log = not args.no_log, profile = args.profile)
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.precision', 3):
+        print(results.to_string(index = False))
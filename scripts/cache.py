@@ -0,0 +1,181 @@
+# Stimulus cache used by 'run' and the main experiment script
+
+import time
+from collections import OrderedDict
+from PIL import Image
+from scripts.simulated import SimulatedImageStim
+
+
+class StimulusCache:
+
+    '''
+    Keeps decoded and uploaded ImageStims in memory so that each image file is read, decoded and sent to
+    the GPU only once per session. The same stimulus object is handed back on every later use. When
+    the estimated texture memory goes above 'max_bytes', the least recently used stimuli are dropped.
+
+    Parameters
+    ——————————
+     • win : the psychopy window (or a SimulatedWindow) the stimuli are drawn in.
+     • max_bytes : int. Upper bound on the estimated texture memory held by the cache. Defaults to 512 MB.
+     • sizes : dictionary mapping files to their (width, height) in pixels, e.g. from the stimulus
+       manifest. The size of other files is read from their header.
+     • variants : a VariantStore holding the images pre-rendered for this window. Images found in it
+       are uploaded without being decoded or resampled.
+     • screens : a ScreenRenderer generating the text screens of the task, e.g. the question screens.
+       The screens it knows are taken from it rather than from their files.
+    '''
+
+    def __init__(self, win, max_bytes = 512 * 1024**2, sizes = None, variants = None, screens = None):
+
+        self.win = win
+        self.max_bytes = max_bytes
+        self.sizes = dict(sizes or {})
+        self.variants = variants
+        self.screens = screens
+        # (file, size) -> (stimulus, estimated bytes), oldest use first
+        self._stims = OrderedDict()
+        # book-keeping for the report
+        self.resident_bytes = 0
+        self.load_time = 0.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __len__(self):
+        return len(self._stims)
+
+
+    def __contains__(self, key):
+        return key in self._stims
+
+
+    def _estimate_bytes(self, file, image):
+        # an image already in memory, e.g. pre-rendered at its display size
+        if image is not None:
+            width, height = image.size
+        elif file in self.sizes:
+            width, height = self.sizes[file]
+        else:
+            # only the header is read here, the pixels are decoded by psychopy
+            with Image.open(file) as img:
+                width, height = img.size
+        # textures are uploaded as RGBA, 1 byte per channel
+        return width * height * 4
+
+
+    def _make_stim(self, file, size, image):
+        # nothing to upload on a simulated window
+        if getattr(self.win, 'simulated', False):
+            return SimulatedImageStim(self.win, image = file, size = size)
+        # the texture is decoded (unless it already was) and uploaded when the stimulus is created
+        from psychopy import visual
+        return visual.ImageStim(self.win, image = file if image is None else image, size = size)
+
+
+    def _evict(self):
+        # drop the least recently used stimuli until we are back under the limit
+        while self.resident_bytes > self.max_bytes and len(self._stims) > 1:
+            _, (_, nbytes) = self._stims.popitem(last = False)
+            self.resident_bytes -= nbytes
+            self.evictions += 1
+
+
+    def get(self, file, size = None, image = None):
+
+        '''
+        Returns the stimulus for an image file, creating it on the first request.
+
+        Parameters
+        ——————————
+         • file : path to the image.
+         • size : display size of the image, None keeps the size of the file.
+         • image : the image already decoded, e.g. by a Prefetcher. If None, the file is decoded here.
+        '''
+
+        key = (str(file), None if size is None else tuple(size))
+
+        # cached: mark as most recently used and return it
+        if key in self._stims:
+            self._stims.move_to_end(key)
+            self.hits += 1
+            return self._stims[key][0]
+
+        # not cached: decode, upload and store it
+        self.misses += 1
+        start = time.perf_counter()
+        # take the generated screen, or the pre-rendered image, if there is one
+        if image is None and self.screens is not None and key[0] in self.screens:
+            image = self.screens.get(key[0])
+        elif image is None and self.variants is not None and key[0] in self.variants:
+            image = self.variants.get(key[0])
+        stim = self._make_stim(key[0], size, image)
+        nbytes = self._estimate_bytes(key[0], image)
+        self.load_time += time.perf_counter() - start
+        self._stims[key] = (stim, nbytes)
+        self.resident_bytes += nbytes
+        self._evict()
+
+        return stim
+
+
+    def preload(self, files, size = None, images = None):
+
+        '''
+        Creates the stimuli for all the given files at once, typically at the start of the session.
+        Returns the time spent loading, in seconds.
+
+        Parameters
+        ——————————
+         • files : iterable of paths to the images.
+         • size : display size of the images, None keeps the size of the files.
+         • images : dictionary mapping files to their image already decoded, e.g. by 'decode_images'.
+           The other files are decoded here.
+        '''
+
+        images = images or {}
+        start = time.perf_counter()
+        for file in files:
+            self.get(file, size, images.get(file))
+
+        return time.perf_counter() - start
+
+
+    def warm_up(self, frames = 3):
+
+        '''
+        Draws every cached stimulus once into the back buffer, which is cleared without being shown,
+        then flips a few blank frames. The driver finishes uploading the textures and compiling the
+        shaders here rather than on the first screens of the session. Returns the time it took, in
+        seconds.
+
+        Parameters
+        ——————————
+         • frames : int. Number of blank frames flipped after the drawing.
+        '''
+
+        start = time.perf_counter()
+        for stim, _ in self._stims.values():
+            stim.draw()
+        self.win.clearBuffer()
+        for _ in range(frames):
+            self.win.flip()
+
+        return time.perf_counter() - start
+
+
+    def report(self):
+
+        '''
+        Returns a dictionary summarising the load time and memory use of the cache.
+        '''
+
+        return {
+            'n_stimuli': len(self._stims),
+            'resident_mb': self.resident_bytes / 1024**2,
+            'max_mb': self.max_bytes / 1024**2,
+            'load_time': self.load_time,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
@@ -0,0 +1,363 @@
+# Calibration of a station: refresh rate, keyboard latency and stimulus read throughput, saved as a
+# profile that 'run' and the main experiment script take their settings from
+#
+#     python -m scripts.calibration
+#     python -m scripts.calibration --null    (headless, on a simulated display and participant)
+
+import argparse, datetime, io, json, math, os, re, socket, time
+import numpy as np
+from PIL import Image
+
+
+# folder of the profiles, one per station
+PROFILE_FOLDER = r'./calibration'
+
+
+def station_name():
+
+    '''
+    Returns the name of this station, its host name, as used for its profile.
+    '''
+
+    return re.sub(r'[^A-Za-z0-9-]', '-', socket.gethostname())
+
+
+
+def profile_path(station = None, folder = PROFILE_FOLDER):
+
+    '''
+    Returns the path of the profile of a station, this one by default.
+    '''
+
+    return os.path.join(folder, f'{station or station_name()}.json')
+
+
+
+def measure_display(win, n_frames = 300):
+
+    '''
+    Flips blank frames as fast as the display allows and measures the time between them.
+
+    Parameters
+    ——————————
+     • win : the psychopy window (or a SimulatedWindow) to measure.
+     • n_frames : int. Number of frames to flip.
+
+     Returns
+    ——————————
+     • display : dictionary with the 'refresh_rate' in Hz, the 'frame_period' in seconds (the median
+       time between two flips), the standard deviation and maximum of that time in ms, and the number
+       of frames dropped during the measure.
+    '''
+
+    # the first flip only syncs us to the display
+    win.flip()
+    flip_times = np.array([win.flip() for _ in range(n_frames)])
+    intervals = np.diff(flip_times)
+    period = float(np.median(intervals))
+
+    return {
+        'refresh_rate': 1. / period,
+        'frame_period': period,
+        'frame_jitter_ms': 1000 * float(intervals.std()),
+        'max_interval_ms': 1000 * float(intervals.max()),
+        'dropped_frames': int(np.maximum(np.round(intervals / period) - 1, 0).sum()),
+        'n_frames': n_frames
+    }
+
+
+
+def measure_keyboard(win, keyboard = None, n_presses = 10):
+
+    '''
+    Asks for a few presses of the space bar and measures how long after going down each press is read,
+    on the clock the responses are timed with.
+
+    Parameters
+    ——————————
+     • win : the psychopy window (or a SimulatedWindow) the instructions are shown in.
+     • keyboard : the keyboard of the session, e.g. an AsyncKeyboard. Defaults to a psychopy Keyboard,
+       or to the simulated keyboard of a SimulatedWindow.
+     • n_presses : int. Number of presses to measure.
+
+     Returns
+    ——————————
+     • keyboard : dictionary with the 'backend' the keys were read with, and the median and maximum
+       latency in ms.
+    '''
+
+    # imported here so that loading a profile doesn't import psychopy
+    from scripts.timing import TrialTimer
+    from scripts.keyboard import AsyncKeyboard
+
+    timer = TrialTimer(win, keyboard)
+    simulated = getattr(win, 'simulated', False)
+    latencies = []
+    for press in range(n_presses):
+        if not simulated:
+            from psychopy import visual
+            visual.TextStim(win, text = f'Press the space bar ({n_presses - press} left)').draw()
+        win.flip()
+        timer.keyboard.clearEvents()
+        # from the key going down to the press being read, not to its release, which the psychopy
+        # Keyboard would wait for by default
+        key = timer.keyboard.waitKeys(keyList = ['space'], waitRelease = False)[0]
+        latencies.append(timer.getTime() - key.tDown)
+    latencies = np.array(latencies)
+
+    if simulated:
+        backend = 'simulated'
+    else:
+        backend = 'evdev' if isinstance(timer.keyboard, AsyncKeyboard) else 'psychopy'
+
+    return {
+        'backend': backend,
+        'latency_ms': 1000 * float(np.median(latencies)),
+        'latency_max_ms': 1000 * float(latencies.max()),
+        'n_presses': n_presses
+    }
+
+
+
+def measure_disk(files):
+
+    '''
+    Reads and decodes image files one after the other, timing the reading and the decoding apart. Files
+    already in the page cache of the system are read faster, so the first calibration after the station
+    started is the most pessimistic.
+
+    Parameters
+    ——————————
+     • files : list of paths to the images, e.g. every stimulus and screen of the session.
+
+     Returns
+    ——————————
+     • disk : dictionary with the read throughput in MB/s, the median and maximum decoding time of an
+       image in ms, and the texture memory all the images take once uploaded, in MB.
+    '''
+
+    read_time, n_bytes, texture_bytes, decode_times = 0., 0, 0, []
+    for file in files:
+        start = time.perf_counter()
+        with open(file, 'rb') as stream:
+            content = stream.read()
+        read = time.perf_counter()
+        with Image.open(io.BytesIO(content)) as img:
+            img.load()
+            img.convert('RGB')
+            width, height = img.size
+        decode_times.append(time.perf_counter() - read)
+        read_time += read - start
+        n_bytes += len(content)
+        # textures are uploaded as RGBA, 1 byte per channel
+        texture_bytes += width * height * 4
+
+    return {
+        'read_mb_s': n_bytes / 1024**2 / read_time if read_time > 0 else float('inf'),
+        'decode_ms': 1000 * float(np.median(decode_times)),
+        'decode_max_ms': 1000 * float(np.max(decode_times)),
+        'texture_mb': texture_bytes / 1024**2,
+        'n_images': len(files)
+    }
+
+
+
+def _physical_memory():
+    # the memory of the machine in bytes, None where it can't be read (e.g. on Windows)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, AttributeError, OSError):
+        return None
+
+
+
+def calibrate(win, files, keyboard = None, interval_time = 0.4, n_frames = 300, n_presses = 10,
+              memory_share = 0.25, generated_bytes = 0):
+
+    '''
+    Measures the display, keyboard and disk of this station, and chooses the settings of the stimulus
+    cache and prefetching from them: every image is preloaded if their textures fit in 'memory_share'
+    of the memory of the machine; otherwise the cache is limited to it and images are decoded in the
+    background, deep enough ahead that the slowest image is ready after as many fixations.
+
+    Parameters
+    ——————————
+     • win : the psychopy window (or a SimulatedWindow, for a null-display calibration).
+     • files : the images of the session, stimuli and screens.
+     • keyboard : the keyboard of the session, see 'measure_keyboard'.
+     • interval_time : duration of the fixation cross before each image, in seconds.
+     • n_frames, n_presses : see 'measure_display' and 'measure_keyboard'.
+     • memory_share : share of the memory of the machine the stimulus cache may take.
+     • generated_bytes : texture memory of the screens generated rather than read from files, in bytes.
+
+     Returns
+    ——————————
+     • profile : dictionary with the 'display', 'keyboard' and 'disk' measures, the 'memory_mb' of the
+       machine, and the 'recommended' settings: 'cache_mb' and 'prefetch' (the prefetch depth, 0 to
+       preload every image).
+    '''
+
+    display = measure_display(win, n_frames)
+    keys = measure_keyboard(win, keyboard, n_presses)
+    disk = measure_disk(files)
+    memory = _physical_memory()
+
+    # room for every texture, with some margin, if the machine has it
+    cache_mb = math.ceil(1.1 * (disk['texture_mb'] + generated_bytes / 1024**2))
+    prefetch = 0
+    if memory is not None and cache_mb > memory_share * memory / 1024**2:
+        cache_mb = math.floor(memory_share * memory / 1024**2)
+        prefetch = max(2, math.ceil(disk['decode_max_ms'] / 1000 / interval_time) + 1)
+
+    return {
+        'station': station_name(),
+        'date': datetime.datetime.now().isoformat(timespec = 'seconds'),
+        'null_display': bool(getattr(win, 'simulated', False)),
+        'display': display,
+        'keyboard': keys,
+        'disk': disk,
+        'memory_mb': memory / 1024**2 if memory is not None else None,
+        'recommended': {'cache_mb': cache_mb, 'prefetch': prefetch}
+    }
+
+
+
+def save_profile(profile, path = None):
+
+    '''
+    Saves a profile, by default as the profile of this station.
+    '''
+
+    path = path or profile_path()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    with open(path, 'w') as file:
+        json.dump(profile, file, indent = 1)
+
+    return path
+
+
+
+def load_profile(path = None):
+
+    '''
+    Loads a profile, by default the profile of this station. Returns None if there is none.
+    '''
+
+    path = path or profile_path()
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+
+def matches_window(profile, win, tolerance = 0.02):
+
+    '''
+    Whether a profile was measured on a display refreshing at the same rate as a window, within
+    'tolerance' (relative).
+    '''
+
+    return abs(profile['display']['frame_period'] - win.monitorFramePeriod) <= tolerance * win.monitorFramePeriod
+
+
+
+def check_profile(profile, win, interval_time = 0.4, feedback_time = 0.5, tolerance = 0.001):
+
+    '''
+    Checks that a station can play the session as planned, from its profile. Returns the problems found,
+    as messages.
+
+    Parameters
+    ——————————
+     • profile : the profile of the station.
+     • win : the window of the session.
+     • interval_time, feedback_time : durations of the fixation and feedback, in seconds.
+     • tolerance : largest difference accepted between a duration and the frames it is played as, in
+       seconds.
+    '''
+
+    warnings = []
+    display, keys, disk = profile['display'], profile['keyboard'], profile['disk']
+
+    if profile['null_display'] and not getattr(win, 'simulated', False):
+        warnings.append('the profile was measured without a display: calibrate the station again')
+    if not matches_window(profile, win):
+        warnings.append(f"the window refreshes at {1 / win.monitorFramePeriod:.1f} Hz but the station was "
+                        f"calibrated at {display['refresh_rate']:.1f} Hz: calibrate the station again")
+
+    # durations are played as whole frames
+    period = display['frame_period'] if matches_window(profile, win) else win.monitorFramePeriod
+    for name, secs in [('fixation', interval_time), ('feedback', feedback_time)]:
+        frames = max(1, round(secs / period))
+        if abs(frames * period - secs) > tolerance:
+            warnings.append(f'at {1 / period:.1f} Hz, the {1000 * secs:.0f} ms {name} lasts {frames} frames, '
+                            f'{1000 * frames * period:.1f} ms')
+    if display['dropped_frames'] > 0.01 * display['n_frames']:
+        warnings.append(f"{display['dropped_frames']} of {display['n_frames']} frames were dropped during the "
+                        f"calibration, durations will not always be met")
+
+    # images decoded during the session have to be ready by the end of the fixation
+    if profile['recommended']['prefetch'] and disk['decode_max_ms'] > 1000 * interval_time:
+        warnings.append(f"the slowest image takes {disk['decode_max_ms']:.0f} ms to decode, longer than the "
+                        f"fixation: some images may come late")
+    if keys['latency_ms'] > 1000 * period:
+        warnings.append(f"key presses are read {keys['latency_ms']:.1f} ms after they happen, more than a frame")
+
+    return warnings
+
+
+
+if __name__ == '__main__':
+
+    from scripts.config import read_config, plan_screens, plan_stimuli, session_screens
+    from scripts.manifest import load_manifest
+
+    parser = argparse.ArgumentParser(description = 'Calibrate this station and save its profile.')
+    parser.add_argument('--config', default = r'./experiment.toml', help = 'configuration of the session')
+    parser.add_argument('--null', action = 'store_true', help = 'calibrate without a display, with a simulated participant')
+    parser.add_argument('--frames', type = int, default = 300, help = 'number of frames to time')
+    parser.add_argument('--presses', type = int, default = 10, help = 'number of key presses to time')
+    parser.add_argument('--out', help = 'where to save the profile, defaults to the profile of this station '
+                                        '(<station>-null for a null-display calibration)')
+    args = parser.parse_args()
+
+    config = read_config(args.config)
+    window, task = config['window'], config['task']
+    stimuli = load_manifest(config['stimuli']['folder'], verify = False)
+    # the images read from disk, the screens of the task are generated
+    screens = session_screens(config)
+    files = plan_stimuli(config, stimuli) + [file for file in plan_screens(config) if file not in screens]
+
+    if args.null:
+        from scripts.simulated import SimulatedWindow
+        win = SimulatedWindow(size = window['size'], units = window['units'], color = window['color'])
+        keyboard = None
+    else:
+        from psychopy import visual
+        from scripts.keyboard import open_keyboard
+        win = visual.Window(size = window['size'], fullscr = window['fullscr'], units = window['units'],
+                            color = window['color'])
+        keyboard = open_keyboard()
+
+    # the generated screens are the size of the window, uploaded as RGBA
+    generated_bytes = len(screens.texts) * screens.size[0] * screens.size[1] * 4
+    profile = calibrate(win, files, keyboard, task['interval_time'], args.frames, args.presses,
+                        generated_bytes = generated_bytes)
+    if keyboard is not None:
+        keyboard.close()
+    win.close()
+
+    path = save_profile(profile, args.out or profile_path(station_name() + ('-null' if args.null else '')))
+    display, keys, disk, recommended = profile['display'], profile['keyboard'], profile['disk'], profile['recommended']
+    print(f"Display: {display['refresh_rate']:.2f} Hz, jitter {display['frame_jitter_ms']:.2f} ms, "
+          f"{display['dropped_frames']} of {display['n_frames']} frames dropped")
+    print(f"Keyboard ({keys['backend']}): presses read {keys['latency_ms']:.2f} ms after they happen "
+          f"({keys['latency_max_ms']:.2f} ms at most)")
+    print(f"Disk: {disk['read_mb_s']:.0f} MB/s, {disk['decode_ms']:.1f} ms to decode an image "
+          f"({disk['decode_max_ms']:.1f} ms at most), {disk['texture_mb']:.0f} MB of textures")
+    print(f"Cache of {recommended['cache_mb']} MB, " + (f"prefetch {recommended['prefetch']} images ahead"
+          if recommended['prefetch'] else 'every image preloaded'))
+    for warning in check_profile(profile, win, task['interval_time'], task['feedback_time']):
+        print(f'Warning: {warning}')
+    print(f'Profile saved in {path}')
@@ -0,0 +1,307 @@
+# Configuration of the session played by the main experiment script, from a TOML (or YAML) file
+#
+#     python -m scripts.config experiment.toml
+
+import copy, os, sys
+from PIL import ImageColor
+from scripts.screens import ScreenRenderer, task_screens
+
+
+# everything a configuration file can set, with the values used when it leaves them out
+DEFAULTS = {
+    'window': {'size': [1440, 900], 'fullscr': False, 'units': 'pix', 'color': '#BABAB9'},
+    'stimuli': {'folder': './stimuli'},
+    'task': {'categories': ['face', 'scene', 'body'], 'keys': ['f', 'j'], 'interval_time': 0.4,
+             'feedback_time': 0.5, 'response_window': None, 'max_target_run': None, 'adaptive_block_size': None},
+    'cache': {'max_mb': 512, 'rendered_screens': None},
+    'screens': {'start': None, 'end': None},
+    'phases': []
+}
+
+PHASE_DEFAULTS = {'exp_phase': None, 'runs': 1, 'intro': None, 'after_run': {}, 'criterion': None}
+
+# parameters of the criterion ending the practice early, see 'PracticeCriterion'
+CRITERION_DEFAULTS = {'window': 10, 'accuracy': 0.9, 'max_rt_change': 0.15, 'min_trials': 10, 'max_trials': None}
+
+# folder of the instruction screens, whose names are used by 'run_block'
+INSTRUCTIONS = 'instructions'
+
+UNITS = ['pix', 'norm', 'height', 'deg', 'degFlat', 'degFlatPos', 'cm']
+
+
+def read_config(path):
+
+    '''
+    Reads a configuration file, TOML or YAML (which needs PyYAML), and fills in the defaults of
+    everything it leaves out. The configuration still has to be checked with 'validate_config'.
+
+    Parameters
+    ——————————
+     • path : path of the file.
+
+     Returns
+    ——————————
+     • config : dictionary with the 'window', 'stimuli', 'task', 'cache', 'screens' and 'phases'
+       sections.
+    '''
+
+    with open(path, 'rb') as file:
+        if os.path.splitext(path)[1] in ('.yaml', '.yml'):
+            import yaml
+            raw = yaml.safe_load(file) or {}
+        else:
+            try:
+                import tomllib
+            except ImportError: # python < 3.11
+                import tomli as tomllib
+            raw = tomllib.load(file)
+
+    config = copy.deepcopy(DEFAULTS)
+    # unknown sections are kept so that they can be reported
+    for section, values in raw.items():
+        if section == 'phases' or not isinstance(values, dict) or not isinstance(config.get(section), dict):
+            config[section] = values
+        else:
+            config[section].update(values)
+    config['phases'] = [{**copy.deepcopy(PHASE_DEFAULTS), **phase} if isinstance(phase, dict) else phase
+                        for phase in config['phases']]
+
+    return config
+
+
+
+def screen_file(name):
+
+    '''
+    Returns the file of an instruction screen, from its name, e.g. 'run02_end'.
+    '''
+
+    return os.path.join(INSTRUCTIONS, f'{name}.png')
+
+
+
+def _check(problems, condition, message):
+    if not condition:
+        problems.append(message)
+    return condition
+
+
+
+def _is_number(value, minimum = 0.):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > minimum
+
+
+
+def _check_criterion(problems, where, criterion, exp_phase):
+    # the criterion ending the practice early, if any
+    if criterion is None:
+        return
+    _check(problems, exp_phase == 'practice', f'{where}: only the practice can end on a criterion')
+    if not _check(problems, isinstance(criterion, dict), f'{where}: criterion must be a table'):
+        return
+    for name in criterion:
+        _check(problems, name in CRITERION_DEFAULTS, f"unknown parameter '{name}' in the criterion of {where}")
+    criterion = {**CRITERION_DEFAULTS, **criterion}
+    window, min_trials, max_trials = criterion['window'], criterion['min_trials'], criterion['max_trials']
+    _check(problems, isinstance(window, int) and window >= 2 and window % 2 == 0,
+           f'{where}: the criterion window must be an even number of trials')
+    _check(problems, _is_number(criterion['accuracy']) and criterion['accuracy'] <= 1,
+           f'{where}: the criterion accuracy must be between 0 and 1')
+    _check(problems, _is_number(criterion['max_rt_change']), f'{where}: the criterion max_rt_change must be positive')
+    if _check(problems, isinstance(min_trials, int) and min_trials > 0,
+              f'{where}: the criterion min_trials must be a positive integer'):
+        _check(problems, max_trials is None or (isinstance(max_trials, int) and max_trials >= min_trials),
+               f'{where}: the criterion max_trials must be an integer above min_trials, or left out')
+
+
+
+def validate_config(config, stimuli = None):
+
+    '''
+    Checks every parameter of a configuration, and that every screen it refers to exists, so that a
+    mistake stops the experiment before it starts rather than in the middle of a session. With the
+    stimuli, also checks that every phase has images of every category to detect. Raises a ValueError
+    listing all the problems found, if any.
+
+    Parameters
+    ——————————
+     • config : the configuration, from 'read_config'.
+     • stimuli : the stimuli, from the stimulus manifest.
+    '''
+
+    problems = []
+
+    # sections and parameters that don't exist, e.g. misspelled
+    for section in config:
+        if not _check(problems, section in DEFAULTS, f"unknown section '{section}'"):
+            continue
+        if isinstance(DEFAULTS[section], dict) and _check(problems, isinstance(config[section], dict),
+                                                          f'[{section}] must be a table'):
+            for name in config[section]:
+                _check(problems, name in DEFAULTS[section], f"unknown parameter '{name}' in [{section}]")
+    # the rest can't be checked without the right sections
+    if any(problem.endswith('must be a table') for problem in problems):
+        raise ValueError('Invalid experiment configuration:\n - ' + '\n - '.join(problems))
+
+    window, task = config['window'], config['task']
+    size = window['size']
+    _check(problems, isinstance(size, list) and len(size) == 2 and all(isinstance(x, int) and x > 0 for x in size),
+           f'window size must be two positive integers, not {size}')
+    _check(problems, isinstance(window['fullscr'], bool), 'window fullscr must be true or false')
+    _check(problems, window['units'] in UNITS, f"window units must be one of {UNITS}, not '{window['units']}'")
+    try:
+        ImageColor.getrgb(window['color'])
+    except (ValueError, AttributeError):
+        problems.append(f"window color '{window['color']}' is not a color")
+
+    _check(problems, _is_number(config['cache']['max_mb']), 'cache max_mb must be a positive number')
+    _check(problems, config['cache']['rendered_screens'] is None or isinstance(config['cache']['rendered_screens'], str),
+           'cache rendered_screens must be a folder, or left out')
+
+    categories, keys = task['categories'], task['keys']
+    _check(problems, isinstance(categories, list) and categories and len(set(categories)) == len(categories),
+           f'categories must be a list of different categories, not {categories}')
+    _check(problems, isinstance(keys, list) and len(keys) == 2 and keys[0] != keys[1],
+           f'keys must be two different keys, not {keys}')
+    for name in ['interval_time', 'feedback_time']:
+        _check(problems, _is_number(task[name]), f'{name} must be a positive number of seconds')
+    _check(problems, task['response_window'] is None or _is_number(task['response_window']),
+           'response_window must be a positive number of seconds, or left out')
+    for name in ['max_target_run', 'adaptive_block_size']:
+        _check(problems, task[name] is None or (isinstance(task[name], int) and task[name] > 0),
+               f'{name} must be a positive integer, or left out')
+
+    # the phases
+    phases = config['phases']
+    _check(problems, isinstance(phases, list) and phases, 'at least one phase is needed')
+    seen = set()
+    for index, phase in enumerate(phases if isinstance(phases, list) else []):
+        where = f'phase {index + 1}'
+        if not _check(problems, isinstance(phase, dict), f'{where} must be a table'):
+            continue
+        for name in phase:
+            _check(problems, name in PHASE_DEFAULTS, f"unknown parameter '{name}' in {where}")
+        exp_phase, runs = phase['exp_phase'], phase['runs']
+        _check(problems, exp_phase in ('practice', 'main'), f"{where}: exp_phase must be 'practice' or 'main'")
+        _check(problems, exp_phase not in seen, f"{where}: there can only be one '{exp_phase}' phase")
+        seen.add(exp_phase)
+        if _check(problems, isinstance(runs, int) and runs >= 0, f'{where}: runs must be a whole number'):
+            # practice trials are all logged as run 0
+            _check(problems, exp_phase != 'practice' or runs <= 1, f'{where}: there can only be one practice run')
+        _check_criterion(problems, where, phase['criterion'], exp_phase)
+        if not _check(problems, isinstance(phase['after_run'], dict), f'{where}: after_run must be a table'):
+            continue
+        for run in phase['after_run']:
+            _check(problems, str(run).isdigit() and isinstance(runs, int) and 1 <= int(run) <= runs,
+                   f'{where}: after_run refers to run {run}, but the phase has {runs} runs')
+        if stimuli is not None and exp_phase in ('practice', 'main') and isinstance(categories, list):
+            present = set(stimuli.loc[stimuli['exp_phase'] == exp_phase, 'stim_cat'])
+            for category in categories:
+                _check(problems, category in present, f"{where}: no {exp_phase} image of the category '{category}'")
+            block_size = task['adaptive_block_size']
+            n_images = int((stimuli['exp_phase'] == exp_phase).sum())
+            _check(problems, exp_phase != 'main' or block_size is None or not isinstance(block_size, int)
+                   or block_size <= n_images, f'adaptive_block_size is larger than the {n_images} main images')
+
+    # every screen the session will show, once the phases are known to be right; the screens of the task
+    # are generated
+    if not any(problem.startswith(('phase', 'categories', 'keys', 'window size')) for problem in problems):
+        generated = session_screens(config)
+        for file in plan_screens(config):
+            _check(problems, file in generated or os.path.exists(file), f'the screen {file} does not exist')
+
+    if problems:
+        raise ValueError('Invalid experiment configuration:\n - ' + '\n - '.join(problems))
+
+
+
+def session_runs(config):
+
+    '''
+    Lists the runs of the session in the order they are played.
+
+     Returns
+    ——————————
+     • runs : list of dictionaries, one per run, with its 'label' in the session file, its 'run' number
+       in the data (0 for the practice), its phase, its number in the phase ('phase_run'), and the
+       screens shown before it ('intro', first run of a phase only) and after it ('after'), or None,
+       and the parameters of the criterion ending its blocks early ('criterion'), or None.
+    '''
+
+    runs = []
+    for phase in config['phases']:
+        after_run = {int(run): name for run, name in phase['after_run'].items()}
+        for phase_run in range(1, phase['runs'] + 1):
+            practice = phase['exp_phase'] == 'practice'
+            runs.append({
+                'label': 'practice' if practice else f'run{phase_run}',
+                'run': 0 if practice else phase_run,
+                'exp_phase': phase['exp_phase'],
+                'phase_run': phase_run,
+                'intro': phase['intro'] if phase_run == 1 else None,
+                'after': after_run.get(phase_run),
+                'criterion': {**CRITERION_DEFAULTS, **phase['criterion']} if phase['criterion'] is not None else None
+            })
+
+    return runs
+
+
+
+def session_screens(config):
+
+    '''
+    Returns the renderer of the screens generated for the task of a session, see 'ScreenRenderer'.
+    '''
+
+    return ScreenRenderer(config['window']['size'], task_screens(config['task']['categories'], config['task']['keys'],
+                                                                 folder = INSTRUCTIONS),
+                          folder = config['cache']['rendered_screens'])
+
+
+
+def plan_screens(config):
+
+    '''
+    Returns the files of every screen the session can show: start and end, intro and after-run screens,
+    the fixation cross, break and question screens, and the feedback screens if there is a practice. The
+    break, question and feedback screens are generated, see 'session_screens'.
+    '''
+
+    runs = session_runs(config)
+    names = [config['screens']['start'], config['screens']['end']]
+    names += [run[screen] for run in runs for screen in ('intro', 'after')]
+    names += ['cross', 'break']
+    if any(run['exp_phase'] == 'practice' for run in runs):
+        names += ['correct', 'wrong']
+    keys = config['task']['keys']
+    names += [f'q{category}_{yes_key}_{no_key}' for category in config['task']['categories']
+              for yes_key in keys for no_key in keys if no_key != yes_key]
+
+    return [screen_file(name) for name in dict.fromkeys(names) if name is not None]
+
+
+
+def plan_stimuli(config, stimuli):
+
+    '''
+    Returns the files of the stimuli the session can show, those of its phases.
+    '''
+
+    phases = [phase['exp_phase'] for phase in config['phases'] if phase['runs'] > 0]
+    return stimuli.loc[stimuli['exp_phase'].isin(phases), 'stim_file'].tolist()
+
+
+
+if __name__ == '__main__':
+
+    from scripts.manifest import load_manifest
+
+    if len(sys.argv) != 2:
+        sys.exit('usage: python -m scripts.config <configuration file>')
+
+    config = read_config(sys.argv[1])
+    stimuli = load_manifest(config['stimuli']['folder'])
+    validate_config(config, stimuli)
+    runs = session_runs(config)
+    print(f"{sys.argv[1]} is valid: {len(runs)} runs ({', '.join(run['label'] for run in runs)}), "
+          f'{len(plan_stimuli(config, stimuli))} stimuli and {len(plan_screens(config))} screens to preload')
@@ -0,0 +1,140 @@
+# Criterion to end the practice early, used by 'run' and the main experiment script
+
+from collections import deque
+
+
+class PracticeCriterion:
+
+    '''
+    Decides, after every trial of a block, whether the participant has practised the task enough: over
+    the last 'window' trials, the accuracy (timeouts count as errors) is at least 'accuracy' both on the
+    targets and on the other images, and the RTs have settled, i.e. the mean RT of the correct responses
+    in the newer half of the window is within 'max_rt_change' (a proportion) of the one in the older
+    half. The targets being a minority of the images, an accuracy over all the trials could be met by
+    answering 'no' every time: the criterion is not met while the window holds no target. The block ends as soon as the criterion
+    is met, but not before 'min_trials', and at the latest after 'max_trials'. Each block (category and
+    key order) is judged on its own, so every condition is still practised.
+
+    The statistics are updated in constant time, so the decision costs nothing on the display thread.
+
+    Parameters
+    ——————————
+     • window : int. Number of trials the criterion is evaluated on. Even, to split it in two halves.
+     • accuracy : accuracy the participant needs over the window, on the targets and on the other
+       images.
+     • max_rt_change : largest change of the mean RT from the older to the newer half of the window, as
+       a proportion of the older one.
+     • min_trials : int. Number of trials played in a block whatever the performance.
+     • max_trials : int. Number of trials after which the block ends even if the criterion isn't met.
+       None to end it when its images run out.
+    '''
+
+    def __init__(self, window = 10, accuracy = 0.9, max_rt_change = 0.15, min_trials = 10, max_trials = None):
+
+        if window < 2 or window % 2:
+            raise ValueError(f'the window of the criterion must be an even number of trials, not {window}')
+        self.window = window
+        self.accuracy = accuracy
+        self.max_rt_change = max_rt_change
+        self.min_trials = min_trials
+        self.max_trials = max_trials
+        self.start_block()
+
+
+    def start_block(self):
+
+        '''
+        Starts the statistics of a new block.
+        '''
+
+        self.trials = 0
+        # why the block was stopped: 'criterion', 'max_trials', or '' while it goes on
+        self.stop = ''
+        # (target, correct, RT of a correct response or None) of the trials in each half of the window
+        self._older, self._newer = deque(), deque()
+        # running sums of each half: targets and correct ones, other images and correct ones, RTs of the
+        # correct responses and their number
+        self._sums = {'older': [0, 0, 0, 0, 0., 0], 'newer': [0, 0, 0, 0, 0., 0]}
+
+
+    def _add(self, half, trial, sign):
+        sums = self._sums[half]
+        target, correct, rt = trial
+        # the counts of the targets, or of the other images
+        counts = 0 if target else 2
+        sums[counts] += sign
+        sums[counts + 1] += sign * correct
+        if rt is not None:
+            sums[4] += sign * rt
+            sums[5] += sign
+
+
+    def update(self, rt, correct, target, timeout = False):
+
+        '''
+        Adds a trial to the statistics. Returns True if the block should stop after it.
+
+        Parameters
+        ——————————
+         • rt : the RT, in seconds (NaN if the trial timed out).
+         • correct : bool. Whether the response was correct.
+         • target : bool. Whether the image was a target.
+         • timeout : bool. Whether the trial timed out.
+        '''
+
+        self.trials += 1
+        trial = (bool(target), bool(correct), rt if correct and not timeout else None)
+        # the trial enters the newer half, whose oldest trial moves to the older half, whose oldest
+        # trial leaves the window
+        self._newer.append(trial)
+        self._add('newer', trial, 1)
+        if len(self._newer) > self.window // 2:
+            moved = self._newer.popleft()
+            self._add('newer', moved, -1)
+            self._older.append(moved)
+            self._add('older', moved, 1)
+        if len(self._older) > self.window // 2:
+            self._add('older', self._older.popleft(), -1)
+
+        if self.trials >= self.min_trials and self.met():
+            self.stop = 'criterion'
+        elif self.max_trials is not None and self.trials >= self.max_trials:
+            self.stop = 'max_trials'
+
+        return bool(self.stop)
+
+
+    def state(self):
+
+        '''
+        Returns the accuracy on the targets and on the other images, and the relative RT change, over the
+        window (NaN until it is full, or without trials to compute them on), and why the block was
+        stopped, if it was, as columns for the trial log.
+        '''
+
+        older, newer = self._sums['older'], self._sums['newer']
+        full = len(self._older) + len(self._newer) == self.window
+        accuracies = []
+        for counts in (0, 2):
+            trials = older[counts] + newer[counts]
+            accuracies.append((older[counts + 1] + newer[counts + 1]) / trials if full and trials else float('nan'))
+        if full and older[5] and newer[5]:
+            older_rt = older[4] / older[5]
+            rt_change = abs(newer[4] / newer[5] - older_rt) / older_rt
+        else:
+            rt_change = float('nan')
+
+        return {'criterion_target_accuracy': accuracies[0], 'criterion_nontarget_accuracy': accuracies[1],
+                'criterion_rt_change': rt_change, 'criterion_stop': self.stop}
+
+
+    def met(self):
+
+        '''
+        Returns whether the criterion is met over the window.
+        '''
+
+        state = self.state()
+        # (NaN, before the window is full or while it holds no target, never passes)
+        return (state['criterion_target_accuracy'] >= self.accuracy and state['criterion_nontarget_accuracy'] >= self.accuracy
+                and state['criterion_rt_change'] <= self.max_rt_change)
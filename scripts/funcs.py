@@ -2,11 +2,21 @@
 
 import numpy as np
 import pandas as pd
-import pathlib, time
-from psychopy import visual, event, core
+import pathlib, glob
+from scripts.cache import StimulusCache
+from scripts.screens import ScreenRenderer, task_screens
+from scripts.timing import TrialTimer, frame_summary
+from scripts.prefetch import Prefetcher
+from scripts.calibration import matches_window
+from scripts.scoring import EVENT_DTYPE, event_row, image_stems, score_block
 
 
-def run_block(win, images, yes_key, no_key, category, exp_parameters):
+# the progress of the practice recorded when there is no criterion to end it
+NO_CRITERION = {'criterion_target_accuracy': float('nan'), 'criterion_nontarget_accuracy': float('nan'),
+                'criterion_rt_change': float('nan'), 'criterion_stop': ''}
+
+
+def run_block(win, images, yes_key, no_key, category, exp_parameters, cache, timer, logger, estimates = None, monitor = None, verifier = None, criterion = None):
     
     '''
     This is an internal function that shouldn't be called outside of 'run'.
@@ -21,92 +31,261 @@ def run_block(win, images, yes_key, no_key, category, exp_parameters):
      • images : the images to show for each trial.
      • keys : answer keys. The first one is the correct one by convention.
      • category : the category to detect during the block.
-     • exp_parameters : list of parameters to use (ITI, etc.).
+     • exp_parameters : list of parameters to use (fixation and feedback durations in frames, etc.).
+     • cache : the StimulusCache holding the images and instruction screens.
+     • timer : the TrialTimer stamping the onsets and responses.
+     • logger : the TrialLogger to stream the trials to, or None.
+     • estimates : the ImageEstimates to update after every trial, or None.
+     • monitor : the PerformanceMonitor to update after every trial, or None.
+     • verifier : the FrameVerifier checking the frame of every stimulus, or None.
+     • criterion : the PracticeCriterion ending the block once the task is learnt, or None.
     '''
     
-    # create a dictionary to save the data
-    data = { # list all the variables of interest we want to save
-        'trial_nb': [],
-        'rt': [],
-        'acc':[],
-        'response':[],
-        'image': [],
-        'category':[],
-        'exp_phase':[],
-        'yes_key': []
-    }
+    # preallocate the raw events of the block, everything else is derived after it
+    events = np.zeros(len(images), dtype = EVENT_DTYPE)
+    # things we need on every trial, computed once for the whole block
+    stim_files = images['stim_file'].to_numpy()
+    stems = image_stems(stim_files).to_numpy()
+    targets = images['stim_cat'].to_numpy() == category
+    practice = images['exp_phase'].to_numpy() == 'practice'
 
     # show instructions for the task until 'space' is pressed
-    visual.ImageStim(win, fr'instructions/q{category}_{yes_key}_{no_key}.png').draw()
-    win.flip()
-    event.waitKeys(keyList = ('space'))
+    show_screen(win, cache, timer, fr'instructions/q{category}_{yes_key}_{no_key}.png')
+    
+    # the fixation cross and feedback screens are the same for every trial
+    cross = cache.get(fr'instructions/cross.png')
+    feedback = {True: cache.get(fr'instructions/correct.png'), False: cache.get(fr'instructions/wrong.png')}
+    
+    # decode the upcoming images in the background, in trial order
+    prefetcher = None
+    if exp_parameters['prefetch']:
+        prefetcher = Prefetcher(stim_files, depth = exp_parameters['prefetch'])
+    
+    # durations of the fixation and feedback, in frames
+    interval_frames, feedback_frames = exp_parameters['interval_frames'], exp_parameters['feedback_frames']
+    
+    # show the fixation cross of the first trial
+    cross.draw()
+    fixation_time = timer.flip('fixation')
     
     # plays images, record response
     for n in range(len(images)):
         
-        # find the file to show
-        stimulus_file = images['stim_file'].values[n]
-        # create the image to show
-        image = visual.ImageStim(win, image = stimulus_file, size = (500,500)) 
-        # show the fixation cross
-        visual.ImageStim(win, fr'instructions/cross.png').draw()
-        win.flip()
-        core.wait(exp_parameters['interval_time'])
+        timer.start_trial()
         
-        # show the stimulus
+        # get the image to show while the cross is on screen: already there if it was preloaded,
+        # otherwise taken from the prefetch queue (or decoded here) and uploaded
+        decoded, prefetch_wait = None, 0.
+        with timer.section('image'):
+            if prefetcher is not None:
+                _, decoded = prefetcher.get()
+                prefetch_wait = prefetcher.wait_times[-1]
+            image = cache.get(stim_files[n], size = (500,500), image = decoded)
+        
+        # keep the cross on screen, one flip per frame, for the rest of the fixation
+        for _ in range(interval_frames - 1):
+            cross.draw()
+            timer.flip('fixation', frames = 1)
+        
+        # show the stimulus on the frame after the fixation, stamping its onset at the flip
         image.draw()
-        win.flip()
-    
-        # start measuring the RT
-        startTime = time.time()
-        # wait for a response
-        response = event.waitKeys(keyList = (yes_key, no_key))[0]
-        # calculate the RT
-        rt = time.time() - startTime
-            
-        # check the answer, make it true or false
-        # if the target was present
-        if category == images['stim_cat'].values[n]:
-            # the answer is correct if the 'yes' key was pressed
-            if response == yes_key:
-                acc = True
-            # the answer is incorrect if the 'no' key was pressed
-            elif response == no_key:
-                acc = False
-        # else if the target was absent
-        elif category != images['stim_cat'].values[n]:
-            # the answer is correct if the 'no' key was pressed
-            if response == no_key:
-                acc = True
-            # the answer is incorrect if the 'yes' key was pressed
-            elif response == yes_key:
-                acc = False
+        # (reading back what is about to be shown, if it is checked)
+        if verifier is not None:
+            with timer.section('verify'):
+                verifier.capture(stim_files[n], trial_nb = n)
+        onset_time = timer.flip_onset(frames = 1, planned = fixation_time + interval_frames * timer.frame_period)
+        fixation_duration = onset_time - fixation_time
+    
+        # wait for a response until the deadline, the RT runs from the onset to the key press
+        response, rt = timer.wait_response(keyList = (yes_key, no_key), max_wait = exp_parameters['response_window'])
+        # no response in time is a miss, and the block goes on
+        timeout = response is None
+        if timeout:
+            response = ''
+        # the stimulus frame is out by now, hand it to the check
+        if verifier is not None:
+            with timer.section('verify'):
+                verifier.collect()
+        # the answer is correct if the 'yes' key was pressed for a target
+        correct = not timeout and (response == yes_key) == targets[n]
         
         # if training, show feedback
-        if images['exp_phase'].values[n] == 'practice':
-            if acc: # if the answer was correct show correct feedback
-                visual.ImageStim(win, fr'instructions/correct.png').draw()
-            elif not acc: # if the answer was incorrect show incorrect feedback
-                visual.ImageStim(win, fr'instructions/wrong.png').draw()
-            win.flip()
-            core.wait(exp_parameters['feedback_time'])
-            
-        # append data from the trial
-        data['trial_nb'].append(n)
-        data['rt'].append(rt)
-        data['acc'].append(acc)
-        data['response'].append(response)
-        data['image'].append(pathlib.Path(stimulus_file).stem)
-        data['category'].append(images['stim_cat'].values[n])
-        data['exp_phase'].append(images['exp_phase'].values[n])
-        data['yes_key'].append(yes_key)
+        feedback_duration = float('nan')
+        if practice[n]:
+            screen = feedback[correct]
+            screen.draw()
+            feedback_time = timer.flip('feedback')
+            for _ in range(feedback_frames - 1):
+                screen.draw()
+                timer.flip('feedback', frames = 1)
+        
+        # the fixation cross of the next trial ends this one
+        cross.draw()
+        fixation_time = timer.flip('fixation', frames = 1 if practice[n] else None)
+        if practice[n]:
+            feedback_duration = fixation_time - feedback_time
+            
+        # whether the participant had enough practice
+        stop = criterion is not None and criterion.update(rt, correct, targets[n], timeout)
+        progress = criterion.state() if criterion is not None else NO_CRITERION
+        
+        # record the raw events of the trial, with the timestamps to audit the latencies offline, the
+        # frame timing of its flips and the progress of the practice
+        stamps, frames = timer.stamps, timer.trial_frames()
+        events[n] = (n, n, response, rt, timeout, stamps['planned_onset'], stamps['onset_time'], stamps['flip_time'],
+                     stamps['key_time'], stamps['poll_time'], stamps['anticipations'], prefetch_wait, frames['onset_error'],
+                     frames['dropped_frames'], frames['max_flip_interval'], frames['late_cause'],
+                     fixation_duration, feedback_duration, progress['criterion_target_accuracy'],
+                     progress['criterion_nontarget_accuracy'], progress['criterion_rt_change'],
+                     progress['criterion_stop'])
+        
+        # stream the trial to disk right away, it gets scored when the log is read
+        if logger is not None:
+            with timer.section('log'):
+                logger.log(event_row(events[n], stems[n], category, yes_key))
+        
+        # the running estimates of the image
+        if estimates is not None:
+            estimates.update(stems[n], category, rt, correct)
+        # and the live statistics of the session
+        if monitor is not None:
+            monitor.update(category, yes_key, rt, correct, timeout)
+        
+        # the rest of the block is skipped, its data ends with this trial
+        if stop:
+            events = events[:n + 1]
+            break
+    
+    # stop the background loading
+    if prefetcher is not None:
+        prefetcher.close()
+    
+    # score the whole block at once
+    with timer.section('score'):
+        data = score_block(events, images, category, yes_key)
     
     # return the collected data
     return data
 
 
 
-def run(win, stimuli, exp_phase, categories = ['face', 'scene', 'body'], keys = ['f', 'j'], interval_time=0.4, feedback_time=0.5):
+def load_stimuli(pattern = r'./stimuli/*.png'):
+    
+    '''
+    Lists the experimental stimuli. The file names are <phase>_<category>_<number>.
+    
+    Parameters
+    ——————————
+     • pattern : glob pattern of the stimulus files.
+     
+     Returns
+    ——————————
+     • stim_df : a dataframe with the file, phase, category and number of each stimulus.
+    '''
+    
+    stim_list = glob.glob(pattern) # main task stimuli
+    stim_df = pd.DataFrame({
+        'stim_file': stim_list, # stimulus file
+        'exp_phase': [(pathlib.Path(file).stem).split('_')[0] for file in stim_list], # practice or main task
+        'stim_cat': [(pathlib.Path(file).stem).split('_')[1] for file in stim_list], # category in the image
+        'stim_nb' : [(pathlib.Path(file).stem).split('_')[2] for file in stim_list] # number of the image
+    })
+    
+    return stim_df
+
+
+
+def show_screen(win, cache, timer, file, keyList = ['space']):
+    
+    '''
+    Shows a full screen image, e.g. instructions, until one of the given keys is pressed.
+    
+    Parameters
+    ——————————
+     • win : the window to show the screen in.
+     • cache : the StimulusCache to take the image from.
+     • timer : the TrialTimer whose keyboard is read.
+     • file : path to the image.
+     • keyList : list of the keys that leave the screen. None for any key.
+    '''
+    
+    cache.get(file).draw()
+    timer.flip('screen')
+    timer.wait_keys(keyList)
+
+
+
+def preload_stimuli(cache, stimuli, categories = ['face', 'scene', 'body'], keys = ['f', 'j']):
+    
+    '''
+    Loads into the cache every image a run can show: the stimuli, the fixation cross, the feedback and
+    break screens, and the question screen of each category and key order.
+    
+    Parameters
+    ——————————
+     • cache : the StimulusCache to fill.
+     • stimuli : a dataframe holding the images to present.
+     • categories : list. Categories whose question screens are needed.
+     • keys : list. The two response keys.
+     
+     Returns
+    ——————————
+     • load_time : the time spent loading, in seconds.
+    '''
+    
+    # the stimuli themselves, at their display size
+    load_time = cache.preload(stimuli['stim_file'], size = (500,500))
+    # the screens shown around the trials
+    screens = [fr'instructions/{name}.png' for name in ['cross', 'correct', 'wrong', 'break']]
+    # one question screen per category and key order
+    screens += [fr'instructions/q{category}_{yes_key}_{no_key}.png' for category in categories
+                for yes_key in keys for no_key in keys if no_key != yes_key]
+    load_time += cache.preload(screens)
+    
+    return load_time
+
+
+
+def draw_blocks(rng, stim_files, categories = ['face', 'scene', 'body'], keys = ['f', 'j']):
+    
+    '''
+    Draws the order of the blocks of a run and of the trials of each block: categories in a random
+    order, both key orders for each category in a random order, and all the images in a random order
+    in each block.
+    
+    Parameters
+    ——————————
+     • rng : the numpy random number generator to draw from.
+     • stim_files : list of the images of the phase.
+     • categories : list. Categories to include in the run.
+     • keys : list. The two response keys.
+     
+     Returns
+    ——————————
+     • blocks : list of dictionaries holding the category, the yes and no keys and the ordered images
+       of each block.
+    '''
+    
+    blocks = []
+    # randomise the order of the categories, without changing the list we were given
+    for category in rng.permutation(categories).tolist():
+        # randomise the order of the keys
+        block_keys = rng.permutation(keys).tolist()
+        for yes_key in block_keys:
+            # the other key is the incorrect one
+            no_key = [key for key in block_keys if key != yes_key][0]
+            blocks.append({
+                'category': category,
+                'yes_key': yes_key,
+                'no_key': no_key,
+                'images': rng.permutation(stim_files).tolist()
+            })
+    
+    return blocks
+
+
+
+def run(win, stimuli, exp_phase, categories = ['face', 'scene', 'body'], keys = ['f', 'j'], interval_time=0.4, feedback_time=0.5, interval_frames=None, feedback_frames=None, response_window=None, estimates=None, block_size=None, max_target_run=None, monitor=None, cache=None, keyboard=None, prefetch=None, profile=None, logger=None, verifier=None, criterion=None, state=None, run_label=None, blocks=None, report=None):
     
     '''
     This function plays a run of a detection task. A run consists of several conditions, played randomly one 
@@ -124,63 +303,176 @@ def run(win, stimuli, exp_phase, categories = ['face', 'scene', 'body'], keys =
      • exp_phase : either practice or main. Will determine which images to use and whether feedback is given.
      • categories : list. Categories to include in the run. Defaults to all the categories.
      • keys : list. The two keys to use to indicate whether the category is present. Defaults to 'f' and 'j'.
-     • exp_parameters : the experimental parameters to use in each block.
+     • interval_time : duration of the fixation cross before each image, in seconds. Defaults to 0.4.
+     • feedback_time : duration of the feedback in practice trials, in seconds. Defaults to 0.5.
+     • interval_frames, feedback_frames : the same durations in frames of the display. If None, they
+       are converted from the times above with the refresh rate of the window; either way they are
+       played by counting flips, so they are exact multiples of the frame.
+     • response_window : time left to respond after each image, in seconds. Trials without a response
+       by then are misses and the block goes on. None to wait for the response as long as it takes.
+       A block of the plan can set its own with a 'response_window' entry.
+     • estimates : an ImageEstimates, updated with every trial played.
+     • block_size : int. If given with 'estimates', each block only shows this many images, those whose
+       RT is the least certain so far, in the order planned for the block. None to show all of them.
+     • max_target_run : int. Maximum number of consecutive targets in the blocks shortened with
+       'block_size', as in the schedule they come from. None for no limit.
+     • monitor : a PerformanceMonitor, updated with every trial and checked at the end of each block.
+     • cache : a StimulusCache shared across runs, with the screens of the task. If None, one is
+       created, generating the question, break and feedback screens for the given categories and keys,
+       and, unless 'prefetch' is used, the images of the phase are preloaded before the first block.
+     • keyboard : the keyboard to collect responses from. Defaults to a psychopy Keyboard, or to the
+       simulated keyboard of a SimulatedWindow.
+     • prefetch : int. If above 0, images are not preloaded but decoded in the background this many
+       trials ahead of the current one. If None, taken from the profile, 0 without one.
+     • profile : the calibration profile of the station (see 'scripts.calibration'). If given, the
+       cache created here gets the size it recommends, and durations are converted to frames with the
+       refresh rate it measured. The timings are not checked against it here, but once per session
+       ('scripts.calibration.check_profile').
+     • logger : a TrialLogger. If given, every trial is written to its log as soon as it is played.
+     • verifier : a FrameVerifier. If given, the frame showing each stimulus is read back and checked
+       against the stimulus expected (see 'scripts.verification').
+     • criterion : a PracticeCriterion. If given, each block ends as soon as the participant meets it
+       (see 'scripts.criterion'), and its decision is logged with every trial.
+     • state : a SessionState. If given, the order of the run is drawn from (or, when resuming, taken
+       from) the session, and each block is checkpointed when completed; completed blocks are skipped.
+     • run_label : name of the run in the session, e.g. 'run1'. Required with 'state'.
+     • blocks : the blocks to play, e.g. from a compiled schedule ('schedule_blocks'). If None, the
+       order of the blocks and trials is drawn at random.
+     • report : a function called with each line of text summarising a block (its timing, its alerts
+       and, in the practice, why it ended), e.g. print. None to play the run silently.
      
      Returns
     ——————————
      • df : the resulting data from the runs.
     '''
     
-    # create an empty dataframe
-    df = pd.DataFrame()
+    if state is not None and run_label is None:
+        raise ValueError("'run_label' is needed to keep track of the run in the session")
+    
+    # collect the data of each block, to be put together once at the end
+    block_dfs = []
     
-    # start a block number count
-    block_nbr = 0
+    # the settings measured on this station
+    if prefetch is None:
+        prefetch = profile['recommended']['prefetch'] if profile is not None else 0
     
-    # start by randomising the order of the categories
-    np.random.shuffle(categories)
+    # decode and upload all the images of the phase before the first trial
+    if cache is None:
+        screens = ScreenRenderer(win.size, task_screens(categories, keys))
+        if profile is not None:
+            cache = StimulusCache(win, max_bytes = profile['recommended']['cache_mb'] * 1024**2, screens = screens)
+        else:
+            cache = StimulusCache(win, screens = screens)
+        if not prefetch:
+            preload_stimuli(cache, stimuli.loc[stimuli['exp_phase']==exp_phase], categories, keys)
+    
+    # onsets and responses are all stamped on the same clock, with frames as long as measured on this
+    # station if the display is the one it was calibrated with
+    timer = TrialTimer(win, keyboard)
+    if profile is not None and matches_window(profile, win):
+        timer.frame_period = profile['display']['frame_period']
+    # the fixation and feedback last a whole number of frames
+    interval_frames = interval_frames or timer.to_frames(interval_time)
+    feedback_frames = feedback_frames or timer.to_frames(feedback_time)
+    
+    # the stimuli of the phase
+    phase_stimuli = stimuli.loc[stimuli['exp_phase']==exp_phase].set_index('stim_file', drop=False)
+    
+    # draw the order of the blocks and trials unless it was planned beforehand, or take it from the
+    # session if it was already drawn
+    if blocks is None:
+        draw = lambda rng: draw_blocks(rng, phase_stimuli['stim_file'].tolist(), categories, keys)
+    else:
+        draw = lambda rng, planned = blocks: planned
+    if state is not None:
+        blocks = state.plan_run(run_label, draw)
+    else:
+        blocks = draw(np.random.default_rng())
     
     # run 2 key conditions per category
-    for category in categories:
-        
-        # start by randomising the order of the keys
-        np.random.shuffle(keys)
-        
-        for key in keys:
-            
-            # define the correct key
-            yes_key = key
-            # define the incorrect key
-            no_key  = [key for key in keys if key != yes_key][0]
-            
-            # take in the stimuli and randomise their order
-            images = stimuli.loc[stimuli['exp_phase']==exp_phase].sample(frac=1)
-            
-            # run the block for that key and category condition
-            data = run_block(
-                win = win, 
-                images = images, 
-                yes_key = yes_key, 
-                no_key = no_key, 
-                category = category,
-                exp_parameters={'interval_time':interval_time, 'feedback_time':feedback_time})
-            
-            # after the block, increase block number count
-            block_nbr += 1
-            
-            # # play a break after each block except the last one
-            if category != categories[-1]:
-                visual.ImageStim(win, fr'instructions/break.png').draw()
-                win.flip()
-                event.waitKeys(keyList = ('space'))
-            
-            # append the block data to the run data
-            datadf = pd.DataFrame.from_dict(data)
-            # add some important info
-            datadf['block'] = block_nbr
-            datadf['task'] = category
-            # create the final df to export
-            df = pd.concat([df, datadf]).reset_index(drop=True)
+    for block_index, block in enumerate(blocks):
+        
+        # the block number count starts at 1
+        block_nbr = block_index + 1
+        
+        # skip the blocks completed before the session was interrupted
+        if block.get('done'):
+            continue
+        
+        # take in the stimuli in their randomised order, only the least known ones in adaptive mode
+        block_images = block['images']
+        if estimates is not None and block_size is not None:
+            block_images = estimates.select(block_images, block['category'], block_size, max_target_run)
+        images = phase_stimuli.loc[block_images].reset_index(drop=True)
+        
+        # tell the log (and the frame checks) which block the trials belong to
+        if logger is not None:
+            logger.set_context(block = block_nbr, task = block['category'], yes_key = block['yes_key'])
+        if verifier is not None:
+            verifier.set_context(block = block_nbr)
+        
+        # follow the performance of the block live
+        if monitor is not None:
+            monitor.start_block(run_label, block_nbr, block['category'], block['yes_key'])
+        # and judge it on its own
+        if criterion is not None:
+            criterion.start_block()
+        
+        # run the block for that key and category condition
+        data = run_block(
+            win = win, 
+            images = images, 
+            yes_key = block['yes_key'], 
+            no_key = block['no_key'], 
+            category = block['category'],
+            exp_parameters={'interval_frames':interval_frames, 'feedback_frames':feedback_frames, 'prefetch':prefetch,
+                            'response_window':block.get('response_window', response_window)},
+            cache = cache,
+            timer = timer,
+            logger = logger,
+            estimates = estimates,
+            monitor = monitor,
+            verifier = verifier,
+            criterion = criterion)
+        
+        # alert the experimenter if the participant doesn't follow the task
+        if monitor is not None:
+            alerts = monitor.end_block()
+            if report is not None:
+                for message in alerts:
+                    report(f"Alert, run {run_label} block {block_nbr} ({block['category']}, yes = {block['yes_key']}): {message}")
+        
+        # checkpoint the block once its trials are on disk
+        if state is not None:
+            if logger is not None:
+                logger.sync()
+            state.complete_block(run_label, block_index)
+        
+        # # play a break after each block except the last one
+        if block['category'] != blocks[-1]['category']:
+            show_screen(win, cache, timer, fr'instructions/break.png')
+        
+        # append the block data to the run data
+        datadf = pd.DataFrame.from_dict(data)
+        # add some important info
+        datadf['block'] = block_nbr
+        datadf['task'] = block['category']
+        block_dfs.append(datadf)
+        
+        # how well the frames of the block were timed
+        if report is not None:
+            summary = frame_summary(datadf).iloc[0]
+            report(f"Block {block_nbr}: {summary['late_trials']} of {summary['trials']} trials with dropped frames, "
+                   f"mean onset error {summary['mean_onset_error_ms']:.2f} ms, "
+                   f"{datadf['timeout'].mean():.1%} of trials timed out")
+            if criterion is not None:
+                ending = {'criterion': 'criterion met', 'max_trials': 'most trials allowed', '': 'criterion not met'}
+                report(f"Block {block_nbr}: practice ended after {criterion.trials} trials ({ending[criterion.stop]})")
+    
+    # create the final df to export, empty if all the blocks were already played
+    if not block_dfs:
+        return pd.DataFrame()
+    df = pd.concat(block_dfs).reset_index(drop=True)
 
     return df
 
@@ -0,0 +1,459 @@
+# Asynchronous keyboard, read on its own thread, used by 'TrialTimer' and the main experiment script
+#
+#     python -m scripts.keyboard test
+#     python -m scripts.keyboard replay 2023-02-15_ppt12_keys.csv
+
+import os, select, struct, sys, threading, time
+from collections import deque
+import pandas as pd
+
+
+def _psychopy_time():
+    # the clock of the TrialTimer, imported only when needed so that the key logs can be read without psychopy
+    from psychopy import core
+    return core.getTime
+
+
+
+class KeyEvent:
+
+    '''
+    A key going down or up, with the same attributes as a psychopy key press: key name, time the key
+    went down ('tDown', on the clock of the keyboard) and time relative to the last reset of the
+    keyboard clock. 'duration' is filled in once the release of the key is read.
+    '''
+
+    def __init__(self, name, time, down, rt = None):
+        self.name = name
+        self.time = time
+        self.down = down
+        self.tDown = time
+        self.rt = rt
+        self.duration = None
+
+
+
+class KeyboardClock:
+
+    '''
+    The clock key presses are timed from, reset at each stimulus onset. Same interface as psychopy
+    clocks, on a given time base.
+
+    Parameters
+    ——————————
+     • getTime : function returning the current time, in seconds. Defaults to the psychopy clock.
+    '''
+
+    def __init__(self, getTime = None):
+        if getTime is None:
+            getTime = _psychopy_time()
+        self._getTime = getTime
+        self._reset_time = getTime()
+
+    def getTime(self):
+        return self._getTime() - self._reset_time
+
+    def reset(self, newT = 0.):
+        self._reset_time = self._getTime() + newT
+
+    def getLastResetTime(self):
+        return self._reset_time
+
+
+
+def _evdev_name(code):
+    # 'KEY_F' -> 'f', 'KEY_SPACE' -> 'space', as psychopy names the keys
+    from evdev import ecodes
+    name = ecodes.KEY.get(code, str(code))
+    if isinstance(name, list):
+        name = name[0]
+    return name[4:].lower() if name.startswith('KEY_') else name.lower()
+
+
+
+# ioctl setting the clock the kernel stamps the events of an input device with (EVIOCSCLOCKID)
+EVIOCSCLOCKID = 0x400445a0
+
+
+class EvdevDevice:
+
+    '''
+    A keyboard read directly from its Linux input device with evdev, without going through the window
+    events. The kernel stamps every event when the key changes state, which tells how long each event
+    waited before being read. The device is asked to stamp them on the monotonic clock, so that setting
+    the system time during a session (e.g. by NTP) doesn't shift the ages; if it can't, the wall clock
+    is used. Needs the 'evdev' package and read access to /dev/input.
+
+    Parameters
+    ——————————
+     • path : path of the input device, e.g. '/dev/input/event3'. If None, the first device with
+       letter and space keys is used.
+    '''
+
+    def __init__(self, path = None):
+
+        # Linux only, like the input devices
+        import evdev, fcntl
+        self._evdev = evdev
+        if path is None:
+            path = next((path for path in evdev.list_devices() if self._is_keyboard(evdev.InputDevice(path))), None)
+            if path is None:
+                raise OSError('no readable keyboard found in /dev/input')
+        self.device = evdev.InputDevice(path)
+        self.name = self.device.name
+        # the clock of the event stamps, and the same clock here to tell their age
+        try:
+            fcntl.ioctl(self.device.fd, EVIOCSCLOCKID, struct.pack('i', time.CLOCK_MONOTONIC))
+            self.clock_id = time.CLOCK_MONOTONIC
+        except OSError as error:
+            print(f'Key events stamped on the wall clock, not the monotonic clock: {error}')
+            self.clock_id = time.CLOCK_REALTIME
+
+
+    def _is_keyboard(self, device):
+        keys = device.capabilities().get(self._evdev.ecodes.EV_KEY, [])
+        return self._evdev.ecodes.KEY_F in keys and self._evdev.ecodes.KEY_SPACE in keys
+
+
+    def read(self, timeout):
+
+        '''
+        Waits at most 'timeout' seconds for key events and returns them as (name, down, age) tuples,
+        'age' being how long ago the event happened, in seconds. Auto-repeats are left out.
+        '''
+
+        ready, _, _ = select.select([self.device.fd], [], [], timeout)
+        if not ready:
+            return []
+        events = []
+        for event in self.device.read():
+            # 0 is a release, 1 a press and 2 an auto-repeat
+            if event.type == self._evdev.ecodes.EV_KEY and event.value in (0, 1):
+                age = time.clock_gettime(self.clock_id) - event.timestamp()
+                events.append((_evdev_name(event.code), event.value == 1, age))
+        return events
+
+
+    def close(self):
+        self.device.close()
+
+
+
+class ReplayDevice:
+
+    '''
+    A fake input device replaying a sequence of key events in real time, e.g. a key log saved by
+    'AsyncKeyboard.save', so that the input path can be run and checked without a keyboard. The first
+    event is replayed 'delay' seconds after the device is first read.
+
+    Parameters
+    ——————————
+     • events : list of (time, name, down) tuples, time in seconds on any time base.
+     • delay : time before the first event, in seconds.
+    '''
+
+    def __init__(self, events, delay = 0.):
+
+        events = sorted(events, key = lambda event: event[0])
+        first = events[0][0] if events else 0.
+        # times of the events from the start of the replay
+        self._events = deque((t - first + delay, name, bool(down)) for t, name, down in events)
+        self._start = None
+        self.name = 'replay'
+
+
+    @classmethod
+    def from_csv(cls, path, delay = 0.):
+
+        '''
+        Replays a key log saved by 'AsyncKeyboard.save'.
+        '''
+
+        keys = read_keys(path)
+        return cls(list(zip(keys['time'], keys['name'], keys['down'])), delay)
+
+
+    def read(self, timeout):
+
+        '''
+        Same as 'EvdevDevice.read': waits at most 'timeout' seconds for the next events.
+        '''
+
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = now
+        if not self._events:
+            time.sleep(timeout)
+            return []
+        # sleep until the next event is due, at most for the timeout
+        due = self._start + self._events[0][0]
+        if due > now:
+            time.sleep(min(timeout, due - now))
+            now = time.perf_counter()
+        events = []
+        while self._events and self._start + self._events[0][0] <= now:
+            t, name, down = self._events.popleft()
+            events.append((name, down, now - (self._start + t)))
+        return events
+
+
+    @property
+    def finished(self):
+        return not self._events
+
+
+    def close(self):
+        self._events.clear()
+
+
+
+class AsyncKeyboard:
+
+    '''
+    A keyboard read on a dedicated thread, with the same interface as a psychopy Keyboard for what the
+    experiment uses. The thread blocks on the input device and stamps each event as soon as it arrives,
+    on the same clock as the stimulus onsets, corrected by the age the device reports for it. Events are
+    handed to the trial loop through a deque: appending on one end and popping from the other are
+    atomic, so neither side ever takes a lock or waits for the other.
+
+    Presses that come before the onset of the stimulus (after the previous response) are kept apart as
+    anticipations, and releases give the duration of each press. Every event is kept in 'history', to be
+    saved as the key log of the session.
+
+    Parameters
+    ——————————
+     • device : the input device, an EvdevDevice or a ReplayDevice.
+     • getTime : function giving the time of the stimulus onsets. Defaults to the psychopy clock, which
+       the TrialTimer uses.
+     • poll_interval : how long the main thread sleeps while waiting for a key, in seconds.
+    '''
+
+    def __init__(self, device, getTime = None, poll_interval = 0.0005):
+
+        self.device = device
+        self.getTime = getTime if getTime is not None else _psychopy_time()
+        self.clock = KeyboardClock(self.getTime)
+        self.poll_interval = poll_interval
+        # every event read so far, the presses before the last onset, and the presses not released yet
+        self.history = []
+        self.anticipations = []
+        self._held = {}
+        # events stamped by the reader thread, not yet seen by the trial loop
+        self._events = deque()
+        self._running = True
+        self._thread = threading.Thread(target = self._read_events, name = 'keyboard', daemon = True)
+        self._thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def _read_events(self):
+        while self._running:
+            for name, down, age in self.device.read(0.05):
+                self._events.append(KeyEvent(name, self.getTime() - age, down))
+
+
+    def _next_event(self):
+        # the oldest event waiting, or None; releases complete the press they end
+        try:
+            event = self._events.popleft()
+        except IndexError:
+            return None
+        self.history.append(event)
+        if event.down:
+            self._held[event.name] = event
+        elif event.name in self._held:
+            press = self._held.pop(event.name)
+            press.duration = event.time - press.time
+        return event
+
+
+    def clearEvents(self, eventType = None):
+
+        '''
+        Drops the events waiting, keeping the presses as anticipations of the next stimulus.
+        '''
+
+        self.anticipations = []
+        while (event := self._next_event()) is not None:
+            if event.down:
+                self.anticipations.append(event)
+
+
+    def getKeys(self, keyList = None, **kwargs):
+
+        '''
+        Returns the presses of the given keys waiting, without blocking. Presses that went down before
+        the last reset of the clock (the last onset) are anticipations, not responses.
+        '''
+
+        keys = []
+        while (event := self._next_event()) is not None:
+            if self._is_response(event, keyList):
+                keys.append(event)
+        return keys
+
+
+    def _is_response(self, event, keyList):
+        # a press of one of the keys after the last onset; earlier presses are kept as anticipations
+        if not event.down or (keyList is not None and event.name not in keyList):
+            return False
+        if event.time < self.clock.getLastResetTime():
+            self.anticipations.append(event)
+            return False
+        event.rt = event.time - self.clock.getLastResetTime()
+        return True
+
+
+    def waitKeys(self, maxWait = float('inf'), keyList = None, **kwargs):
+
+        '''
+        Waits for a press of one of the given keys (any key if None), at most 'maxWait' seconds.
+        Returns a list holding the press, empty if none came in time.
+        '''
+
+        end = time.perf_counter() + maxWait
+        while True:
+            # events are taken one at a time, so that those after the press stay for the next read
+            while (event := self._next_event()) is not None:
+                if self._is_response(event, keyList):
+                    return [event]
+            if time.perf_counter() > end:
+                return []
+            time.sleep(self.poll_interval)
+
+
+    def key_log(self):
+
+        '''
+        Returns every key event read so far as a dataframe, one row per press or release.
+        '''
+
+        return pd.DataFrame({'time': [event.time for event in self.history],
+                             'name': [event.name for event in self.history],
+                             'down': [int(event.down) for event in self.history]})
+
+
+    def save(self, path):
+
+        '''
+        Saves the key log, see 'key_log'. Events are appended if the file already exists, e.g. when a
+        session is resumed.
+        '''
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.key_log().to_csv(path, mode = 'a', header = not exists, index = False)
+
+
+    def close(self):
+
+        '''
+        Stops the reader thread and closes the device.
+        '''
+
+        self._running = False
+        self._thread.join()
+        self.device.close()
+
+
+
+def open_keyboard():
+
+    '''
+    Opens the keyboard directly with evdev on Linux. Returns None where it's not possible (other systems,
+    evdev missing, no permission on /dev/input), in which case the psychopy Keyboard is used.
+    '''
+
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return AsyncKeyboard(EvdevDevice())
+    except (ImportError, OSError) as error:
+        print(f'Keyboard read through psychopy, not evdev: {error}')
+        return None
+
+
+
+def read_keys(path):
+
+    '''
+    Reads a key log saved by 'AsyncKeyboard.save'.
+    '''
+
+    return pd.read_csv(path, dtype = {'name': str})
+
+
+
+def add_releases(df, keys):
+
+    '''
+    Adds the time each response key was released, and how long it was held, to the trial data.
+
+    Parameters
+    ——————————
+     • df : the trial data, with the 'response' and 'key_time' of each trial.
+     • keys : the key log of the session, from 'AsyncKeyboard.key_log' or 'read_keys'.
+
+     Returns
+    ——————————
+     • df : a copy of the data with 'release_time' and 'key_duration' columns, empty for the trials
+       without a response (timeouts).
+    '''
+
+    releases = keys.loc[keys['down'] == 0, ['time', 'name']].sort_values('time')
+    releases = releases.rename(columns = {'time': 'release_time', 'name': 'response'})
+    releases['response'] = releases['response'].astype(str)
+    # only the trials with a key press have a release to look for
+    trials = df.reset_index()
+    responded = trials.loc[trials['key_time'].notna()].sort_values('key_time')
+    responded = responded.astype({'response': str})
+    # the first release of the response key after it went down
+    matched = pd.merge_asof(responded[['index', 'key_time', 'response']], releases, left_on = 'key_time',
+                            right_on = 'release_time', by = 'response', direction = 'forward')
+    trials['release_time'] = trials['index'].map(matched.set_index('index')['release_time']).astype(float)
+    trials = trials.set_index('index')
+    trials.index.name = df.index.name
+    trials['key_duration'] = trials['release_time'] - trials['key_time']
+
+    return trials
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('test', 'replay') or (sys.argv[1] == 'replay') != (len(sys.argv) == 3):
+        sys.exit('usage: python -m scripts.keyboard test | replay <key log>')
+
+    if sys.argv[1] == 'test':
+        # print the keys pressed and how long they took to reach us, until escape
+        keyboard = AsyncKeyboard(EvdevDevice())
+        print(f'Reading {keyboard.device.name}, press escape to stop')
+        while True:
+            key = keyboard.waitKeys()[0]
+            print(f'{key.name}: read {1000 * (keyboard.getTime() - key.time):.2f} ms after the press')
+            if key.name == 'escape':
+                break
+        keyboard.close()
+
+    else:
+        # replay a key log and check the events are stamped when they were replayed
+        logged = read_keys(sys.argv[2])['time'].sort_values().to_numpy()
+        device = ReplayDevice.from_csv(sys.argv[2], delay = 0.1)
+        keyboard = AsyncKeyboard(device, getTime = time.perf_counter)
+        while not device.finished:
+            time.sleep(0.05)
+        time.sleep(0.1)
+        keyboard.clearEvents()
+        keyboard.close()
+        # when each event was due, on the same clock
+        due = device._start + 0.1 + logged - logged[0]
+        replayed = pd.Series([event.time for event in keyboard.history])
+        error = 1000 * (replayed - due)
+        print(f'{len(replayed)} events replayed, stamping error {error.mean():.3f} ms on average, '
+              f'{error.abs().max():.3f} ms at most')
@@ -0,0 +1,203 @@
+# Streaming trial log, used by 'run' and the main experiment script
+
+import csv, io, os, queue, sys, threading, time
+import pandas as pd
+from scripts.scoring import score_trials
+
+
+class TrialLogger:
+
+    '''
+    Appends every trial to a CSV file as soon as it is played, so that a crash loses at most the trial
+    being played. The trial loop only puts the row in a queue; a background thread writes it, flushes
+    it to the operating system, and forces it to disk (fsync) every 'fsync_every' rows or
+    'fsync_interval' seconds, whichever comes first. This keeps the disk waits off the display thread.
+
+    The columns of the log are fixed once and for all: by 'columns', by the header of an existing log,
+    or else by the first row logged. A row with a field that isn't one of them raises a ValueError
+    rather than losing the field.
+
+    Parameters
+    ——————————
+     • path : path of the log file. Rows are appended if it already exists.
+     • columns : list of the columns of a new log. None to take them from the first row.
+     • fsync_every : int. Number of rows written between two fsyncs.
+     • fsync_interval : maximal time between two fsyncs, in seconds.
+    '''
+
+    def __init__(self, path, columns = None, fsync_every = 20, fsync_interval = 2.):
+
+        self.path = str(path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        # fields added to every row, e.g. the run number or the participant ID
+        self.context = {}
+        # keep the columns of an existing log, so that appended rows line up
+        self.columns = list(columns) if columns is not None else None
+        self._new = True
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, newline = '') as file:
+                self.columns = next(csv.reader(file))
+            self._new = False
+        # the writer thread
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target = self._write_rows, name = 'trial-logger', daemon = True)
+        self._thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def set_context(self, **fields):
+
+        '''
+        Sets fields to add to every following row.
+        '''
+
+        self.context.update(fields)
+
+
+    def log(self, row):
+
+        '''
+        Queues a trial for writing. Returns immediately.
+
+        Parameters
+        ——————————
+         • row : dictionary holding the data of the trial.
+        '''
+
+        row = {**row, **self.context}
+        # the first row sets the columns of a new log, if they weren't given
+        if self.columns is None:
+            self.columns = list(row)
+        unknown = [name for name in row if name not in self.columns]
+        if unknown:
+            raise ValueError(f'{self.path} has no column for {unknown}')
+        self._queue.put(row)
+
+
+    def _write_rows(self):
+
+        with open(self.path, 'a', newline = '') as file:
+
+            writer = None
+            unsynced, last_sync = 0, time.monotonic()
+
+            while True:
+                row = self._queue.get()
+                # None is the signal to stop
+                if row is None:
+                    break
+                # an event asks for everything so far to be on disk
+                if isinstance(row, threading.Event):
+                    file.flush()
+                    os.fsync(file.fileno())
+                    unsynced, last_sync = 0, time.monotonic()
+                    row.set()
+                    continue
+
+                # a new log starts with its header
+                if writer is None:
+                    writer = csv.DictWriter(file, fieldnames = self.columns, restval = '', lineterminator = '\n')
+                    if self._new:
+                        writer.writeheader()
+                writer.writerow(row)
+                file.flush()
+                unsynced += 1
+
+                # force the rows to disk from time to time
+                if unsynced >= self.fsync_every or time.monotonic() - last_sync > self.fsync_interval:
+                    os.fsync(file.fileno())
+                    unsynced, last_sync = 0, time.monotonic()
+
+            file.flush()
+            os.fsync(file.fileno())
+
+
+    def sync(self):
+
+        '''
+        Waits until all the rows queued so far are written and forced to disk. Meant for the ends of
+        blocks, not for the trial loop.
+        '''
+
+        if self._thread.is_alive():
+            synced = threading.Event()
+            self._queue.put(synced)
+            synced.wait()
+
+
+    def close(self):
+
+        '''
+        Writes the rows still queued, forces them to disk and stops the writer thread.
+        '''
+
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+
+def read_log(path):
+
+    '''
+    Reads a trial log into a dataframe. A last row cut short by a crash is dropped. Participant IDs and
+    responses are read as text, so that e.g. leading zeros are kept.
+
+    Parameters
+    ——————————
+     • path : path of the log file.
+
+     Returns
+    ——————————
+     • df : the trials logged, one row per trial.
+    '''
+
+    with open(path, newline = '') as file:
+        text = file.read()
+
+    # every complete row ends with a line break
+    if not text.endswith('\n'):
+        text = text[:text.rfind('\n') + 1]
+    if not text:
+        return pd.DataFrame()
+
+    return pd.read_csv(io.StringIO(text), dtype = {'ID': str, 'response': str})
+
+
+
+def recover_session(log_path, out_path):
+
+    '''
+    Rebuilds a valid output file from the log of a session that did not finish, scoring its trials.
+    Returns the recovered dataframe.
+
+    Parameters
+    ——————————
+     • log_path : path of the trial log of the session.
+     • out_path : path of the CSV file to write.
+    '''
+
+    df = read_log(log_path)
+    if len(df):
+        df = score_trials(df)
+    df.to_csv(out_path)
+
+    return df
+
+
+
+if __name__ == '__main__':
+
+    # python -m scripts.logger <log file> <output file>
+    if len(sys.argv) != 3:
+        sys.exit('usage: python -m scripts.logger <log file> <output file>')
+    recovered = recover_session(sys.argv[1], sys.argv[2])
+    print(f'Recovered {len(recovered)} trials into {sys.argv[2]}')
@@ -0,0 +1,203 @@
+# Manifest of the stimulus set, checked by the main experiment script at startup
+#
+#     python -m scripts.manifest build ./stimuli
+#     python -m scripts.manifest verify ./stimuli
+
+import hashlib, io, json, os, sys
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from PIL import Image
+
+
+MANIFEST_NAME = 'manifest.csv'
+
+
+def _scan_file(folder, name):
+    # everything the manifest keeps about one image, reading the file once
+    with open(os.path.join(folder, name), 'rb') as file:
+        content = file.read()
+    with Image.open(io.BytesIO(content)) as img:
+        width, height = img.size
+        mode = img.mode
+    # the file names are <phase>_<category>_<number>
+    exp_phase, stim_cat, stim_nb = os.path.splitext(name)[0].split('_')
+    return {
+        'name': name,
+        'exp_phase': exp_phase,
+        'stim_cat': stim_cat,
+        'stim_nb': stim_nb,
+        'width': width,
+        'height': height,
+        'mode': mode,
+        'bytes': len(content),
+        'sha256': hashlib.sha256(content).hexdigest()
+    }
+
+
+
+def _hash_file(path):
+    # content hash of a file, read in chunks
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024**2), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+
+def _list_images(folder):
+    return sorted(name for name in os.listdir(folder) if name.endswith('.png'))
+
+
+
+def _stat_path(manifest_path):
+    # the sizes and times of the files last verified, kept next to the manifest but specific to the machine
+    return os.path.splitext(manifest_path)[0] + '.stat.json'
+
+
+
+def build_manifest(folder = r'./stimuli', workers = 8):
+
+    '''
+    Scans the stimulus set once, in parallel, and saves its manifest in the folder: phase, category and
+    number of each image, with its pixel size, colour mode, byte size and content hash.
+
+    Parameters
+    ——————————
+     • folder : folder of the stimuli.
+     • workers : int. Number of files read at the same time.
+
+     Returns
+    ——————————
+     • manifest : the manifest, one row per image.
+    '''
+
+    names = _list_images(folder)
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        rows = list(pool.map(lambda name: _scan_file(folder, name), names))
+
+    manifest = pd.DataFrame(rows)
+    manifest.to_csv(os.path.join(folder, MANIFEST_NAME), index = False)
+    # the files were just hashed, so they are verified as they are now
+    _save_stats(folder, names)
+
+    return manifest
+
+
+
+def _save_stats(folder, names, stats = None):
+    stats = dict(stats or {})
+    for name in names:
+        stat = os.stat(os.path.join(folder, name))
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+    with open(_stat_path(os.path.join(folder, MANIFEST_NAME)), 'w') as file:
+        json.dump(stats, file)
+
+
+
+def load_manifest(folder = r'./stimuli', verify = True):
+
+    '''
+    Loads the manifest of the stimulus set and, by default, checks that the set was not changed since
+    it was built. The check is incremental: files with the same byte size and modification time as when
+    they were last verified are trusted, and only the others are hashed again. Refuses to go on if an
+    image was added, removed or modified, or if there is no manifest to check the set against.
+
+    Parameters
+    ——————————
+     • folder : folder of the stimuli.
+     • verify : bool. Whether to check the stimulus set against the manifest.
+
+     Returns
+    ——————————
+     • stim_df : a dataframe with the file, phase, category and number of each stimulus, plus the
+       columns of the manifest.
+    '''
+
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    # without a manifest nothing says the set is the intended one, it has to be built on purpose
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f'No stimulus manifest in {folder}: check that the stimuli are the intended '
+                                f'ones, then build it with: python -m scripts.manifest build {folder}')
+    manifest = pd.read_csv(manifest_path, dtype = {'stim_nb': str})
+
+    if verify:
+        verify_manifest(folder, manifest)
+
+    stim_df = manifest.copy()
+    stim_df.insert(0, 'stim_file', [os.path.join(folder, name) for name in manifest['name']])
+
+    return stim_df
+
+
+
+def verify_manifest(folder, manifest):
+
+    '''
+    Checks the stimulus set against its manifest, see 'load_manifest'. Raises a ValueError listing the
+    differences, if any.
+
+    Parameters
+    ——————————
+     • folder : folder of the stimuli.
+     • manifest : the manifest of the set.
+    '''
+
+    # the files themselves
+    names = _list_images(folder)
+    missing = sorted(set(manifest['name']) - set(names))
+    added = sorted(set(names) - set(manifest['name']))
+
+    # the sizes and times of the files when they were last verified
+    stat_path = _stat_path(os.path.join(folder, MANIFEST_NAME))
+    stats = {}
+    if os.path.exists(stat_path):
+        with open(stat_path) as file:
+            stats = json.load(file)
+
+    # hash again only the files that look different
+    modified, verified = [], []
+    for name, sha256 in zip(manifest['name'], manifest['sha256']):
+        if name in missing:
+            continue
+        stat = os.stat(os.path.join(folder, name))
+        if stats.get(name) == [stat.st_size, stat.st_mtime_ns]:
+            continue
+        if _hash_file(os.path.join(folder, name)) != sha256:
+            modified.append(name)
+        else:
+            verified.append(name)
+
+    if missing or added or modified:
+        raise ValueError(f'The stimulus set in {folder} does not match its manifest: '
+                         f'missing {missing}, added {added}, modified {modified}')
+
+    # remember the files verified this time
+    if verified:
+        _save_stats(folder, verified, stats)
+
+
+
+def texture_bytes(stim_df):
+
+    '''
+    Returns the texture memory the images of a manifest will take once uploaded, in bytes (RGBA, one
+    byte per channel), e.g. to size the stimulus cache ahead of time.
+    '''
+
+    return int((stim_df['width'] * stim_df['height'] * 4).sum())
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ('build', 'verify'):
+        sys.exit('usage: python -m scripts.manifest build|verify [stimulus folder]')
+    folder = sys.argv[2] if len(sys.argv) == 3 else r'./stimuli'
+
+    if sys.argv[1] == 'build':
+        manifest = build_manifest(folder)
+        print(f'Manifest of {len(manifest)} images saved in {os.path.join(folder, MANIFEST_NAME)}')
+    else:
+        stim_df = load_manifest(folder)
+        print(f'{len(stim_df)} images match the manifest ({texture_bytes(stim_df) / 1024**2:.1f} MB of textures)')
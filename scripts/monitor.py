@@ -0,0 +1,242 @@
+# Live performance of the participant during the session, used by 'run' and the main experiment script
+#
+#     python -m scripts.monitor 2023-02-15_ppt12_status.json
+
+import datetime, json, os, sys, threading, time
+
+
+class RunningStats:
+
+    '''
+    Streaming count, mean and variance of a variable (Welford's algorithm), in constant memory.
+    '''
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self._m2 = 0.
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def sd(self):
+        return (self._m2 / (self.n - 1)) ** .5 if self.n > 1 else float('nan')
+
+
+
+class PerformanceMonitor:
+
+    '''
+    Running statistics of the responses, updated by 'run_block' after every trial in constant time and
+    memory: mean and standard deviation of the RTs, accuracy per category to detect and yes key, and the
+    rate of fast guesses (RTs too short to follow the image) and timeouts.
+
+    The statistics are written to a small JSON status file every 'interval' seconds by a background
+    thread, so the display thread only updates counters; the experimenter can follow the file from
+    another terminal. At the end of each block, alerts are raised if the accuracy of the responses is
+    low (including far below chance, which usually means the keys were swapped), or if there are many
+    fast guesses or timeouts. Timeouts get their own alert rather than counting as errors, so a
+    participant who is slow is not taken for one who swapped the keys. Alerts are printed and appended
+    to a log file for review.
+
+    Parameters
+    ——————————
+     • path : path of the status file. None to keep the statistics in memory only.
+     • alerts_path : path of the alert log. None to only print the alerts.
+     • fast_guess : RTs below this, in seconds, count as fast guesses.
+     • min_accuracy : accuracy of the responses of a block (timeouts left out) below which an alert
+       is raised.
+     • max_fast_guesses : proportion of fast guesses in a block above which an alert is raised.
+     • max_timeouts : proportion of timeouts in a block above which an alert is raised.
+     • interval : time between two writes of the status file, in seconds.
+    '''
+
+    def __init__(self, path = None, alerts_path = None, fast_guess = 0.15, min_accuracy = 0.6,
+                 max_fast_guesses = 0.1, max_timeouts = 0.1, interval = 1.):
+
+        self.path = path
+        self.alerts_path = alerts_path
+        self.fast_guess = fast_guess
+        self.min_accuracy = min_accuracy
+        self.max_fast_guesses = max_fast_guesses
+        self.max_timeouts = max_timeouts
+        self.interval = interval
+        # the whole session, each category and yes key, and the current block
+        self.rt = RunningStats()
+        self.counts = {'trials': 0, 'correct': 0, 'fast_guesses': 0, 'timeouts': 0}
+        self.conditions = {}
+        self.block = None
+        self.alerts = []
+        # the writer thread
+        self._stop = threading.Event()
+        self._thread = None
+        if path is not None:
+            self._thread = threading.Thread(target = self._write_status, name = 'monitor', daemon = True)
+            self._thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def start_block(self, run, block, task, yes_key):
+
+        '''
+        Starts the statistics of a new block.
+        '''
+
+        self.block = {'run': run, 'block': block, 'task': task, 'yes_key': yes_key,
+                      'trials': 0, 'correct': 0, 'fast_guesses': 0, 'timeouts': 0}
+
+
+    def update(self, task, yes_key, rt, correct, timeout = False):
+
+        '''
+        Adds a trial to the statistics.
+
+        Parameters
+        ——————————
+         • task : the category to detect.
+         • yes_key : the key meaning 'present'.
+         • rt : the RT, in seconds (NaN if the trial timed out).
+         • correct : bool. Whether the response was correct.
+         • timeout : bool. Whether the trial timed out.
+        '''
+
+        fast_guess = not timeout and rt < self.fast_guess
+        if not timeout:
+            self.rt.add(rt)
+        condition = self.conditions.setdefault(f'{task}/{yes_key}', {'trials': 0, 'correct': 0})
+        for counts in (self.counts, condition, self.block):
+            if counts is None:
+                continue
+            counts['trials'] += 1
+            counts['correct'] += bool(correct)
+            if 'fast_guesses' in counts:
+                counts['fast_guesses'] += fast_guess
+                counts['timeouts'] += bool(timeout)
+
+
+    def end_block(self):
+
+        '''
+        Checks the block that just ended and raises its alerts, saved in the alerts file. Returns the alerts
+        of the block, for the caller to show.
+        '''
+
+        block, alerts = self.block, []
+        if not block or not block['trials']:
+            return alerts
+        # the accuracy of the responses: a timeout is neither key, so it says nothing about a swap
+        responses = block['trials'] - block['timeouts']
+        accuracy = block['correct'] / responses if responses else float('nan')
+        fast_guesses = block['fast_guesses'] / block['trials']
+        timeouts = block['timeouts'] / block['trials']
+        if accuracy < 1 - self.min_accuracy:
+            alerts.append(f'accuracy {accuracy:.0%} of the responses, far below chance: were the keys swapped?')
+        elif accuracy < self.min_accuracy:
+            alerts.append(f'accuracy {accuracy:.0%} of the responses, below {self.min_accuracy:.0%}')
+        if fast_guesses > self.max_fast_guesses:
+            alerts.append(f'{fast_guesses:.0%} of the responses faster than {1000 * self.fast_guess:.0f} ms')
+        if timeouts > self.max_timeouts:
+            alerts.append(f'{timeouts:.0%} of the trials timed out')
+
+        for message in alerts:
+            alert = {'time': datetime.datetime.now().isoformat(timespec = 'seconds'), 'run': block['run'],
+                     'block': block['block'], 'task': block['task'], 'yes_key': block['yes_key'], 'alert': message}
+            self.alerts.append(alert)
+            if self.alerts_path is not None:
+                with open(self.alerts_path, 'a') as file:
+                    file.write(json.dumps(alert) + '\n')
+
+        return alerts
+
+
+    def status(self):
+
+        '''
+        Returns the current statistics as a dictionary.
+        '''
+
+        def rates(counts):
+            trials = counts['trials']
+            return {**counts, 'accuracy': counts['correct'] / trials if trials else None}
+
+        return {
+            'time': datetime.datetime.now().isoformat(timespec = 'seconds'),
+            'session': {**rates(self.counts), 'mean_rt': self.rt.mean if self.rt.n else None,
+                        'sd_rt': self.rt.sd if self.rt.n > 1 else None},
+            'block': rates(self.block) if self.block else None,
+            'conditions': {name: rates(counts) for name, counts in dict(self.conditions).items()},
+            'alerts': self.alerts[-5:]
+        }
+
+
+    def _write_status(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+
+    def write(self):
+
+        '''
+        Writes the status file, atomically so a reader never sees it half-written.
+        '''
+
+        if self.path is None:
+            return
+        # the trial loop keeps updating the counters meanwhile, a snapshot a trial off is fine
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.status(), file, indent = 1)
+        os.replace(tmp_path, self.path)
+
+
+    def close(self):
+
+        '''
+        Stops the writer thread, after a last write of the status file.
+        '''
+
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2:
+        sys.exit('usage: python -m scripts.monitor <status file>')
+
+    # follow the status file of a session until interrupted
+    try:
+        while True:
+            if os.path.exists(sys.argv[1]):
+                with open(sys.argv[1]) as file:
+                    status = json.load(file)
+                session, block = status['session'], status['block'] or {}
+                lines = [status['time'],
+                         f"Session: {session['trials']} trials, accuracy {session['accuracy'] or 0:.1%}, "
+                         f"RT {session['mean_rt'] or 0:.3f} ± {session['sd_rt'] or 0:.3f} s, "
+                         f"{session['fast_guesses']} fast guesses, {session['timeouts']} timeouts"]
+                if block:
+                    lines.append(f"Run {block['run']} block {block['block']} ({block['task']}, yes = {block['yes_key']}): "
+                                 f"{block['trials']} trials, accuracy {block['accuracy'] or 0:.1%}")
+                lines += [f"  {name}: accuracy {counts['accuracy'] or 0:.1%} over {counts['trials']} trials"
+                          for name, counts in status['conditions'].items()]
+                lines += [f"  alert, run {alert['run']} block {alert['block']}: {alert['alert']}" for alert in status['alerts']]
+                print('\033[H\033[J' + '\n'.join(lines))
+            time.sleep(1.)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,113 @@
+# Background loading of the upcoming stimuli, used by 'run_block'
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+
+def decode_image(file):
+
+    '''
+    Reads and decodes an image file into memory. Returns a PIL image.
+
+    Parameters
+    ——————————
+     • file : path to the image.
+    '''
+
+    with Image.open(file) as img:
+        # 'load' forces the decoding here rather than when the pixels are first used
+        img.load()
+        return img.convert('RGB')
+
+
+
+def decode_images(files, workers = 4):
+
+    '''
+    Reads and decodes many image files at once on a pool of worker threads, e.g. every image of the
+    session while the participant dialog is shown. Returns a dictionary mapping each file to its
+    decoded PIL image, to hand to 'StimulusCache.preload'.
+
+    Parameters
+    ——————————
+     • files : iterable of paths to the images.
+     • workers : int. Number of worker threads.
+    '''
+
+    files = list(dict.fromkeys(files))
+    with ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'decode') as pool:
+        return dict(zip(files, pool.map(decode_image, files)))
+
+
+
+class Prefetcher:
+
+    '''
+    Reads and decodes the images of a block in trial order on a pool of worker threads, a few trials
+    ahead of the one being played. At most 'depth' images are waiting or being decoded at any time, so
+    memory use stays bounded. Only the decoding happens in the background: turning the decoded image
+    into a texture still has to be done on the main thread, which owns the OpenGL context.
+
+    Parameters
+    ——————————
+     • files : list of paths to the images, in trial order.
+     • depth : int. Number of images decoded ahead of the current trial.
+     • workers : int. Number of worker threads.
+    '''
+
+    def __init__(self, files, depth = 4, workers = 2):
+
+        self._files = iter(list(files))
+        self._pending = deque()
+        self._pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'prefetch')
+        # time the main thread spent waiting for each image
+        self.wait_times = []
+        # fill the queue
+        for _ in range(depth):
+            self._submit()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def _submit(self):
+        # queue the next image, if any are left
+        file = next(self._files, None)
+        if file is not None:
+            self._pending.append((file, self._pool.submit(decode_image, file)))
+
+
+    def get(self):
+
+        '''
+        Returns the next image in trial order as a (file, decoded image) tuple, waiting for it to be
+        decoded if needed, and queues the following one.
+        '''
+
+        file, future = self._pending.popleft()
+        # a refill keeps 'depth' images ahead of the trial
+        self._submit()
+        start = time.perf_counter()
+        image = future.result()
+        self.wait_times.append(time.perf_counter() - start)
+
+        return file, image
+
+
+    def close(self):
+
+        '''
+        Drops the images still queued and stops the worker threads.
+        '''
+
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._pool.shutdown(wait = True)
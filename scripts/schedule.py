@@ -0,0 +1,262 @@
+# Trial schedules, compiled ahead of the session for 'run'
+
+import numpy as np
+import pandas as pd
+
+
+# one row per trial: run and block (from 1), trial (from 0), category to detect (index in the list of
+# categories), stimulus (index in the phase stimuli sorted by file), target flag and yes key (index in
+# the list of keys)
+SCHEDULE_DTYPE = np.dtype([
+    ('run', 'u1'),
+    ('block', 'u1'),
+    ('trial', 'u2'),
+    ('category', 'u1'),
+    ('stim', 'u2'),
+    ('target', '?'),
+    ('yes_key', 'u1')
+])
+
+
+def phase_stimuli(stimuli, exp_phase):
+
+    '''
+    Returns the stimuli of a phase sorted by file, which is the order the 'stim' column of a schedule
+    refers to. Sorting makes the schedules independent of the order the files were listed in.
+
+    Parameters
+    ——————————
+     • stimuli : a dataframe holding the images to present.
+     • exp_phase : either practice or main.
+    '''
+
+    return stimuli.loc[stimuli['exp_phase']==exp_phase].sort_values('stim_file').reset_index(drop=True)
+
+
+
+def longest_run(flags):
+
+    '''
+    Returns the length of the longest run of True values along the last axis of a boolean array.
+    '''
+
+    flags = np.asarray(flags, dtype = bool)
+    positions = np.arange(flags.shape[-1])
+    # position of the last False seen so far (-1 before the first one)
+    last_false = np.maximum.accumulate(np.where(flags, -1, positions), axis = -1)
+    # length of the run of True ending at each position
+    run_length = np.where(flags, positions - last_false, 0)
+
+    return run_length.max(axis = -1, initial = 0)
+
+
+
+def limit_target_run(targets, max_target_run):
+
+    '''
+    Returns an order of trials, as close as possible to the given one, with at most 'max_target_run'
+    consecutive targets: a target that would make its run too long is put off until after the next
+    non-target. An order that already meets the limit is kept as it is. For orders that can't be drawn
+    again, e.g. a planned block some of whose images were left out.
+
+    Parameters
+    ——————————
+     • targets : the target flag of each trial, in their order.
+     • max_target_run : int. Maximum number of consecutive target trials.
+
+     Returns
+    ——————————
+     • order : array of the indices of the trials, in their new order.
+    '''
+
+    targets = np.asarray(targets, dtype = bool)
+    remaining = list(range(len(targets)))
+    order, run_length = [], 0
+    while remaining:
+        trial = remaining[0]
+        if targets[trial] and run_length >= max_target_run:
+            trial = next((trial for trial in remaining if not targets[trial]), None)
+            if trial is None:
+                raise ValueError(f'no trial order with at most {max_target_run} consecutive targets found')
+        remaining.remove(trial)
+        order.append(trial)
+        run_length = run_length + 1 if targets[trial] else 0
+
+    return np.array(order, dtype = int)
+
+
+
+def compile_schedules(stimuli, exp_phase, categories = ['face', 'scene', 'body'], keys = ['f', 'j'],
+                      n_runs = 1, n_participants = 1, seed = None, first_participant = 0,
+                      max_target_run = None, counterbalance_keys = True, max_redraws = 1000):
+
+    '''
+    Compiles the full schedule of a phase, for one or many participants at once. Everything is drawn in
+    a few vectorised steps from a single seed, so thousands of participants take well under a second,
+    e.g. to check the balance of a design before fielding it.
+
+    In each run, the categories come in a random order, each with one block per key order, and every
+    stimulus of the phase is shown once per block in a random order.
+
+    Parameters
+    ——————————
+     • stimuli : a dataframe holding the images to present.
+     • exp_phase : either practice or main.
+     • categories : list. Categories to detect, one per block pair.
+     • keys : list. The response keys.
+     • n_runs : int. Number of runs.
+     • n_participants : int. Number of participants to compile schedules for.
+     • seed : int. Seed of the random number generator.
+     • first_participant : int. Number of the first participant, used for counterbalancing.
+     • max_target_run : int. Maximum number of consecutive target trials. None for no limit.
+     • counterbalance_keys : bool. If True, the key the first block of each category starts with
+       rotates across participants, runs and categories. If False, it is random.
+     • max_redraws : int. Number of times trial orders breaking 'max_target_run' are drawn again
+       before giving up.
+
+     Returns
+    ——————————
+     • schedules : structured array of SCHEDULE_DTYPE, of shape (participants, runs × blocks × trials).
+    '''
+
+    rng = np.random.default_rng(seed)
+    stimuli = phase_stimuli(stimuli, exp_phase)
+    n_cats, n_keys, n_trials = len(categories), len(keys), len(stimuli)
+    n_blocks = n_cats * n_keys
+    shape = (n_participants, n_runs, n_blocks)
+
+    # category of each stimulus, as an index in 'categories' (-1 if never a target)
+    stim_cats = np.array([categories.index(cat) if cat in categories else -1 for cat in stimuli['stim_cat']])
+
+    # order of the categories in each run, each repeated for its key orders
+    cat_order = np.argsort(rng.random((n_participants, n_runs, n_cats)), axis = -1)
+    block_cats = np.repeat(cat_order, n_keys, axis = -1)
+
+    # key each category starts with
+    if counterbalance_keys:
+        participants = first_participant + np.arange(n_participants)[:, None, None]
+        runs = np.arange(n_runs)[None, :, None]
+        first_key = (participants + runs + cat_order) % n_keys
+    else:
+        first_key = rng.integers(n_keys, size = (n_participants, n_runs, n_cats))
+    # and the following blocks of the category go through the other keys in turn
+    block_keys = (np.repeat(first_key, n_keys, axis = -1) + np.tile(np.arange(n_keys), n_cats)) % n_keys
+
+    # order of the stimuli in each block
+    stim_order = np.argsort(rng.random(shape + (n_trials,)), axis = -1)
+    targets = stim_cats[stim_order] == block_cats[..., None]
+
+    # draw the blocks with too many consecutive targets again
+    if max_target_run is not None:
+        for _ in range(max_redraws):
+            bad = longest_run(targets) > max_target_run
+            if not bad.any():
+                break
+            stim_order[bad] = np.argsort(rng.random((bad.sum(), n_trials)), axis = -1)
+            targets = stim_cats[stim_order] == block_cats[..., None]
+        else:
+            raise ValueError(f'no trial order with at most {max_target_run} consecutive targets found')
+
+    # fill the table
+    schedules = np.empty(shape + (n_trials,), dtype = SCHEDULE_DTYPE)
+    schedules['run'] = (np.arange(n_runs) + 1)[None, :, None, None]
+    schedules['block'] = (np.arange(n_blocks) + 1)[None, None, :, None]
+    schedules['trial'] = np.arange(n_trials)
+    schedules['category'] = block_cats[..., None]
+    schedules['stim'] = stim_order
+    schedules['target'] = targets
+    schedules['yes_key'] = block_keys[..., None]
+
+    return schedules.reshape(n_participants, -1)
+
+
+
+def compile_schedule(stimuli, exp_phase, categories = ['face', 'scene', 'body'], keys = ['f', 'j'],
+                     n_runs = 1, seed = None, participant = 0, max_target_run = None,
+                     counterbalance_keys = True):
+
+    '''
+    Compiles the schedule of a phase for a single participant. See 'compile_schedules'.
+
+     Returns
+    ——————————
+     • schedule : structured array of SCHEDULE_DTYPE, one row per trial.
+    '''
+
+    return compile_schedules(stimuli, exp_phase, categories, keys, n_runs = n_runs, n_participants = 1,
+                             seed = seed, first_participant = participant, max_target_run = max_target_run,
+                             counterbalance_keys = counterbalance_keys)[0]
+
+
+
+def schedule_blocks(schedule, stimuli, exp_phase, categories = ['face', 'scene', 'body'],
+                    keys = ['f', 'j'], run = 1):
+
+    '''
+    Turns the schedule of one run into the list of blocks played by 'run'.
+
+    Parameters
+    ——————————
+     • schedule : the schedule of a participant, from 'compile_schedule'.
+     • stimuli : a dataframe holding the images to present, as given to 'compile_schedule'.
+     • exp_phase : either practice or main.
+     • categories : list. Categories the schedule was compiled with.
+     • keys : list. Keys the schedule was compiled with.
+     • run : int. Number of the run, starting at 1.
+
+     Returns
+    ——————————
+     • blocks : list of dictionaries holding the category, the yes and no keys and the ordered images
+       of each block.
+    '''
+
+    stim_files = phase_stimuli(stimuli, exp_phase)['stim_file'].to_numpy()
+    run_schedule = schedule[schedule['run'] == run]
+
+    blocks = []
+    for block in np.unique(run_schedule['block']):
+        trials = run_schedule[run_schedule['block'] == block]
+        yes_key = keys[trials['yes_key'][0]]
+        blocks.append({
+            'category': categories[trials['category'][0]],
+            'yes_key': yes_key,
+            'no_key': [key for key in keys if key != yes_key][0],
+            'images': stim_files[trials['stim']].tolist()
+        })
+
+    return blocks
+
+
+
+def balance_report(schedules, categories = ['face', 'scene', 'body'], keys = ['f', 'j']):
+
+    '''
+    Summarises the balance of a set of schedules: for each category and yes key, the number of blocks,
+    their mean position in the run, the proportion of target trials and the longest run of targets.
+
+    Parameters
+    ——————————
+     • schedules : array of schedules, from 'compile_schedules'.
+     • categories : list. Categories the schedules were compiled with.
+     • keys : list. Keys the schedules were compiled with.
+    '''
+
+    # one row per block: the first trial of each block holds its condition
+    flat = schedules.reshape(-1)
+    n_trials = int(flat['trial'].max()) + 1
+    targets = flat['target'].reshape(-1, n_trials)
+    firsts = flat[flat['trial'] == 0]
+
+    blocks = pd.DataFrame({
+        'category': np.asarray(categories)[firsts['category']],
+        'yes_key': np.asarray(keys)[firsts['yes_key']],
+        'block': firsts['block'],
+        'target_rate': targets.mean(axis = 1),
+        'longest_target_run': longest_run(targets)
+    })
+
+    return blocks.groupby(['category', 'yes_key']).agg(
+        n_blocks = ('block', 'size'),
+        mean_position = ('block', 'mean'),
+        target_rate = ('target_rate', 'mean'),
+        longest_target_run = ('longest_target_run', 'max'))
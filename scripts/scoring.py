@@ -0,0 +1,154 @@
+# Scoring of the trials, used by 'run_block' and the main experiment script
+
+import numpy as np
+import pandas as pd
+
+
+# raw events recorded by 'run_block' for each trial; everything else is derived after the block
+EVENT_DTYPE = np.dtype([
+    ('trial_nb', 'u2'),
+    ('stim', 'u2'),
+    ('response', 'U16'),
+    ('rt', 'f8'),
+    ('timeout', '?'),
+    ('planned_onset', 'f8'),
+    ('onset_time', 'f8'),
+    ('flip_time', 'f8'),
+    ('key_time', 'f8'),
+    ('poll_time', 'f8'),
+    ('anticipations', 'u2'),
+    ('prefetch_wait', 'f8'),
+    ('onset_error', 'f8'),
+    ('dropped_frames', 'u2'),
+    ('max_flip_interval', 'f8'),
+    ('late_cause', 'U16'),
+    ('fixation_duration', 'f8'),
+    ('feedback_duration', 'f8'),
+    ('criterion_target_accuracy', 'f8'),
+    ('criterion_nontarget_accuracy', 'f8'),
+    ('criterion_rt_change', 'f8'),
+    ('criterion_stop', 'U10')
+])
+
+# columns of the raw events of a trial in the trial log, as given by 'event_row', scored when the log is read
+LOG_COLUMNS = [name for name in EVENT_DTYPE.names if name != 'stim'] + ['image', 'task', 'yes_key']
+
+# columns of the data of a trial, in the order the trial data always had them, as given by 'score_block'
+TRIAL_COLUMNS = ['trial_nb', 'rt', 'acc', 'response', 'timeout', 'image', 'category', 'exp_phase', 'yes_key', 'target',
+                 'planned_onset', 'onset_time', 'flip_time', 'key_time', 'poll_time', 'anticipations', 'prefetch_wait',
+                 'onset_error', 'dropped_frames', 'max_flip_interval', 'late_cause', 'timing_ok',
+                 'fixation_duration', 'feedback_duration', 'criterion_target_accuracy', 'criterion_nontarget_accuracy',
+                 'criterion_rt_change', 'criterion_stop']
+
+
+def detection_rule(response, yes_key, target):
+
+    '''
+    The default scoring rule: a response is correct when the yes key was pressed for a target, or any
+    other key for a non-target. Works element-wise on arrays.
+
+    Parameters
+    ——————————
+     • response : the keys pressed.
+     • yes_key : the keys meaning 'present'.
+     • target : whether the category to detect was in the image.
+    '''
+
+    return (np.asarray(response) == np.asarray(yes_key)) == np.asarray(target)
+
+
+
+def image_stems(files):
+
+    '''
+    Returns the names of image files without folder and extension, e.g. 'main_face_26'.
+    '''
+
+    return pd.Series(files).str.replace(r'^.*[\\/]', '', regex = True).str.replace(r'\.[^.]*$', '', regex = True)
+
+
+
+def event_row(event, image, task, yes_key):
+
+    '''
+    Returns the raw events of a trial, as recorded by 'run_block', as a row of the trial log.
+
+    Parameters
+    ——————————
+     • event : the record of the trial, of EVENT_DTYPE.
+     • image : the stem of its image file, e.g. 'main_face_26'.
+     • task : the category to detect.
+     • yes_key : the key meaning 'present'.
+    '''
+
+    row = dict(zip(EVENT_DTYPE.names, event.tolist()))
+    del row['stim']
+    row.update(image = image, task = task, yes_key = yes_key)
+
+    return row
+
+
+
+def score_trials(df, rule = detection_rule):
+
+    '''
+    Derives the category, phase, target flag and accuracy of every trial in one vectorised pass. Works
+    on the data of a block as well as on a whole trial log, so past data can be scored again with a
+    different rule.
+
+    Parameters
+    ——————————
+     • df : dataframe with the 'image' (stem of the image file), 'task' (category to detect),
+       'yes_key' and 'response' of each trial, and whether it timed out if there was a deadline.
+     • rule : function taking the responses, yes keys and target flags and returning the accuracy.
+       Defaults to 'detection_rule'.
+
+     Returns
+    ——————————
+     • df : a copy of the dataframe with 'exp_phase', 'category', 'target' and 'acc' columns, and a
+       'timing_ok' column if the frame timing was recorded.
+    '''
+
+    df = df.copy()
+    # the image names are <phase>_<category>_<number>
+    parts = df['image'].str.split('_', expand = True)
+    df['exp_phase'] = parts[0]
+    df['category'] = parts[1]
+    df['target'] = df['category'].to_numpy() == df['task'].to_numpy()
+    df['acc'] = rule(df['response'].to_numpy(), df['yes_key'].to_numpy(), df['target'].to_numpy())
+    # a trial without a response before the deadline is a miss, whatever the rule says
+    if 'timeout' in df:
+        df['acc'] = df['acc'] & ~df['timeout'].to_numpy(dtype = bool)
+    # trials where a frame was dropped can't be trusted for timing
+    if 'dropped_frames' in df:
+        df['timing_ok'] = df['dropped_frames'].to_numpy() == 0
+
+    return df
+
+
+
+def score_block(events, images, category, yes_key, rule = detection_rule):
+
+    '''
+    Turns the raw events of a block into its data, one row per trial.
+
+    Parameters
+    ——————————
+     • events : structured array of EVENT_DTYPE, as recorded by 'run_block'.
+     • images : the images of the block, in the order they were shown.
+     • category : the category to detect during the block.
+     • yes_key : the key meaning 'present'.
+     • rule : the scoring rule. Defaults to 'detection_rule'.
+
+     Returns
+    ——————————
+     • data : dictionary holding one list per variable.
+    '''
+
+    df = pd.DataFrame(events)
+    df['image'] = image_stems(images['stim_file'].to_numpy()[events['stim']]).to_numpy()
+    df['task'] = category
+    df['yes_key'] = yes_key
+    df = score_trials(df, rule)
+
+    return df[TRIAL_COLUMNS].to_dict('list')
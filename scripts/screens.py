@@ -0,0 +1,194 @@
+# Screens shown around the trials, rendered from text templates, used by the stimulus cache
+#
+#     python -m scripts.screens --size 1440 900 --categories face scene body --keys f j
+
+import argparse, hashlib, json, os
+from PIL import Image, ImageDraw, ImageFont
+
+
+# text of each screen, by name; **text** is set in bold. The question screens are named after the category
+# to detect and the keys meaning yes and no, e.g. 'qface_f_j'
+TEMPLATES = {
+    'question': 'Is the image a **{category}** image?\n\n'
+                'Press [ **{yes_key}** ] = **yes** / [ **{no_key}** ] = **no**.\n\n'
+                'Press [space] bar to start.',
+    'break': 'You can have a break now.\n\nPress [space] bar to continue.',
+    'correct': 'You are correct!',
+    'wrong': 'Oops, you are wrong!'
+}
+
+# serif fonts, regular and bold, in order of preference; PIL's own font if none is installed
+FONTS = [('times.ttf', 'timesbd.ttf'), ('Times New Roman.ttf', 'Times New Roman Bold.ttf'),
+         ('LiberationSerif-Regular.ttf', 'LiberationSerif-Bold.ttf'), ('DejaVuSerif.ttf', 'DejaVuSerif-Bold.ttf')]
+
+
+def task_screens(categories = ['face', 'scene', 'body'], keys = ['f', 'j'], feedback = True, folder = r'instructions'):
+
+    '''
+    Returns the text of every screen a task needs: the question screen of each category and key order,
+    the break screen, and the feedback screens.
+
+    Parameters
+    ——————————
+     • categories : list. The categories to detect.
+     • keys : list. The two response keys.
+     • feedback : bool. Whether to include the feedback screens, shown in the practice.
+     • folder : folder the screens are named in, as files, by 'run_block'.
+
+     Returns
+    ——————————
+     • texts : dictionary mapping the file each screen stands for, e.g. 'instructions/qface_f_j.png',
+       to its text.
+    '''
+
+    texts = {f'q{category}_{yes_key}_{no_key}': TEMPLATES['question'].format(category = category,
+                                                                              yes_key = yes_key, no_key = no_key)
+             for category in categories for yes_key in keys for no_key in keys if no_key != yes_key}
+    texts['break'] = TEMPLATES['break']
+    if feedback:
+        texts.update({name: TEMPLATES[name] for name in ['correct', 'wrong']})
+
+    return {os.path.normpath(os.path.join(folder, f'{name}.png')): text for name, text in texts.items()}
+
+
+
+def _load_fonts(size):
+    # the first serif font installed, regular and bold
+    for regular, bold in FONTS:
+        try:
+            return ImageFont.truetype(regular, size), ImageFont.truetype(bold, size), regular
+        except OSError:
+            continue
+    font = ImageFont.load_default(size)
+    return font, font, 'default'
+
+
+
+class ScreenRenderer:
+
+    '''
+    Renders text screens the size of the window, black text centred on a transparent background so
+    the window shows through, e.g. the question and feedback screens from 'task_screens'. Each screen
+    is rendered once per session and kept in memory; with a 'folder', rendered screens are also kept
+    on disk across sessions, keyed by their text, the window size and the font.
+
+    The stimulus cache takes the screens from the renderer instead of reading their files, with the
+    same interface as a VariantStore.
+
+    Parameters
+    ——————————
+     • size : size of the window, in pixels.
+     • texts : dictionary mapping the files the screens stand for to their text.
+     • folder : folder of the screens rendered in earlier sessions. None to keep them in memory only.
+     • font_size : height of the text, as a share of the height of the window.
+    '''
+
+    def __init__(self, size, texts, folder = None, font_size = 0.055):
+
+        self.size = tuple(int(x) for x in size)
+        self.texts = {os.path.normpath(str(file)): text for file, text in texts.items()}
+        self.folder = folder
+        self.font_size = max(8, round(font_size * self.size[1]))
+        self._fonts = None
+        self._images = {}
+
+
+    def __contains__(self, file):
+        return os.path.normpath(str(file)) in self.texts
+
+
+    def __iter__(self):
+        return iter(self.texts)
+
+
+    def _key(self, text):
+        # what a rendered screen depends on
+        config = json.dumps([text, list(self.size), self.font_size, self._fonts[2]])
+        return hashlib.sha256(config.encode()).hexdigest()[:12]
+
+
+    def render(self, text):
+
+        '''
+        Renders a text, line by line, each centred. Returns an RGBA PIL image the size of the window.
+        '''
+
+        regular, bold, _ = self._fonts
+        img = Image.new('RGBA', self.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        lines = text.split('\n')
+        line_height = round(1.2 * self.font_size)
+        y = (self.size[1] - line_height * len(lines)) / 2
+        for line in lines:
+            # the parts of the line alternate between regular and bold
+            parts = [(part, bold if i % 2 else regular) for i, part in enumerate(line.split('**')) if part]
+            x = (self.size[0] - sum(font.getlength(part) for part, font in parts)) / 2
+            for part, font in parts:
+                draw.text((x, y), part, font = font, fill = (0, 0, 0, 255))
+                x += font.getlength(part)
+            y += line_height
+
+        return img
+
+
+    def get(self, file):
+
+        '''
+        Returns the screen standing for a file, rendering it on the first request (or reading it from
+        the folder of rendered screens).
+        '''
+
+        file = os.path.normpath(str(file))
+        if file in self._images:
+            return self._images[file]
+
+        if self._fonts is None:
+            self._fonts = _load_fonts(self.font_size)
+        text = self.texts[file]
+        path = None
+        if self.folder is not None:
+            name = os.path.splitext(os.path.basename(file))[0]
+            path = os.path.join(self.folder, f'{name}_{self.size[0]}x{self.size[1]}_{self._key(text)}.png')
+        if path is not None and os.path.exists(path):
+            with Image.open(path) as img:
+                img.load()
+                image = img.convert('RGBA')
+        else:
+            image = self.render(text)
+            if path is not None:
+                os.makedirs(self.folder, exist_ok = True)
+                image.save(path)
+        self._images[file] = image
+
+        return image
+
+
+    def render_all(self):
+
+        '''
+        Renders every screen, e.g. in the background before the session starts.
+        '''
+
+        for file in self.texts:
+            self.get(file)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Render the screens of a task, to check how they look.')
+    parser.add_argument('--size', type = int, nargs = 2, default = [1440, 900], help = 'window size in pixels')
+    parser.add_argument('--categories', nargs = '+', default = ['face', 'scene', 'body'])
+    parser.add_argument('--keys', nargs = 2, default = ['f', 'j'])
+    parser.add_argument('--color', default = '#BABAB9', help = 'background color of the window')
+    parser.add_argument('--out', default = r'./screens_preview', help = 'where to save the screens')
+    args = parser.parse_args()
+
+    renderer = ScreenRenderer(args.size, task_screens(args.categories, args.keys))
+    os.makedirs(args.out, exist_ok = True)
+    for file in renderer:
+        # on the background of the window, as they will be seen
+        screen = Image.new('RGBA', renderer.size, args.color)
+        screen.alpha_composite(renderer.get(file))
+        screen.convert('RGB').save(os.path.join(args.out, os.path.basename(file)))
+    print(f'{len(renderer.texts)} screens saved in {args.out}')
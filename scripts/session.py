@@ -0,0 +1,135 @@
+# Session checkpoints, used by 'run' and the main experiment script
+
+import json, os
+import numpy as np
+
+
+class SessionState:
+
+    '''
+    Keeps track of a session in a small JSON file, so that an interrupted session can be restarted at
+    the first block that was not finished. The file records the seed and the state of the random number
+    generator, the order of the blocks and trials of each run as soon as they are drawn, and which
+    blocks were completed. Restarting from the file replays nothing and draws nothing again: the runs
+    and blocks left are played exactly as they would have been.
+
+    The file is rewritten atomically after every change, so a crash can't leave it half-written.
+
+    Parameters
+    ——————————
+     • path : path of the session file. If it exists, the session is resumed from it.
+     • seed : int. Seed of a new session. Ignored when resuming. Defaults to a random seed.
+    '''
+
+    def __init__(self, path, seed = None):
+
+        self.path = str(path)
+        self.resumed = os.path.exists(self.path)
+
+        if self.resumed:
+            with open(self.path) as file:
+                saved = json.load(file)
+            self.seed = saved['seed']
+            self.runs = saved['runs']
+            # each restart is a new attempt, so its trials can be told apart in the log
+            self.attempt = saved['attempt'] + 1
+            self.rng = np.random.default_rng()
+            self.rng.bit_generator.state = saved['rng_state']
+        else:
+            self.seed = int(seed) if seed is not None else int(np.random.SeedSequence().entropy % 2**32)
+            self.runs = {}
+            self.attempt = 1
+            self.rng = np.random.default_rng(self.seed)
+
+        self.save()
+
+
+    def save(self):
+
+        '''
+        Writes the state to the session file.
+        '''
+
+        state = {
+            'seed': self.seed,
+            'attempt': self.attempt,
+            'rng_state': self.rng.bit_generator.state,
+            'runs': self.runs
+        }
+        # write next to the file, then swap it in
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+
+    def plan_run(self, run_label, draw_blocks):
+
+        '''
+        Returns the blocks of a run, drawing them the first time the run is played.
+
+        Parameters
+        ——————————
+         • run_label : name of the run, e.g. 'run1'.
+         • draw_blocks : function taking the random number generator and returning the list of blocks
+           of the run, each a JSON-serialisable dictionary.
+        '''
+
+        if run_label not in self.runs:
+            self.runs[run_label] = draw_blocks(self.rng)
+            self.save()
+
+        return self.runs[run_label]
+
+
+    def complete_block(self, run_label, block_index):
+
+        '''
+        Marks a block of a run as completed.
+
+        Parameters
+        ——————————
+         • run_label : name of the run.
+         • block_index : position of the block in the run, starting at 0.
+        '''
+
+        # remember which attempt completed the block
+        self.runs[run_label][block_index]['done'] = self.attempt
+        self.save()
+
+
+    def is_done(self, run_label):
+
+        '''
+        Returns whether all the blocks of a run were completed.
+        '''
+
+        return run_label in self.runs and all(block.get('done') for block in self.runs[run_label])
+
+
+    def keep_completed(self, df, run_labels):
+
+        '''
+        Keeps only the trials of completed blocks, each from the attempt that completed it. Trials of
+        blocks cut short by an interruption are dropped.
+
+        Parameters
+        ——————————
+         • df : the trial log, with 'run', 'block' and 'attempt' columns.
+         • run_labels : dictionary mapping the values of the 'run' column to the run names.
+        '''
+
+        # nothing was logged yet, e.g. the session crashed before the first trial
+        if df.empty:
+            return df.reset_index(drop = True)
+
+        # the attempt that completed each (run, block)
+        completed = {(run, block_index + 1): block['done']
+                     for run, run_label in run_labels.items() if run_label in self.runs
+                     for block_index, block in enumerate(self.runs[run_label]) if block.get('done')}
+        keep = [completed.get((run, block)) == attempt
+                for run, block, attempt in zip(df['run'], df['block'], df['attempt'])]
+
+        return df.loc[keep].reset_index(drop = True)
@@ -0,0 +1,265 @@
+# Simulated display and keyboard, to run the experiment code without a screen
+
+import math, pathlib, random
+import numpy as np
+
+
+class SimulatedClock:
+
+    '''
+    A clock running on the virtual time of a SimulatedWindow, with the same interface as psychopy clocks.
+
+    Parameters
+    ——————————
+     • win : the SimulatedWindow providing the time.
+    '''
+
+    def __init__(self, win):
+        self.win = win
+        self._reset_time = win.now
+
+    def getTime(self):
+        return self.win.now - self._reset_time
+
+    def reset(self, newT = 0.):
+        self._reset_time = self.win.now + newT
+
+    def getLastResetTime(self):
+        return self._reset_time
+
+
+
+class SimulatedKeyPress:
+
+    '''
+    A key press as returned by a psychopy Keyboard: key name, absolute time the key went down and time
+    relative to the last reset of the keyboard clock.
+    '''
+
+    def __init__(self, name, tDown, rt):
+        self.name = name
+        self.tDown = tDown
+        self.rt = rt
+        self.duration = None
+
+
+
+class SimulatedKeyboard:
+
+    '''
+    A keyboard answering on its own. Each time a key is awaited, 'responder' is asked which key to press
+    and with which latency; the key goes down that long after the last flip of the window (i.e. after
+    the stimulus onset), and is picked up 'poll_delay' seconds later.
+
+    Parameters
+    ——————————
+     • win : the SimulatedWindow the keyboard belongs to.
+     • responder : function taking the list of accepted keys and returning a (key, latency) tuple.
+       Defaults to a random key after 0.5 s.
+     • poll_delay : delay between the key press and the moment it is read, in seconds.
+     • seed : seed of the default responder.
+    '''
+
+    def __init__(self, win, responder = None, poll_delay = 0.004, seed = None):
+
+        self.win = win
+        self.clock = SimulatedClock(win)
+        self.poll_delay = poll_delay
+        rng = random.Random(seed)
+        self.responder = responder if responder is not None else (lambda keyList: (rng.choice(keyList), 0.5))
+
+
+    def clearEvents(self):
+        pass
+
+
+    def waitKeys(self, maxWait = float('inf'), keyList = None, **kwargs):
+
+        # no key list means any key, which the responder gets as 'space'
+        key, latency = self.responder(list(keyList) if keyList is not None else ['space'])
+        # the key goes down after what is on screen appeared, but can't go down in the past
+        shown_time = self.win.flip_times[-1] if self.win.flip_times else 0.
+        t_down = max(shown_time + latency, self.win.now)
+        # too late: nothing was pressed while we waited
+        if t_down > self.win.now + maxWait:
+            self.win.now += maxWait
+            return []
+        # time passes until the press is read
+        self.win.now = t_down + self.poll_delay
+
+        return [SimulatedKeyPress(key, t_down, t_down - self.clock.getLastResetTime())]
+
+
+
+class SyntheticResponder:
+
+    '''
+    A simulated participant for a SimulatedKeyboard. It follows the task by looking at what is on
+    screen: question screens ('q<category>_<yes key>_<no key>') tell it which category to detect and
+    which key means 'present', and stimulus images ('<phase>_<category>_<number>') are answered with
+    the right key with probability 'p_correct'. RTs are drawn from an ex-Gaussian distribution (a
+    normal plus an exponential) with parameters per category of the image. Any other screen is left
+    by pressing the first key accepted, after 'screen_time' seconds.
+
+    Parameters
+    ——————————
+     • win : the SimulatedWindow the participant looks at.
+     • rt_params : dictionary mapping image categories to (mu, sigma, tau) in seconds. Categories not
+       listed use the 'default' entry.
+     • p_correct : dictionary mapping image categories to the probability of a correct answer.
+       Categories not listed use the 'default' entry.
+     • screen_time : time spent on the other screens, in seconds.
+     • seed : seed of the random draws.
+    '''
+
+    def __init__(self, win, rt_params = None, p_correct = None, screen_time = 1., seed = None):
+
+        self.win = win
+        self.rt_params = {'face': (0.42, 0.05, 0.08), 'body': (0.46, 0.06, 0.10), 'scene': (0.45, 0.06, 0.10),
+                          'default': (0.48, 0.06, 0.12)}
+        self.rt_params.update(rt_params or {})
+        self.p_correct = {'default': 0.95}
+        self.p_correct.update(p_correct or {})
+        self.screen_time = screen_time
+        self.rng = np.random.default_rng(seed)
+        # the task of the current block, from the last question screen
+        self.task = None
+        self.yes_key = None
+        self.no_key = None
+
+
+    def __call__(self, keyList):
+
+        for image in self.win.shown:
+            parts = pathlib.Path(str(image)).stem.split('_')
+
+            # a question screen: remember the task
+            if len(parts) == 3 and parts[0].startswith('q'):
+                self.task, self.yes_key, self.no_key = parts[0][1:], parts[1], parts[2]
+
+            # a stimulus: answer it
+            elif len(parts) == 3 and parts[0] in ('main', 'practice') and self.task is not None:
+                category = parts[1]
+                correct = self.rng.random() < self.p_correct.get(category, self.p_correct['default'])
+                target = category == self.task
+                key = self.yes_key if target == correct else self.no_key
+                mu, sigma, tau = self.rt_params.get(category, self.rt_params['default'])
+                latency = max(0.1, self.rng.normal(mu, sigma) + self.rng.exponential(tau))
+                if key in keyList:
+                    return key, latency
+
+        # anything else
+        return keyList[0], self.screen_time
+
+
+
+class SimulatedImageStim:
+
+    '''
+    Stands in for a psychopy ImageStim: remembers what it shows and counts how often it is drawn.
+    '''
+
+    def __init__(self, win, image = None, size = None, **kwargs):
+        self.win = win
+        self.image = image
+        self.size = size
+        self.n_draws = 0
+
+    def draw(self):
+        self.n_draws += 1
+        self.win.drawn.append(self.image)
+
+
+
+class SimulatedWindow:
+
+    '''
+    A window that is never shown. Time is virtual: flips land on the next vertical blank of a display
+    running at 'frame_rate', and waiting moves the clock forward instead of sleeping, so experiment code
+    runs as fast as the machine allows. 'flip' returns 'return_delay' seconds (plus random jitter) after
+    the actual vertical blank, like a real window, which is what the onset stamps have to see through.
+
+    Parameters
+    ——————————
+     • size : size of the window, in pixels.
+     • units : units of the window.
+     • color : background color of the window.
+     • frame_rate : refresh rate of the simulated display, in Hz.
+     • return_delay : mean delay between the vertical blank and the return of 'flip', in seconds.
+     • jitter : standard deviation of that delay, in seconds.
+     • seed : seed of the random jitter and of the keyboard.
+     • responder : responder of the keyboard, see SimulatedKeyboard. Defaults to a SyntheticResponder.
+    '''
+
+    # lets other code tell a simulated window from a psychopy one
+    simulated = True
+
+    def __init__(self, size = (1440,900), units = 'pix', color = '#BABAB9', frame_rate = 60.,
+                 return_delay = 0.001, jitter = 0., seed = None, responder = None):
+
+        self.size = size
+        self.units = units
+        self.color = color
+        self.monitorFramePeriod = 1. / frame_rate
+        self.return_delay = return_delay
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        # virtual time, in seconds
+        self.now = 0.
+        self.clock = SimulatedClock(self)
+        self.keyboard = SimulatedKeyboard(self, responder = responder if responder is not None
+                                          else SyntheticResponder(self, seed = seed))
+        # what was drawn since the last flip, what the last flip put on screen, and the vertical blank
+        # of each flip
+        self.drawn = []
+        self.shown = []
+        self.flip_times = []
+        self._on_flip = []
+
+
+    def _next_vblank(self, after):
+        # first vertical blank strictly after a given time
+        return (math.floor(after / self.monitorFramePeriod) + 1) * self.monitorFramePeriod
+
+
+    def getActualFrameRate(self, **kwargs):
+        return 1. / self.monitorFramePeriod
+
+
+    def getFutureFlipTime(self, targetTime = 0, clock = None):
+        return self._next_vblank(self.now + targetTime)
+
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._on_flip.append((function, args, kwargs))
+
+
+    def flip(self, clearBuffer = True):
+
+        # the new frame is shown at the next vertical blank
+        self.now = self._next_vblank(self.now)
+        self.flip_times.append(self.now)
+        self.shown = list(self.drawn)
+        # functions waiting for the flip run at the vertical blank
+        for function, args, kwargs in self._on_flip:
+            function(*args, **kwargs)
+        self._on_flip = []
+        if clearBuffer:
+            self.drawn = []
+        # the flip returns a little later
+        flip_time = self.now
+        self.now += max(0., self._rng.gauss(self.return_delay, self.jitter))
+
+        return flip_time
+
+
+    def clearBuffer(self, color = True, depth = False, stencil = False):
+        self.drawn = []
+
+
+    def wait(self, secs):
+        self.now += secs
+
+
+    def close(self):
+        pass
@@ -0,0 +1,99 @@
+# Breakdown of the startup time of the main experiment script, from launch to the first screen
+#
+# Only the standard library is imported here, so that the clock can start before the heavy imports.
+
+import json, threading, time
+from contextlib import contextmanager
+
+
+class StartupClock:
+
+    '''
+    Records how long each stage of the startup takes, on the main thread or on the background thread
+    preparing the session meanwhile, relative to the launch of the script.
+
+    Parameters
+    ——————————
+     • launch : 'time.perf_counter()' at the launch of the script. Defaults to now.
+    '''
+
+    def __init__(self, launch = None):
+
+        self.launch = time.perf_counter() if launch is None else launch
+        # (stage, thread, start, end), in seconds since the launch
+        self.stages = []
+        self.marks = {}
+        self._lock = threading.Lock()
+
+
+    @contextmanager
+    def stage(self, name):
+
+        '''
+        Times the stage run inside the 'with' block.
+        '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.stages.append((name, threading.current_thread().name, start - self.launch, end - self.launch))
+
+
+    def mark(self, name):
+
+        '''
+        Records a point in time, e.g. 'first_screen'.
+        '''
+
+        self.marks[name] = time.perf_counter() - self.launch
+
+
+    def report(self):
+
+        '''
+        Returns the breakdown as a dictionary: each stage with its thread, start and duration, and the
+        marks, all in seconds since the launch. The time spent waiting for the participant dialog is
+        given apart, as 'first_screen_without_dialog'.
+        '''
+
+        with self._lock:
+            stages = sorted(self.stages, key = lambda stage: stage[2])
+        report = {
+            'stages': [{'stage': name, 'thread': thread, 'start': start, 'duration': end - start}
+                       for name, thread, start, end in stages],
+            'marks': dict(self.marks)
+        }
+        if 'first_screen' in self.marks:
+            dialog = sum(end - start for name, _, start, end in stages if name == 'dialog')
+            report['first_screen_without_dialog'] = self.marks['first_screen'] - dialog
+
+        return report
+
+
+    def summary(self):
+
+        '''
+        Returns the breakdown as lines of text, to print.
+        '''
+
+        report = self.report()
+        lines = [f"  {stage['start']:6.2f} s  {stage['duration']:6.2f} s  {stage['stage']} ({stage['thread']})"
+                 for stage in report['stages']]
+        if 'first_screen' in report['marks']:
+            lines.append(f"First screen {report['marks']['first_screen']:.2f} s after launch, "
+                         f"{report['first_screen_without_dialog']:.2f} s without the dialog")
+
+        return ['Startup (start, duration, stage):'] + lines
+
+
+    def save(self, path):
+
+        '''
+        Saves the breakdown as JSON.
+        '''
+
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent = 1)
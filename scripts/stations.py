@@ -0,0 +1,372 @@
+# Coordination of sessions run on several stations at once
+#
+#     python -m scripts.stations launch 4 --simulate
+#     python -m scripts.stations station --coordinator //labshare/rt/coordinator.sqlite
+#     python -m scripts.stations monitor --coordinator //labshare/rt/coordinator.sqlite
+
+import argparse, datetime, io, os, re, socket, sqlite3, subprocess, sys, time
+from contextlib import closing
+import pandas as pd
+from scripts.scoring import score_trials
+
+
+# the experiment script, run from its own folder so the stimuli and instructions are found
+EXPERIMENT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'RT_experiment.py')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    session_key TEXT PRIMARY KEY,
+    participant INTEGER UNIQUE,
+    counterbalance INTEGER,
+    station TEXT,
+    status TEXT,
+    started TEXT,
+    heartbeat TEXT,
+    finished TEXT,
+    out TEXT,
+    header TEXT,
+    log_offset INTEGER DEFAULT 0,
+    run INTEGER,
+    block INTEGER,
+    trials INTEGER DEFAULT 0,
+    correct INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS trials (
+    session_key TEXT,
+    row_nb INTEGER,
+    line TEXT,
+    PRIMARY KEY (session_key, row_nb)
+);
+'''
+
+
+class Coordinator:
+
+    '''
+    Hands out participant IDs and counterbalancing groups to the stations, and collects the trial log
+    of every session into one SQLite database. Every station and the monitor open the same database
+    file, e.g. on a shared drive whose locks work; SQLite makes sure no two stations get the same ID.
+
+    Each session gets a unique key, '<date>_ppt<ID>_<station>', which prefixes all its output files
+    in the data folder, so sessions never overwrite each other's files.
+
+    While a session runs, its station beats every few seconds ('heartbeat'). A running session whose
+    station stopped beating for 'timeout' seconds, e.g. because the station crashed, is marked as
+    failed ('expire'), and so is a session still running on a station that starts a new one.
+
+    Parameters
+    ——————————
+     • path : path of the database, created if needed.
+     • data : folder the sessions write their output to. Defaults to a 'data' folder next to the
+       database.
+     • n_groups : int. Number of counterbalancing groups, e.g. the number of response keys.
+     • timeout : time without a heartbeat after which a running session is failed, in seconds.
+    '''
+
+    def __init__(self, path = r'./coordinator.sqlite', data = None, n_groups = 2, timeout = 60.):
+
+        self.path = str(path)
+        self.data = data if data is not None else os.path.join(os.path.dirname(os.path.abspath(self.path)), 'data')
+        self.n_groups = n_groups
+        self.timeout = timeout
+        os.makedirs(self.data, exist_ok = True)
+        with closing(self._connect()) as db:
+            db.executescript(SCHEMA)
+            # databases created before the heartbeats
+            if 'heartbeat' not in [column[1] for column in db.execute('PRAGMA table_info(sessions)')]:
+                db.execute('ALTER TABLE sessions ADD COLUMN heartbeat TEXT')
+
+
+    def _connect(self):
+        # in autocommit mode, transactions are opened explicitly where needed
+        return sqlite3.connect(self.path, timeout = 30, isolation_level = None)
+
+
+    def assign(self, station):
+
+        '''
+        Starts a new session on a station. The participant gets the next free ID, and the
+        counterbalancing group with the fewest sessions not abandoned so far.
+
+        Parameters
+        ——————————
+         • station : name of the station, e.g. its host name.
+
+         Returns
+        ——————————
+         • session : dictionary with the 'session_key', 'participant', 'counterbalance' and 'out'
+           prefix of the output files of the session.
+        '''
+
+        station = re.sub(r'[^A-Za-z0-9-]', '-', station)
+        db = self._connect()
+        try:
+            # take the write lock before reading, so two stations can't pick the same ID
+            db.execute('BEGIN IMMEDIATE')
+            # a session still running on this station was cut short: the station runs one at a time
+            now = datetime.datetime.now().isoformat()
+            db.execute("UPDATE sessions SET status = 'failed', finished = ? WHERE station = ? AND status = 'running'",
+                       (now, station))
+            participant = db.execute('SELECT COALESCE(MAX(participant), 0) + 1 FROM sessions').fetchone()[0]
+            counts = dict(db.execute("SELECT counterbalance, COUNT(*) FROM sessions WHERE status != 'failed' "
+                                     "GROUP BY counterbalance").fetchall())
+            counterbalance = min(range(self.n_groups), key = lambda group: (counts.get(group, 0), group))
+            session_key = f'{datetime.date.today()}_ppt{participant}_{station}'
+            out = os.path.join(self.data, session_key)
+            db.execute('INSERT INTO sessions (session_key, participant, counterbalance, station, status, started, '
+                       "heartbeat, out) VALUES (?, ?, ?, ?, 'running', ?, ?, ?)",
+                       (session_key, participant, counterbalance, station, now, now, out))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+
+        return {'session_key': session_key, 'participant': participant, 'counterbalance': counterbalance, 'out': out}
+
+
+    def heartbeat(self, session_key):
+
+        '''
+        Tells the coordinator that a session is still running.
+        '''
+
+        with closing(self._connect()) as db:
+            db.execute("UPDATE sessions SET heartbeat = ? WHERE session_key = ? AND status = 'running'",
+                       (datetime.datetime.now().isoformat(), session_key))
+
+
+    def expire(self):
+
+        '''
+        Marks as failed the running sessions whose station stopped beating more than 'timeout' seconds
+        ago. Returns their keys.
+        '''
+
+        limit = (datetime.datetime.now() - datetime.timedelta(seconds = self.timeout)).isoformat()
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            expired = [row[0] for row in db.execute("SELECT session_key FROM sessions WHERE status = 'running' "
+                                                    'AND COALESCE(heartbeat, started) < ?', (limit,))]
+            db.executemany("UPDATE sessions SET status = 'failed', finished = ? WHERE session_key = ?",
+                           [(datetime.datetime.now().isoformat(), key) for key in expired])
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+
+        return expired
+
+
+    def finish(self, session_key, returncode = 0):
+
+        '''
+        Marks a session as done, or as failed if its process returned an error.
+        '''
+
+        status = 'done' if returncode == 0 else 'failed'
+        with closing(self._connect()) as db:
+            db.execute('UPDATE sessions SET status = ?, finished = ? WHERE session_key = ?',
+                       (status, datetime.datetime.now().isoformat(), session_key))
+
+
+    def collect(self):
+
+        '''
+        Reads the trials logged since the last collection, for every session, into the database, and
+        updates the progress of the sessions. Only complete rows are read, so a log can be collected
+        while it is being written. Returns the number of trials collected.
+        '''
+
+        db = self._connect()
+        n_new = 0
+        try:
+            sessions = db.execute('SELECT session_key, out, header, log_offset, trials FROM sessions').fetchall()
+            for session_key, out, header, offset, n_trials in sessions:
+
+                log_path = out + '_log.csv'
+                if not os.path.exists(log_path) or os.path.getsize(log_path) <= offset:
+                    continue
+                with open(log_path, 'rb') as file:
+                    file.seek(offset)
+                    chunk = file.read()
+                # every complete row ends with a line break
+                chunk = chunk[:chunk.rfind(b'\n') + 1]
+                if not chunk:
+                    continue
+                lines = chunk.decode().splitlines()
+                if header is None:
+                    header, lines = lines[0], lines[1:]
+
+                # score the new trials for the progress
+                new = pd.read_csv(io.StringIO('\n'.join([header] + lines) + '\n')) if lines else pd.DataFrame()
+                progress = {}
+                if len(new):
+                    scored = score_trials(new)
+                    progress = {'run': int(scored['run'].iloc[-1]), 'block': int(scored['block'].iloc[-1]),
+                                'correct': int(scored['acc'].sum())}
+
+                db.execute('BEGIN')
+                db.executemany('INSERT OR REPLACE INTO trials VALUES (?, ?, ?)',
+                               [(session_key, n_trials + i, line) for i, line in enumerate(lines)])
+                db.execute('UPDATE sessions SET header = ?, log_offset = ?, trials = trials + ?, '
+                           'correct = correct + ?, run = COALESCE(?, run), block = COALESCE(?, block) '
+                           'WHERE session_key = ?',
+                           (header, offset + len(chunk), len(lines), progress.get('correct', 0),
+                            progress.get('run'), progress.get('block'), session_key))
+                db.execute('COMMIT')
+                n_new += len(lines)
+        finally:
+            db.close()
+
+        return n_new
+
+
+    def progress(self):
+
+        '''
+        Returns the progress of every session: station, participant, status, current run and block,
+        number of trials played and running accuracy.
+        '''
+
+        with closing(self._connect()) as db:
+            progress = pd.read_sql_query('SELECT session_key, station, participant, counterbalance, status, run, '
+                                         'block, trials, correct FROM sessions ORDER BY participant', db)
+        progress['accuracy'] = progress['correct'] / progress['trials'].where(progress['trials'] > 0)
+
+        return progress.drop(columns = 'correct')
+
+
+    def trials(self, session_key = None):
+
+        '''
+        Returns the trials collected, from one session or from all of them, with the key of their
+        session. Raw trials, as in the logs: score them with 'score_trials'.
+        '''
+
+        with closing(self._connect()) as db:
+            query = 'SELECT s.session_key, s.header, t.line FROM trials t JOIN sessions s USING (session_key)'
+            if session_key is not None:
+                rows = db.execute(query + ' WHERE s.session_key = ? ORDER BY t.row_nb', (session_key,)).fetchall()
+            else:
+                rows = db.execute(query + ' ORDER BY s.participant, t.row_nb').fetchall()
+
+        sessions = []
+        for key in dict.fromkeys(row[0] for row in rows):
+            lines = [row for row in rows if row[0] == key]
+            df = pd.read_csv(io.StringIO('\n'.join([lines[0][1]] + [row[2] for row in lines]) + '\n'))
+            df.insert(0, 'session_key', key)
+            sessions.append(df)
+
+        return pd.concat(sessions, ignore_index = True) if sessions else pd.DataFrame()
+
+
+
+def session_command(session, simulate = False):
+
+    '''
+    Returns the command running the experiment for a session handed out by the coordinator.
+    '''
+
+    command = [sys.executable, EXPERIMENT, '--id', str(session['participant']),
+               '--counterbalance', str(session['counterbalance']), '--out', session['out']]
+    return command + ['--simulate'] if simulate else command
+
+
+
+def show_progress(coordinator):
+
+    '''
+    Prints the progress of every session, in place of the previous one.
+    '''
+
+    progress = coordinator.progress()
+    progress['accuracy'] = progress['accuracy'].map(lambda acc: '' if pd.isna(acc) else f'{acc:.1%}')
+    # clear the terminal first
+    print('\033[H\033[J' + time.strftime('%H:%M:%S'))
+    print(progress.to_string(index = False) if len(progress) else 'No session yet')
+
+
+
+def launch(coordinator, n_stations, simulate = False, interval = 1.):
+
+    '''
+    Runs several sessions at once on this machine, e.g. headless with simulated participants, and
+    shows their progress until they all end. Each session writes what it prints to
+    '<output prefix>_console.txt'.
+
+    Parameters
+    ——————————
+     • coordinator : the Coordinator to take the sessions from.
+     • n_stations : int. Number of sessions to run.
+     • simulate : bool. Whether to run the sessions with simulated participants.
+     • interval : time between two progress updates, in seconds.
+    '''
+
+    processes = {}
+    for station in range(1, n_stations + 1):
+        session = coordinator.assign(f'{socket.gethostname()}-{station}')
+        console = open(session['out'] + '_console.txt', 'w')
+        processes[session['session_key']] = (subprocess.Popen(session_command(session, simulate),
+                                                               cwd = os.path.dirname(EXPERIMENT),
+                                                               stdout = console, stderr = subprocess.STDOUT), console)
+
+    while processes:
+        time.sleep(interval)
+        coordinator.collect()
+        for session_key, (process, console) in list(processes.items()):
+            if process.poll() is not None:
+                console.close()
+                coordinator.finish(session_key, process.returncode)
+                del processes[session_key]
+            else:
+                coordinator.heartbeat(session_key)
+        coordinator.expire()
+        show_progress(coordinator)
+
+    # what was logged after the last update
+    coordinator.collect()
+    show_progress(coordinator)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Run and follow sessions on several stations.')
+    parser.add_argument('command', choices = ['station', 'launch', 'monitor'],
+                        help = 'station: run one session here; launch: run several sessions here; '
+                               'monitor: collect the logs and show the progress of all the sessions')
+    parser.add_argument('n_stations', type = int, nargs = '?', default = 1, help = 'number of sessions to launch')
+    parser.add_argument('--coordinator', default = r'./coordinator.sqlite', help = 'path of the coordinator database')
+    parser.add_argument('--data', help = 'folder of the session outputs, defaults to data/ next to the database')
+    parser.add_argument('--simulate', action = 'store_true', help = 'run with simulated participants')
+    args = parser.parse_args()
+
+    coordinator = Coordinator(args.coordinator, args.data)
+
+    if args.command == 'station':
+        session = coordinator.assign(socket.gethostname())
+        print(f"Session {session['session_key']}, counterbalancing group {session['counterbalance']}")
+        process = subprocess.Popen(session_command(session, args.simulate), cwd = os.path.dirname(EXPERIMENT))
+        # beat while the session runs, so that the monitor can tell a crashed station
+        while process.poll() is None:
+            coordinator.heartbeat(session['session_key'])
+            time.sleep(min(10., coordinator.timeout / 3))
+        coordinator.finish(session['session_key'], process.returncode)
+
+    elif args.command == 'launch':
+        launch(coordinator, args.n_stations, args.simulate)
+
+    else:
+        try:
+            while True:
+                coordinator.collect()
+                coordinator.expire()
+                show_progress(coordinator)
+                time.sleep(1.)
+        except KeyboardInterrupt:
+            coordinator.collect()
@@ -0,0 +1,291 @@
+# Timing of the flips, stimulus onsets and responses, used by 'run_block'
+
+import math, time
+from contextlib import contextmanager
+import pandas as pd
+
+
+class TrialTimer:
+
+    '''
+    Stamps stimulus onsets and responses on one monotonic, high-resolution clock.
+
+    The onset is taken from the flip itself: the keyboard clock is reset from 'win.callOnFlip', so it
+    starts at the moment the stimulus is put on screen rather than when 'win.flip()' returns. Responses
+    are read from a psychopy Keyboard (or an AsyncKeyboard), which reports the time each key went down
+    as given by the hardware event, instead of the time the event queue was polled. All the raw timestamps of the last
+    trial are kept in 'stamps' so that latencies can be audited offline.
+
+    Every flip also goes through the timer, which records it in 'flips': when it was planned, when it
+    happened, how many frames were dropped on the way, and how long the code between it and the
+    previous flip spent in each section marked with 'section' (loading an image, logging, etc.), so
+    that late flips can be traced back to their cause.
+
+    Parameters
+    ——————————
+     • win : the psychopy window (or a SimulatedWindow) the stimuli are shown in.
+     • keyboard : the keyboard to read the responses from, e.g. an AsyncKeyboard. Defaults to a
+       psychopy Keyboard, or to a SimulatedKeyboard when the window is simulated.
+    '''
+
+    def __init__(self, win, keyboard = None):
+
+        self.win = win
+        # a simulated window brings its own virtual clock and keyboard
+        if getattr(win, 'simulated', False):
+            self.getTime = win.clock.getTime
+            self.keyboard = keyboard if keyboard is not None else win.keyboard
+        else:
+            # psychopy is only needed with a real window, so that simulated sessions run without it
+            from psychopy import core
+            from psychopy.hardware.keyboard import Keyboard
+            # same time base as the key events of the Keyboard
+            self.getTime = core.getTime
+            self.keyboard = keyboard if keyboard is not None else Keyboard()
+        # raw timestamps of the current trial
+        self.stamps = {}
+        # duration of a frame, in seconds, as measured by psychopy when the window was created
+        self.frame_period = win.monitorFramePeriod
+        # every flip so far, the flip the current trial started at, and the time spent in each
+        # section since the last flip
+        self.flips = []
+        self._trial_start = 0
+        self._sections = {}
+
+
+    def _on_flip(self, record, onset):
+        # called by the window right after the buffers were swapped
+        record['time'] = self.getTime()
+        if onset:
+            self.keyboard.clock.reset()
+
+
+    @contextmanager
+    def section(self, name):
+
+        '''
+        Marks a section of code, whose duration is recorded with the next flip. Use as
+        'with timer.section('image'): ...'.
+        '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sections[name] = self._sections.get(name, 0.) + time.perf_counter() - start
+
+
+    def to_frames(self, secs):
+
+        '''
+        Converts a duration in seconds to a number of frames (at least one) at the refresh rate of the
+        window.
+        '''
+
+        return max(1, round(secs / self.frame_period))
+
+
+    def flip(self, label, frames = None, planned = None, onset = False):
+
+        '''
+        Flips the window and records the flip. Returns the time of the flip.
+
+        Parameters
+        ——————————
+         • label : what the flip shows, e.g. 'fixation'.
+         • frames : number of frames the previous flip was meant to stay on screen. Frames are dropped
+           if the flip comes later than that. If None, the flip is expected on the next frame.
+         • planned : time the flip was planned for in the schedule of the trial, which its error is
+           measured from. Defaults to the time it was expected at.
+         • onset : bool. Whether the flip is a stimulus onset, from which the RT is measured.
+        '''
+
+        # when the flip is expected to happen
+        if frames is not None and self.flips:
+            expected = self.flips[-1]['time'] + frames * self.frame_period
+        else:
+            expected = self.win.getFutureFlipTime(clock = None)
+        planned = expected if planned is None else planned
+
+        record = {'label': label, 'planned': planned}
+        self.win.callOnFlip(self._on_flip, record, onset)
+        record['flip_time'] = self.win.flip()
+
+        # how late it was, in seconds from the schedule and in frames from the previous flip
+        record['interval'] = record['time'] - self.flips[-1]['time'] if self.flips else float('nan')
+        record['error'] = record['time'] - planned
+        record['dropped'] = max(0, round((record['time'] - expected) / self.frame_period))
+        # the slowest section since the last flip is the likely cause of a late flip, if it took a good
+        # part of a frame; otherwise the flip was late because of how long we waited before it
+        record['sections'] = self._sections
+        slowest = max(self._sections, key = self._sections.get, default = None)
+        if not record['dropped']:
+            record['cause'] = ''
+        elif slowest is not None and self._sections[slowest] > self.frame_period / 2:
+            record['cause'] = slowest
+        else:
+            record['cause'] = 'wait'
+        self._sections = {}
+        self.flips.append(record)
+
+        return record['time']
+
+
+    def start_trial(self):
+
+        '''
+        Starts the timestamps and flip records of a new trial.
+        '''
+
+        self.stamps = {}
+        # only the last flip of the previous trial is needed, to time the next one
+        self.flips = self.flips[-1:]
+        self._trial_start = len(self.flips)
+
+
+    def trial_frames(self):
+
+        '''
+        Returns the frame timing of the current trial: the onset error in seconds, the number of frames
+        dropped over all its flips, the longest interval between two of its flips, and the section most
+        likely to have caused the worst late flip.
+        '''
+
+        flips = self.flips[self._trial_start:]
+        onsets = [flip for flip in flips if flip['label'] == 'stimulus']
+        worst = max(flips, key = lambda flip: flip['dropped'], default = None)
+
+        return {
+            'onset_error': onsets[-1]['error'] if onsets else float('nan'),
+            'dropped_frames': sum(flip['dropped'] for flip in flips),
+            # (the first flip of the session has no interval)
+            'max_flip_interval': max((flip['interval'] for flip in flips if not math.isnan(flip['interval'])),
+                                     default = float('nan')),
+            'late_cause': worst['cause'] if worst is not None and worst['dropped'] else ''
+        }
+
+
+    def wait(self, secs):
+
+        '''
+        Waits for a given time, in seconds. Negative times don't wait.
+        '''
+
+        if secs <= 0:
+            return
+        if getattr(self.win, 'simulated', False):
+            self.win.wait(secs)
+        else:
+            from psychopy import core
+            core.wait(secs)
+
+
+    def flip_onset(self, frames = None, planned = None):
+
+        '''
+        Flips the window to show the stimulus drawn beforehand and stamps its onset.
+        Returns the onset time.
+
+        Parameters
+        ——————————
+         • frames : number of frames the previous flip was meant to stay on screen, see 'flip'.
+         • planned : time the onset was planned for, see 'flip'.
+        '''
+
+        # anything pressed before the onset is not a response to this stimulus
+        self.keyboard.clearEvents()
+        # stamp the onset when the flip happens
+        self.flip('stimulus', frames, planned, onset = True)
+        self.stamps['planned_onset'] = self.flips[-1]['planned']
+        self.stamps['onset_time'] = self.flips[-1]['time']
+        self.stamps['flip_time'] = self.flips[-1]['flip_time']
+
+        return self.stamps['onset_time']
+
+
+    def wait_response(self, keyList, max_wait = None):
+
+        '''
+        Waits for one of the given keys after the last onset. Returns the key pressed and the RT in
+        seconds, measured from the onset to the hardware time of the key press, or (None, NaN) if no
+        key was pressed before the deadline.
+
+        Parameters
+        ——————————
+         • keyList : list of the keys accepted as a response.
+         • max_wait : the response window, in seconds from the onset. None to wait as long as it takes.
+        '''
+
+        # return at the press: the psychopy Keyboard would wait for the release by default, and a press
+        # made in time but released after the deadline would be a timeout
+        if max_wait is None:
+            keys = self.keyboard.waitKeys(keyList = list(keyList), waitRelease = False)
+        else:
+            # the deadline is counted from the onset, not from now
+            time_left = max(0., self.stamps['onset_time'] + max_wait - self.getTime())
+            keys = self.keyboard.waitKeys(maxWait = time_left, keyList = list(keyList), waitRelease = False)
+        # time at which the key press reached us, or the deadline passed
+        self.stamps['poll_time'] = self.getTime()
+        # keys pressed before the onset, only known to keyboards that keep them
+        self.stamps['anticipations'] = len(getattr(self.keyboard, 'anticipations', []))
+
+        # no response in time
+        if not keys:
+            self.stamps['key_time'] = float('nan')
+            return None, float('nan')
+
+        # time at which the key went down, from the input event
+        self.stamps['key_time'] = keys[0].tDown
+
+        return keys[0].name, keys[0].rt
+
+
+    def wait_keys(self, keyList = ['space']):
+
+        '''
+        Waits until one of the given keys is pressed, e.g. to leave an instruction screen. Returns the key.
+
+        Parameters
+        ——————————
+         • keyList : list of the keys to wait for. None for any key. Defaults to 'space'.
+        '''
+
+        self.keyboard.clearEvents()
+        return self.keyboard.waitKeys(keyList = keyList, waitRelease = False)[0].name
+
+
+
+def _main_cause(causes):
+    # most frequent cause of late flips, causes read back from a log are NaN when empty
+    causes = causes.fillna('')
+    causes = causes[causes != '']
+    return causes.mode().iat[0] if len(causes) else ''
+
+
+
+def frame_summary(df, by = ['block']):
+
+    '''
+    Summarises the frame timing of trials, e.g. per block or for the whole session.
+
+    Parameters
+    ——————————
+     • df : the trial data, with the 'onset_error', 'dropped_frames' and 'late_cause' columns.
+     • by : list of the columns to group the trials by. An empty list summarises all the trials.
+
+     Returns
+    ——————————
+     • summary : dataframe with the number of trials, of trials with dropped frames, of frames
+       dropped, the mean and maximum onset error (in ms) and the most frequent cause of late flips.
+    '''
+
+    grouped = df.assign(all = 'all').groupby(by or ['all'])
+    summary = grouped.agg(
+        trials = ('dropped_frames', 'size'),
+        late_trials = ('dropped_frames', lambda dropped: int((dropped > 0).sum())),
+        dropped_frames = ('dropped_frames', 'sum'),
+        mean_onset_error_ms = ('onset_error', lambda error: 1000 * error.mean()),
+        max_onset_error_ms = ('onset_error', lambda error: 1000 * error.max()),
+        main_cause = ('late_cause', _main_cause))
+
+    return summary
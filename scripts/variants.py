@@ -0,0 +1,222 @@
+# Store of the images pre-rendered at their display size, used by the stimulus cache
+#
+#     python -m scripts.variants build --size 1440 900 --units pix --color '#BABAB9'
+
+import argparse, glob, hashlib, json, os
+import numpy as np
+from PIL import Image, ImageColor
+from scripts.manifest import load_manifest
+
+
+def variant_key(size, units, screen_color, stim_size = (500,500)):
+
+    '''
+    Returns the key of a window configuration: images rendered for one configuration can only be used
+    with exactly the same one.
+
+    Parameters
+    ——————————
+     • size : size of the window, in pixels.
+     • units : units of the window.
+     • screen_color : background color of the window.
+     • stim_size : display size of the stimuli.
+    '''
+
+    config = json.dumps([list(size), units, screen_color, list(stim_size)])
+    return hashlib.sha256(config.encode()).hexdigest()[:12]
+
+
+
+def render_image(file, size, screen_color, resample = Image.LANCZOS):
+
+    '''
+    Renders an image at its display size, as 8-bit RGB. Transparent parts are filled with the
+    background color of the window.
+
+    Parameters
+    ——————————
+     • file : path to the image.
+     • size : display size in pixels, None to keep the size of the file.
+     • screen_color : background color of the window.
+     • resample : resampling filter of PIL used to reach the display size.
+    '''
+
+    with Image.open(file) as img:
+        img = img.convert('RGBA')
+    # flatten the image onto the background
+    background = Image.new('RGBA', img.size, ImageColor.getrgb(screen_color))
+    img = Image.alpha_composite(background, img).convert('RGB')
+    if size is not None and tuple(img.size) != tuple(size):
+        img = img.resize(tuple(size), resample)
+
+    return img
+
+
+
+def screen_hash(file, display_size, screen_color):
+
+    '''
+    Returns the hash of what a pre-rendered screen depends on: the content of its file, and the size
+    and background it is rendered with. A screen whose hash changed has to be rendered again.
+    '''
+
+    with open(file, 'rb') as content:
+        digest = hashlib.sha256(content.read())
+    digest.update(json.dumps([display_size, screen_color]).encode())
+
+    return digest.hexdigest()
+
+
+
+def build_variant_store(stim_df, screens, size, units, screen_color, stim_size = (500,500),
+                        folder = r'./variants'):
+
+    '''
+    Renders every stimulus and screen once for a window configuration, and saves them as raw RGB pixels
+    in a single file that can be memory-mapped, with an index of where each image starts.
+
+    Only 'pix' units are supported: in other units the size of the images in pixels depends on the
+    monitor and can't be known ahead of time.
+
+    Parameters
+    ——————————
+     • stim_df : the stimuli, from the stimulus manifest.
+     • screens : list of the instruction and feedback screens, shown at the size of their file.
+     • size : size of the window, in pixels.
+     • units : units of the window.
+     • screen_color : background color of the window.
+     • stim_size : display size of the stimuli.
+     • folder : folder of the variant stores, one sub-folder per configuration.
+
+     Returns
+    ——————————
+     • path : folder of the store that was built.
+    '''
+
+    if units != 'pix':
+        raise ValueError(f"images can only be pre-rendered for 'pix' units, not '{units}'")
+
+    path = os.path.join(folder, variant_key(size, units, screen_color, stim_size))
+    os.makedirs(path, exist_ok = True)
+
+    # what to render, at which size; the hash of the stimuli, and of the screens, tells a stale store apart
+    images = [(file, stim_size, sha256, False) for file, sha256 in zip(stim_df['stim_file'], stim_df['sha256'])]
+    images += [(file, None, screen_hash(file, None, screen_color), True) for file in screens]
+
+    index, offset = {}, 0
+    with open(os.path.join(path, 'textures.raw'), 'wb') as raw:
+        for file, display_size, sha256, screen in images:
+            pixels = np.asarray(render_image(file, display_size, screen_color), dtype = np.uint8)
+            raw.write(pixels.tobytes())
+            index[os.path.normpath(file)] = {'offset': offset, 'width': pixels.shape[1],
+                                             'height': pixels.shape[0], 'sha256': sha256, 'screen': screen}
+            offset += pixels.nbytes
+
+    with open(os.path.join(path, 'index.json'), 'w') as file:
+        json.dump({'size': list(size), 'units': units, 'screen_color': screen_color,
+                   'stim_size': list(stim_size), 'images': index}, file)
+
+    return path
+
+
+
+class VariantStore:
+
+    '''
+    Pre-rendered images of one window configuration, memory-mapped from disk. Images are handed out
+    without decoding, resampling or copying the pixels.
+
+    Parameters
+    ——————————
+     • path : folder of the store, as returned by 'build_variant_store'.
+    '''
+
+    def __init__(self, path):
+
+        with open(os.path.join(path, 'index.json')) as file:
+            meta = json.load(file)
+        self.index = meta['images']
+        self.config = {key: meta[key] for key in ['size', 'units', 'screen_color', 'stim_size']}
+        self.pixels = np.memmap(os.path.join(path, 'textures.raw'), dtype = np.uint8, mode = 'r')
+
+
+    def __contains__(self, file):
+        return os.path.normpath(str(file)) in self.index
+
+
+    def get(self, file):
+
+        '''
+        Returns the pre-rendered image of a file, as a PIL image sharing the memory of the store.
+        '''
+
+        entry = self.index[os.path.normpath(str(file))]
+        n_bytes = entry['width'] * entry['height'] * 3
+        buffer = self.pixels[entry['offset']:entry['offset'] + n_bytes]
+
+        return Image.frombuffer('RGB', (entry['width'], entry['height']), buffer, 'raw', 'RGB', 0, 1)
+
+
+    def stale(self, stim_df):
+
+        '''
+        Returns the stimuli that are missing from the store or changed since it was built.
+        '''
+
+        return [file for file, sha256 in zip(stim_df['stim_file'], stim_df['sha256'])
+                if file not in self or self.index[os.path.normpath(file)]['sha256'] != sha256]
+
+
+    def stale_screens(self):
+
+        '''
+        Returns the screens whose file, or rendering, changed since the store was built (or that were
+        stored without a hash, by older versions).
+        '''
+
+        screens = [file for file, entry in self.index.items() if entry.get('screen', entry['sha256'] is None)]
+        return [file for file in screens if not os.path.exists(file)
+                or screen_hash(file, None, self.config['screen_color']) != self.index[file]['sha256']]
+
+
+
+def open_variant_store(stim_df, size, units, screen_color, stim_size = (500,500), folder = r'./variants'):
+
+    '''
+    Opens the store of a window configuration if it was built and is up to date with the stimuli.
+    Returns None otherwise. Screens changed since the store was built are left out of it, so that they
+    are rendered again from their file.
+    '''
+
+    path = os.path.join(folder, variant_key(size, units, screen_color, stim_size))
+    if not os.path.exists(os.path.join(path, 'index.json')):
+        return None
+    store = VariantStore(path)
+    if store.stale(stim_df):
+        return None
+    stale_screens = store.stale_screens()
+    for file in stale_screens:
+        del store.index[file]
+    if stale_screens:
+        print(f'{len(stale_screens)} screens changed since the images were pre-rendered, rendering them again '
+              f'(python -m scripts.variants build to update the store)')
+
+    return store
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Pre-render the images for a window configuration.')
+    parser.add_argument('command', choices = ['build'])
+    parser.add_argument('--size', type = int, nargs = 2, default = [1440, 900], help = 'window size in pixels')
+    parser.add_argument('--units', default = 'pix', help = 'window units')
+    parser.add_argument('--color', default = '#BABAB9', help = 'background color of the window')
+    parser.add_argument('--stim-size', type = int, nargs = 2, default = [500, 500], help = 'stimulus size')
+    parser.add_argument('--stimuli', default = r'./stimuli', help = 'folder of the stimuli')
+    parser.add_argument('--folder', default = r'./variants', help = 'folder of the variant stores')
+    args = parser.parse_args()
+
+    path = build_variant_store(load_manifest(args.stimuli), sorted(glob.glob(r'instructions/*.png')),
+                               args.size, args.units, args.color, args.stim_size, args.folder)
+    print(f'Images rendered for this configuration in {path}')
@@ -0,0 +1,480 @@
+# Verification of the frames actually rendered, used by 'run_block' and the main experiment script
+#
+#     python -m scripts.verification --config experiment.toml --offscreen
+
+import argparse, ctypes, hashlib, os, queue, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from PIL import Image
+from scripts.variants import render_image
+
+
+# grid the grey levels of a frame are averaged over in its fingerprint
+FINGERPRINT_SIZE = (16, 16)
+
+# columns of the trial data identifying a trial, those found in the data are used to match the checks
+TRIAL_KEYS = ['attempt', 'run', 'block', 'trial_nb']
+
+
+def fingerprint(image):
+
+    '''
+    Returns the fingerprint of an image: its grey levels averaged over a 16 x 16 grid, as a flat array.
+    Unlike a hash of the pixels, it survives the resampling and blending of the texture by the graphics
+    card, so a frame read back from the window can be compared with the image it should show.
+
+    Parameters
+    ——————————
+     • image : a PIL image, or an array of RGB pixels (height, width, 3).
+    '''
+
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(np.ascontiguousarray(image))
+    grey = image.convert('L').resize(FINGERPRINT_SIZE, Image.BOX)
+
+    return np.asarray(grey, dtype = np.float32).ravel()
+
+
+
+def frame_references(files, size, screen_color, variants = None, workers = 4):
+
+    '''
+    Returns the fingerprint of each stimulus as it should appear on screen: at its display size, on the
+    background of the window. Meant to be computed in the background, e.g. while the participant dialog
+    is shown.
+
+    Parameters
+    ——————————
+     • files : iterable of paths to the stimuli.
+     • size : display size of the stimuli, in pixels.
+     • screen_color : background color of the window.
+     • variants : a VariantStore of the window, whose pre-rendered images are used where available.
+     • workers : int. Number of worker threads.
+
+     Returns
+    ——————————
+     • references : dictionary mapping each file to its fingerprint.
+    '''
+
+    def reference(file):
+        if variants is not None and file in variants:
+            return fingerprint(variants.get(file))
+        return fingerprint(render_image(file, size, screen_color))
+
+    files = list(dict.fromkeys(os.path.normpath(str(file)) for file in files))
+    with ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'references') as pool:
+        return dict(zip(files, pool.map(reference, files)))
+
+
+
+def stimulus_region(win, size = (500,500)):
+
+    '''
+    Returns the region of the window covered by a stimulus drawn at its centre, as (x, y, width, height)
+    in pixels from the bottom left corner, as OpenGL counts them.
+
+    Parameters
+    ——————————
+     • win : the window, in 'pix' units.
+     • size : display size of the stimulus, in pixels.
+    '''
+
+    if win.units != 'pix':
+        raise ValueError(f"frames can only be verified in a window in 'pix' units, not '{win.units}'")
+    width, height = (int(x) for x in size)
+    win_width, win_height = (int(x) for x in win.size)
+
+    return (win_width - width) // 2, (win_height - height) // 2, width, height
+
+
+
+class GLFrameReader:
+
+    '''
+    Reads a region of the back buffer of a psychopy window into pixel buffer objects without waiting for
+    it: 'read' only queues the transfer on the graphics card, and 'fetch' maps the buffer later, once
+    the transfer is done, e.g. after the flip that showed the frame. 'depth' buffers are used in turn,
+    so that many frames can be in flight. Works with any OpenGL context, including an offscreen one
+    (see 'open_offscreen_window').
+
+    Parameters
+    ——————————
+     • win : the psychopy window, whose OpenGL context must be current.
+     • region : (x, y, width, height) of the region to read, in pixels from the bottom left corner.
+     • depth : int. Number of pixel buffers.
+    '''
+
+    def __init__(self, win, region, depth = 4):
+
+        import pyglet.gl as GL
+        self._gl = GL
+        self.region = region
+        # rows are read as RGBA, without padding
+        self.nbytes = region[2] * region[3] * 4
+        # psychopy draws into a framebuffer object rather than the back buffer if asked to
+        self._source = GL.GL_COLOR_ATTACHMENT0 if getattr(win, 'useFBO', False) else GL.GL_BACK
+        self._buffers = (GL.GLuint * depth)()
+        GL.glGenBuffers(depth, self._buffers)
+        for buffer in self._buffers:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.nbytes, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self._free = deque(self._buffers)
+
+
+    def read(self):
+
+        '''
+        Queues the transfer of the region into a free pixel buffer and returns at once. Returns the
+        buffer to fetch the pixels from, or None if all the buffers are still waiting to be fetched.
+        '''
+
+        if not self._free:
+            return None
+        GL = self._gl
+        x, y, width, height = self.region
+        buffer = self._free.popleft()
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+        GL.glReadBuffer(self._source)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        # with a pixel buffer bound, the pixels go to the buffer, at offset 0, instead of memory
+        GL.glReadPixels(x, y, width, height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        return buffer
+
+
+    def fetch(self, buffer):
+
+        '''
+        Copies the pixels out of a buffer returned by 'read', and frees it. Returns them as an RGB array
+        (height, width, 3), top row first.
+        '''
+
+        GL = self._gl
+        _, _, width, height = self.region
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+        try:
+            pointer = GL.glMapBuffer(GL.GL_PIXEL_PACK_BUFFER, GL.GL_READ_ONLY)
+            data = ctypes.string_at(pointer, self.nbytes)
+        finally:
+            GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self._free.append(buffer)
+
+        # OpenGL rows go from the bottom up
+        return np.frombuffer(data, dtype = np.uint8).reshape(height, width, 4)[::-1, :, :3]
+
+
+    def close(self):
+        self._gl.glDeleteBuffers(len(self._buffers), self._buffers)
+
+
+
+class SoftwareFrameReader:
+
+    '''
+    Renders the frames of a SimulatedWindow in software, as the graphics card would have: the images
+    drawn since the last flip, resampled linearly to the size of the region, on the background of the
+    window, the last one on top. Stands in for a GLFrameReader where there is no OpenGL context, e.g.
+    in simulated sessions; the rendering itself is left to the worker thread of the FrameVerifier.
+
+    Parameters
+    ——————————
+     • win : the SimulatedWindow.
+     • region : (x, y, width, height) of the region to read, in pixels from the bottom left corner.
+    '''
+
+    def __init__(self, win, region):
+        self.win = win
+        self.region = region
+
+
+    def read(self):
+        # what is about to be shown
+        return list(self.win.drawn)
+
+
+    def fetch(self, drawn):
+        # rendered later, by whoever calls the result
+        size = self.region[2:]
+        if not drawn:
+            return lambda: np.asarray(Image.new('RGB', size, self.win.color))
+        return lambda: np.asarray(render_image(drawn[-1], size, self.win.color, Image.BILINEAR))
+
+
+    def close(self):
+        pass
+
+
+
+def open_offscreen_window(size, units = 'pix', color = '#BABAB9'):
+
+    '''
+    Opens a psychopy window in an offscreen OpenGL context, with pyglet's headless mode (EGL), e.g. to
+    verify the rendering on a Linux box without a display. Must be called before anything imports
+    psychopy.visual.
+    '''
+
+    import pyglet
+    pyglet.options['headless'] = True
+    from psychopy import visual
+
+    return visual.Window(size = size, fullscr = False, units = units, color = color, winType = 'pyglet')
+
+
+
+class FrameVerifier:
+
+    '''
+    Checks that each stimulus was actually rendered as expected. Right before the flip showing a
+    stimulus, the region it covers is read back from the window without waiting ('capture'); once the
+    flip is done, the pixels are fetched ('collect') and handed to a worker thread, which hashes them,
+    fingerprints them, and compares the fingerprint with those of all the stimuli of the set. A frame
+    matches if the stimulus it looks most like is the expected one, closer than 'tolerance' grey levels
+    on average. Only the reads and the copies are left to the display thread.
+
+    Parameters
+    ——————————
+     • win : the window, a psychopy window or a SimulatedWindow, in 'pix' units.
+     • references : dictionary mapping the stimuli to their fingerprint, see 'frame_references'.
+     • size : display size of the stimuli, in pixels.
+     • tolerance : largest mean difference of grey levels (0 - 255) between a matching frame and its
+       reference.
+     • depth : int. Number of frames that can be read back and not fetched yet.
+    '''
+
+    def __init__(self, win, references, size = (500,500), tolerance = 8., depth = 4):
+
+        region = stimulus_region(win, size)
+        if getattr(win, 'simulated', False):
+            self.reader = SoftwareFrameReader(win, region)
+        else:
+            self.reader = GLFrameReader(win, region, depth)
+        self.files = list(references)
+        self._index = {file: i for i, file in enumerate(self.files)}
+        self._references = np.stack([references[file] for file in self.files])
+        self.tolerance = tolerance
+        # fields added to every check, e.g. the run and block numbers
+        self.context = {}
+        # one row per frame checked, filled by the worker thread
+        self.checks = []
+        # frames read back and not fetched yet
+        self._pending = deque()
+        # time spent on the display thread, and frames not read because no buffer was free
+        self.display_time = 0.
+        self.n_frames = 0
+        self.skipped = 0
+        # the worker thread
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target = self._check_frames, name = 'frame-verifier', daemon = True)
+        self._thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def set_context(self, **fields):
+
+        '''
+        Sets fields to add to every following check.
+        '''
+
+        self.context.update(fields)
+
+
+    def capture(self, file, **fields):
+
+        '''
+        Reads back the frame about to be shown, expected to show the given stimulus. Call it after
+        drawing the frame, right before the flip. Returns immediately.
+
+        Parameters
+        ——————————
+         • file : path to the stimulus drawn.
+         • fields : fields identifying the trial, e.g. its number.
+        '''
+
+        start = time.perf_counter()
+        row = {**self.context, **fields, 'expected': os.path.normpath(str(file))}
+        handle = self.reader.read()
+        if handle is None:
+            self.skipped += 1
+        else:
+            self._pending.append((row, handle))
+        self.n_frames += 1
+        self.display_time += time.perf_counter() - start
+
+
+    def collect(self):
+
+        '''
+        Fetches the frames read back so far and hands them to the worker thread. Call it once the flip
+        showing the last frame captured is done, e.g. after the response.
+        '''
+
+        start = time.perf_counter()
+        while self._pending:
+            row, handle = self._pending.popleft()
+            self._queue.put((row, self.reader.fetch(handle)))
+        self.display_time += time.perf_counter() - start
+
+
+    def _check_frames(self):
+
+        while True:
+            item = self._queue.get()
+            # None is the signal to stop
+            if item is None:
+                break
+            row, pixels = item
+            # frames rendered in software are rendered here
+            if callable(pixels):
+                pixels = pixels()
+            pixels = np.ascontiguousarray(pixels)
+            distances = np.abs(self._references - fingerprint(pixels)).mean(axis = 1)
+            nearest = self.files[int(np.argmin(distances))]
+            expected = self._index.get(row['expected'])
+            distance = float(distances[expected]) if expected is not None else float('nan')
+            self.checks.append({**row, 'frame_hash': hashlib.sha256(pixels.tobytes()).hexdigest()[:16],
+                                'frame_nearest': nearest, 'frame_distance': distance,
+                                'frame_match': nearest == row['expected'] and distance <= self.tolerance})
+
+
+    def close(self):
+
+        '''
+        Checks the frames still waiting and stops the worker thread.
+        '''
+
+        if self._thread.is_alive():
+            self.collect()
+            self._queue.put(None)
+            self._thread.join()
+            self.reader.close()
+
+
+    def report(self):
+
+        '''
+        Returns the checks made so far as a dataframe, one row per frame checked.
+        '''
+
+        return pd.DataFrame(self.checks, columns = None if self.checks else
+                            ['expected', 'frame_hash', 'frame_nearest', 'frame_distance', 'frame_match'])
+
+
+    def summary(self):
+
+        '''
+        Returns a dictionary summarising the checks: frames captured, checked, skipped and mismatched,
+        and the mean time each capture cost the display thread, in ms.
+        '''
+
+        checks = self.report()
+        return {
+            'frames': self.n_frames,
+            'checked': len(checks),
+            'skipped': self.skipped,
+            'mismatches': int((~checks['frame_match'].astype(bool)).sum()),
+            'display_ms': 1000 * self.display_time / max(1, self.n_frames)
+        }
+
+
+    def save(self, path):
+
+        '''
+        Saves the checks. Rows are appended if the file already exists, e.g. when a session is resumed.
+        '''
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.report().to_csv(path, mode = 'a', header = not exists, index = False)
+
+
+
+def read_frame_checks(path):
+
+    '''
+    Reads the checks saved by 'FrameVerifier.save'.
+    '''
+
+    return pd.read_csv(path, dtype = {'frame_hash': str})
+
+
+
+def add_frame_checks(df, checks):
+
+    '''
+    Adds the result of the frame verification to the trial data.
+
+    Parameters
+    ——————————
+     • df : the trial data.
+     • checks : the checks of the session, from 'FrameVerifier.report' or 'read_frame_checks'.
+
+     Returns
+    ——————————
+     • df : a copy of the data with the 'frame_match', 'frame_distance', 'frame_nearest' and
+       'frame_hash' of each trial, empty for the trials not checked.
+    '''
+
+    keys = [key for key in TRIAL_KEYS if key in df.columns and key in checks.columns]
+    checks = checks.drop_duplicates(keys, keep = 'last')
+    columns = keys + ['frame_match', 'frame_distance', 'frame_nearest', 'frame_hash']
+    trials = df.reset_index().merge(checks[columns], on = keys, how = 'left').set_index('index')
+    trials.index.name = df.index.name
+
+    return trials
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Draw every stimulus once and check what was rendered, '
+                                                   'e.g. on a headless box.')
+    parser.add_argument('--config', default = r'./experiment.toml', help = 'description of the session')
+    parser.add_argument('--offscreen', action = 'store_true', help = 'render in an offscreen OpenGL context')
+    parser.add_argument('--simulate', action = 'store_true', help = 'render in software, without OpenGL')
+    parser.add_argument('--tolerance', type = float, default = 8., help = 'largest mean grey level difference')
+    args = parser.parse_args()
+
+    from scripts.config import read_config, plan_stimuli
+    from scripts.manifest import load_manifest
+    config = read_config(args.config)
+    window = config['window']
+    stimuli = plan_stimuli(config, load_manifest(config['stimuli']['folder']))
+
+    if args.simulate:
+        from scripts.simulated import SimulatedWindow
+        win = SimulatedWindow(size = window['size'], units = window['units'], color = window['color'])
+    elif args.offscreen:
+        win = open_offscreen_window(window['size'], window['units'], window['color'])
+    else:
+        from psychopy import visual
+        win = visual.Window(size = window['size'], fullscr = False, units = window['units'], color = window['color'])
+    from scripts.cache import StimulusCache
+
+    references = frame_references(stimuli, (500,500), window['color'])
+    cache = StimulusCache(win)
+    cache.preload(stimuli, size = (500,500))
+    with FrameVerifier(win, references, tolerance = args.tolerance) as verifier:
+        for n, file in enumerate(stimuli):
+            cache.get(file, size = (500,500)).draw()
+            verifier.capture(file, trial_nb = n)
+            win.flip()
+            verifier.collect()
+    win.close()
+
+    summary = verifier.summary()
+    print(f"{summary['checked']} of {summary['frames']} frames checked, {summary['mismatches']} mismatches, "
+          f"{summary['display_ms']:.3f} ms per frame on the display thread")
+    checks = verifier.report()
+    for _, check in checks.loc[~checks['frame_match'].astype(bool)].iterrows():
+        print(f"  {check['expected']}: looks like {check['frame_nearest']} ({check['frame_distance']:.1f})")
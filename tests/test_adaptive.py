@@ -0,0 +1,31 @@
+from scripts.adaptive import ImageEstimates
+
+
+def test_select_keeps_the_least_known_images():
+
+    images = [f'main_face_{n}' for n in range(4)] + [f'main_scene_{n}' for n in range(4)]
+    estimates = ImageEstimates(images, ['face'])
+    # the even images are well known by now
+    for image in images[::2]:
+        for rt in (0.5, 0.6, 0.5, 0.6, 0.5, 0.6):
+            estimates.update(image, 'face', rt, True)
+
+    files = [f'stimuli/{image}.png' for image in images]
+    kept = estimates.select(files, 'face', 4)
+
+    assert kept == ['stimuli/main_face_1.png', 'stimuli/main_face_3.png', 'stimuli/main_scene_1.png',
+                    'stimuli/main_scene_3.png']
+
+
+def test_select_keeps_runs_of_targets_short():
+
+    images = ['main_face_0', 'main_scene_0', 'main_face_1', 'main_scene_1', 'main_face_2', 'main_scene_2']
+    estimates = ImageEstimates(images, ['face'])
+    # the scene between the first two faces is well known, and left out, as is the last face
+    for image in ['main_scene_0', 'main_face_2']:
+        for rt in (0.5, 0.6, 0.5, 0.6, 0.5, 0.6):
+            estimates.update(image, 'face', rt, True)
+    files = [f'stimuli/{image}.png' for image in images]
+
+    assert estimates.select(files, 'face', 4) == [files[0], files[2], files[3], files[5]]
+    assert estimates.select(files, 'face', 4, max_target_run = 1) == [files[0], files[3], files[2], files[5]]
@@ -0,0 +1,71 @@
+import os, sys
+import pandas as pd
+import pytest
+from scripts.aggregate import ingest, load_trials, session_files, summaries
+
+
+def touch(folder, *names):
+    for name in names:
+        (folder / name).write_text('')
+
+
+def test_session_files_leave_out_side_files(tmp_path):
+
+    # a session of the experiment script, and one of the station coordinator with the same participant
+    sessions = ['2023-02-15_ppt12.csv', '2023-02-15_ppt12_vm-1.csv']
+    side = ['log.csv', 'timing.csv', 'keys.csv', 'estimates.csv', 'frames.csv', 'session.json',
+            # a file a later version might write
+            'anything.csv']
+    for name in sessions:
+        touch(tmp_path, name, *[os.path.splitext(name)[0] + '_' + suffix for suffix in side])
+    # a session that was interrupted: only its session file and log
+    touch(tmp_path, '2023-02-16_ppt14_session.json', '2023-02-16_ppt14_log.csv', '2023-02-16_ppt14_anything.csv')
+    touch(tmp_path, 'notes.csv')
+
+    assert session_files(str(tmp_path)) == [str(tmp_path / name) for name in sessions]
+
+
+def test_session_files_without_session_file(tmp_path):
+
+    # sessions run before they kept a session file
+    touch(tmp_path, '2023-02-15_ppt12.csv', '2023-02-15_ppt12_log.csv', '2023-02-15_ppt12_frames.csv',
+          '2023-02-15_ppt12_vm-1.csv', '2023-02-15_ppt12_vm-1_timing.csv')
+
+    assert session_files(str(tmp_path)) == [str(tmp_path / '2023-02-15_ppt12.csv'),
+                                            str(tmp_path / '2023-02-15_ppt12_vm-1.csv')]
+
+
+def write_session(folder, name, participant, **columns):
+    # a session file as written by the experiment script, two trials of a face block
+    df = pd.DataFrame({'trial_nb': [0, 1], 'rt': [0.5, 0.7], 'acc': [True, False], 'response': ['f', 'j'],
+                       'image': ['main_face_1', 'main_scene_1'], 'category': ['face', 'scene'], 'exp_phase': 'main',
+                       'task': 'face', 'ID': participant, 'age': 20, 'gender': 'f', 'run': 1, 'block': 1, **columns})
+    df.to_csv(folder / name)
+
+
+def test_ingest_twice_with_new_columns(tmp_path):
+
+    pytest.importorskip('pyarrow')
+    dataset = str(tmp_path / 'cohort')
+    write_session(tmp_path, '2023-02-15_ppt1.csv', '001')
+    assert ingest(session_files(str(tmp_path)), dataset, workers = 1) == 1
+    # a later batch, from sessions with a response deadline
+    write_session(tmp_path, '2023-02-16_ppt2.csv', '002', timeout = [False, True])
+    assert ingest(session_files(str(tmp_path)), dataset, workers = 1) == 1
+    assert ingest(session_files(str(tmp_path)), dataset, workers = 1) == 0
+
+    trials = load_trials(dataset, demographics = True).sort_values(['session', 'trial_nb'])
+
+    assert trials['ID'].tolist() == ['001', '001', '002', '002']
+    assert trials['timeout'].isna().tolist() == [True, True, False, False]
+    assert (trials['run'] == 1).all() and (trials['task'] == 'face').all()
+    assert summaries(dataset)['participant']['timeout_rate'].tolist() == [0, 0.5]
+
+
+def test_ingest_without_pyarrow(tmp_path, monkeypatch):
+
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    write_session(tmp_path, '2023-02-15_ppt1.csv', '001')
+
+    with pytest.raises(ImportError, match = 'pip install pyarrow'):
+        ingest(session_files(str(tmp_path)), str(tmp_path / 'cohort'))
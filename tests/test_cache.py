@@ -0,0 +1,30 @@
+from scripts.cache import StimulusCache
+from scripts.simulated import SimulatedWindow
+
+
+def test_stimuli_are_loaded_once():
+
+    win = SimulatedWindow()
+    cache = StimulusCache(win, sizes = {'a.png': (10, 10)})
+
+    stim = cache.get('a.png', size = (500, 500))
+
+    assert cache.get('a.png', size = (500, 500)) is stim
+    assert cache.report()['misses'] == 1 and cache.report()['hits'] == 1
+
+
+def test_least_recently_used_stimuli_are_evicted():
+
+    win = SimulatedWindow()
+    # 400 bytes per image, room for two
+    files = ['a.png', 'b.png', 'c.png']
+    cache = StimulusCache(win, max_bytes = 800, sizes = {file: (10, 10) for file in files})
+
+    cache.preload(['a.png', 'b.png'])
+    # 'a' is used again, so 'b' is the least recently used when 'c' comes in
+    cache.get('a.png')
+    cache.get('c.png')
+
+    assert ('a.png', None) in cache and ('c.png', None) in cache and ('b.png', None) not in cache
+    report = cache.report()
+    assert report['evictions'] == 1 and report['resident_mb'] * 1024**2 == 800
@@ -0,0 +1,29 @@
+from scripts.calibration import measure_keyboard
+from scripts.simulated import SimulatedWindow
+
+
+class ReleaseKeyboard:
+
+    # a keyboard on which every key is held 1 s, waiting for the release unless told not to, as the
+    # psychopy Keyboard does by default
+    def __init__(self, keyboard):
+        self.keyboard = keyboard
+        self.clock = keyboard.clock
+
+    def clearEvents(self):
+        pass
+
+    def waitKeys(self, maxWait = float('inf'), keyList = None, waitRelease = True, **kwargs):
+        keys = self.keyboard.waitKeys(maxWait = maxWait, keyList = keyList)
+        if keys and waitRelease:
+            self.keyboard.win.now += 1.
+        return keys
+
+
+def test_keyboard_latency_leaves_out_how_long_keys_are_held():
+
+    win = SimulatedWindow()
+    keys = measure_keyboard(win, ReleaseKeyboard(win.keyboard), n_presses = 3)
+
+    # only the polling delay of the simulated keyboard
+    assert keys['latency_max_ms'] < 10
@@ -0,0 +1,59 @@
+import pathlib
+import pytest
+from scripts.config import read_config, session_runs, validate_config
+from scripts.manifest import load_manifest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture
+def config(monkeypatch):
+    # the configuration of the repository, whose screens are in its folders
+    monkeypatch.chdir(ROOT)
+    return read_config('experiment.toml')
+
+
+def test_repository_configuration_is_valid(config):
+
+    validate_config(config, load_manifest(config['stimuli']['folder']))
+
+    runs = session_runs(config)
+    assert [run['label'] for run in runs] == ['practice', 'run1', 'run2', 'run3']
+    assert [run['run'] for run in runs] == [0, 1, 2, 3]
+    assert runs[0]['criterion']['window'] == 10 and runs[1]['criterion'] is None
+
+
+def test_all_problems_are_reported(config):
+
+    config['task']['keys'] = ['f', 'f']
+    config['task']['interval_time'] = -1
+    config['task']['colour'] = 'red'
+    config['phases'][0]['criterion'] = {'window': 7}
+    config['phases'][1]['after_run'] = {'9': 'break'}
+
+    with pytest.raises(ValueError) as error:
+        validate_config(config)
+
+    message = str(error.value)
+    for problem in ["keys must be two different keys", "interval_time must be a positive number",
+                    "unknown parameter 'colour' in [task]", 'criterion window must be an even number',
+                    'after_run refers to run 9']:
+        assert problem in message
+
+
+def test_missing_screen(config):
+
+    config['screens']['start'] = 'no_such_screen'
+
+    with pytest.raises(ValueError, match = 'no_such_screen.png does not exist'):
+        validate_config(config)
+
+
+def test_defaults(tmp_path):
+
+    path = tmp_path / 'session.toml'
+    path.write_text('[[phases]]\nexp_phase = "main"\n')
+
+    config = read_config(str(path))
+
+    assert config['task']['keys'] == ['f', 'j'] and config['phases'][0]['runs'] == 1
@@ -0,0 +1,35 @@
+from scripts.criterion import PracticeCriterion
+
+
+def play(criterion, trials):
+    # the trials as (target, response 'yes'), with a steady RT; returns whether the block stopped
+    for target, yes in trials:
+        if criterion.update(0.5, yes == target, target):
+            return True
+    return False
+
+
+def test_all_no_responder_does_not_meet_the_criterion():
+
+    criterion = PracticeCriterion(window = 10, accuracy = 0.9, min_trials = 10)
+    # one target in seven, as in the practice, always answered 'no': 6 of 7 trials correct
+    trials = [(n % 7 == 0, False) for n in range(40)]
+
+    assert not play(criterion, trials)
+    assert criterion.state()['criterion_target_accuracy'] == 0
+
+
+def test_window_without_target_does_not_meet_the_criterion():
+
+    criterion = PracticeCriterion(window = 10, accuracy = 0.9, min_trials = 10)
+
+    assert not play(criterion, [(False, False)] * 20)
+
+
+def test_learnt_task_meets_the_criterion():
+
+    criterion = PracticeCriterion(window = 10, accuracy = 0.9, min_trials = 10)
+    trials = [(n % 7 == 0, n % 7 == 0) for n in range(40)]
+
+    assert play(criterion, trials)
+    assert criterion.trials == 10 and criterion.stop == 'criterion'
@@ -0,0 +1,80 @@
+import queue, time
+import numpy as np
+import pandas as pd
+from scripts.keyboard import AsyncKeyboard, add_releases
+
+
+def test_add_releases_with_timeouts():
+
+    # a response, a timeout (no key time), and another response of the same key
+    df = pd.DataFrame({'response': ['f', '', 'f'], 'key_time': [1.0, np.nan, 3.0]})
+    keys = pd.DataFrame({'time': [1.0, 1.2, 3.0, 3.5], 'name': ['f', 'f', 'f', 'f'], 'down': [1, 0, 1, 0]})
+
+    trials = add_releases(df, keys)
+
+    assert list(trials.index) == [0, 1, 2]
+    assert trials['release_time'].tolist()[::2] == [1.2, 3.5]
+    assert np.isnan(trials.loc[1, 'release_time']) and np.isnan(trials.loc[1, 'key_duration'])
+    assert np.allclose(trials['key_duration'].tolist()[::2], [0.2, 0.5])
+
+
+def test_import_without_fcntl(monkeypatch):
+
+    # as on Windows: the module imports, and open_keyboard falls back to psychopy
+    import importlib, sys
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    monkeypatch.setattr(sys, 'platform', 'win32')
+    keyboard = importlib.reload(sys.modules['scripts.keyboard'])
+
+    assert keyboard.open_keyboard() is None
+
+
+class QueueDevice:
+
+    # an input device handing out the events put in it, as (name, down, age) tuples
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def read(self, timeout):
+        try:
+            return [self.queue.get(timeout = timeout)]
+        except queue.Empty:
+            return []
+
+    def close(self):
+        pass
+
+
+def test_async_keyboard():
+
+    now = [10.]
+    device = QueueDevice()
+    keyboard = AsyncKeyboard(device, getTime = lambda: now[0])
+
+    # pressed before the onset: an anticipation, not a response
+    device.queue.put(('f', True, 0.))
+    device.queue.put(('f', False, 0.))
+    time.sleep(0.1)
+    now[0] = 11.
+    keyboard.clearEvents()
+    keyboard.clock.reset()
+    assert [key.name for key in keyboard.anticipations] == ['f']
+
+    # a response read 20 ms after the key went down, then its release and another press
+    now[0] = 11.5
+    device.queue.put(('j', True, 0.02))
+    device.queue.put(('j', False, 0.))
+    device.queue.put(('f', True, 0.))
+    keys = keyboard.waitKeys(maxWait = 1., keyList = ['f', 'j'])
+    assert [key.name for key in keys] == ['j'] and abs(keys[0].rt - 0.48) < 1e-9
+
+    # the events after the response are left for the next read
+    time.sleep(0.1)
+    assert [key.name for key in keyboard.getKeys(keyList = ['f', 'j'])] == ['f']
+    assert abs(keys[0].duration - 0.02) < 1e-9
+
+    # nothing pressed in time
+    assert keyboard.waitKeys(maxWait = 0.05, keyList = ['f', 'j']) == []
+
+    keyboard.close()
+    assert keyboard.key_log()['down'].tolist() == [1, 0, 1, 0, 1]
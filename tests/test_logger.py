@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from scripts.logger import TrialLogger, read_log
+from scripts.scoring import EVENT_DTYPE, LOG_COLUMNS, event_row, score_trials
+
+
+def test_trials_are_on_disk_as_they_are_played(tmp_path):
+
+    path = tmp_path / 'log.csv'
+    logger = TrialLogger(path, columns = LOG_COLUMNS + ['run'])
+    logger.set_context(run = 1)
+    events = np.zeros(2, dtype = EVENT_DTYPE)
+    events[0]['response'], events[0]['rt'] = 'f', 0.5
+    events[1]['timeout'] = True
+
+    # the first trial can be read back before the second one is played
+    logger.log(event_row(events[0], 'main_face_1', 'face', 'f'))
+    logger.sync()
+    assert len(read_log(path)) == 1
+
+    logger.log(event_row(events[1], 'main_scene_2', 'face', 'f'))
+    logger.close()
+    trials = score_trials(read_log(path))
+
+    assert trials['acc'].tolist() == [True, False] and trials['target'].tolist() == [True, False]
+    assert (trials['run'] == 1).all()
+
+
+def test_unknown_column_fails(tmp_path):
+
+    logger = TrialLogger(tmp_path / 'log.csv', columns = ['rt'])
+    with pytest.raises(ValueError):
+        logger.log({'rt': 0.5, 'acc': True})
+    logger.close()
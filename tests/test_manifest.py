@@ -0,0 +1,52 @@
+import os
+import pytest
+from PIL import Image
+from scripts.manifest import build_manifest, load_manifest
+
+
+def stimulus_set(folder):
+    for name, color in [('main_face_1', 'red'), ('main_scene_1', 'green'), ('practice_body_1', 'blue')]:
+        Image.new('RGB', (4, 3), color).save(folder / f'{name}.png')
+    build_manifest(str(folder))
+
+
+def test_manifest_round_trip(tmp_path):
+
+    stimulus_set(tmp_path)
+
+    stim_df = load_manifest(str(tmp_path))
+
+    assert stim_df['stim_cat'].tolist() == ['face', 'scene', 'body']
+    assert stim_df['exp_phase'].tolist() == ['main', 'main', 'practice']
+    assert stim_df['stim_file'].iloc[0] == os.path.join(str(tmp_path), 'main_face_1.png')
+    assert (stim_df['width'] == 4).all() and (stim_df['height'] == 3).all()
+
+
+def test_modified_image_is_detected(tmp_path):
+
+    stimulus_set(tmp_path)
+    # same size and name, other pixels
+    Image.new('RGB', (4, 3), 'black').save(tmp_path / 'main_face_1.png')
+    os.utime(tmp_path / 'main_face_1.png', ns = (0, 0))
+
+    with pytest.raises(ValueError, match = r"modified \['main_face_1.png'\]"):
+        load_manifest(str(tmp_path))
+
+
+def test_added_and_missing_images_are_detected(tmp_path):
+
+    stimulus_set(tmp_path)
+    os.remove(tmp_path / 'main_scene_1.png')
+    Image.new('RGB', (4, 3), 'white').save(tmp_path / 'main_body_2.png')
+
+    with pytest.raises(ValueError, match = r"missing \['main_scene_1.png'\], added \['main_body_2.png'\]"):
+        load_manifest(str(tmp_path))
+
+
+def test_missing_manifest(tmp_path):
+
+    Image.new('RGB', (4, 3), 'red').save(tmp_path / 'main_face_1.png')
+
+    with pytest.raises(FileNotFoundError, match = 'python -m scripts.manifest build'):
+        load_manifest(str(tmp_path))
+    assert not (tmp_path / 'manifest.csv').exists()
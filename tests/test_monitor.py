@@ -0,0 +1,29 @@
+from scripts.monitor import PerformanceMonitor
+
+
+def test_timeouts_are_not_taken_for_swapped_keys():
+
+    monitor = PerformanceMonitor()
+    monitor.start_block(1, 1, 'face', 'f')
+    # a slow participant: every response correct, but most trials timed out
+    for n in range(20):
+        timeout = n % 4 != 0
+        monitor.update('face', 'f', float('nan') if timeout else 0.6, correct = not timeout, timeout = timeout)
+
+    alerts = monitor.end_block()
+
+    assert alerts == ['75% of the trials timed out']
+
+
+def test_swapped_keys(capsys):
+
+    monitor = PerformanceMonitor()
+    monitor.start_block(1, 1, 'face', 'f')
+    for n in range(20):
+        monitor.update('face', 'f', 0.6, correct = n == 0)
+
+    alerts = monitor.end_block()
+
+    assert len(alerts) == 1 and 'were the keys swapped?' in alerts[0]
+    # shown by the caller
+    assert capsys.readouterr().out == ''
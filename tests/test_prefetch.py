@@ -0,0 +1,35 @@
+from PIL import Image
+from scripts.prefetch import Prefetcher, decode_images
+
+
+def make_images(folder, n):
+    files = []
+    for i in range(n):
+        file = str(folder / f'main_face_{i}.png')
+        Image.new('RGB', (8, 8), (i, 0, 0)).save(file)
+        files.append(file)
+    return files
+
+
+def test_images_come_in_trial_order(tmp_path):
+
+    files = make_images(tmp_path, 6)
+
+    with Prefetcher(files, depth = 2) as prefetcher:
+        # never more than 'depth' images ahead
+        assert len(prefetcher._pending) == 2
+        images = [prefetcher.get() for _ in files]
+        assert len(prefetcher._pending) == 0
+
+    assert [file for file, _ in images] == files
+    assert [image.getpixel((0, 0))[0] for _, image in images] == list(range(6))
+    assert len(prefetcher.wait_times) == 6
+
+
+def test_decode_images(tmp_path):
+
+    files = make_images(tmp_path, 3)
+
+    images = decode_images(files + files[:1])
+
+    assert list(images) == files and all(image.size == (8, 8) for image in images.values())
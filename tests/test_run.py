@@ -0,0 +1,49 @@
+import pathlib
+import numpy as np
+import pytest
+from scripts.funcs import run
+from scripts.manifest import load_manifest
+from scripts.simulated import SimulatedWindow
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture
+def stimuli(monkeypatch):
+    # the task reads its screens from the folders of the repository
+    monkeypatch.chdir(ROOT)
+    return load_manifest('stimuli')
+
+
+def test_durations_are_whole_frames(stimuli):
+
+    # at 75 Hz, 400 ms is 30 frames, and 500 ms is rounded to 38 frames
+    win = SimulatedWindow(frame_rate = 75., seed = 1)
+
+    df = run(win, stimuli, 'practice', interval_time = 0.4, feedback_time = 0.5)
+
+    assert len(df) == 6 * 21 and (df['dropped_frames'] == 0).all()
+    assert np.allclose(df['fixation_duration'], 30 / 75.)
+    assert np.allclose(df['feedback_duration'], 38 / 75.)
+
+
+def test_durations_in_frames(stimuli):
+
+    win = SimulatedWindow(seed = 1)
+
+    df = run(win, stimuli, 'practice', interval_frames = 12, feedback_frames = 3)
+
+    assert np.allclose(df['fixation_duration'], 12 / 60.)
+    assert np.allclose(df['feedback_duration'], 3 / 60.)
+
+
+def test_block_summaries_go_to_the_report(stimuli, capsys):
+
+    win = SimulatedWindow(seed = 1)
+    lines = []
+
+    run(win, stimuli, 'practice', interval_frames = 1, feedback_frames = 1, report = lines.append)
+
+    # one line per block, and nothing printed by the library itself
+    assert len(lines) == 6 and all(line.startswith(f'Block {n + 1}: ') for n, line in enumerate(lines))
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scripts.schedule import (balance_report, compile_schedule, compile_schedules, limit_target_run, longest_run,
+                              schedule_blocks)
+
+CATEGORIES = ['face', 'scene', 'body']
+
+
+def stimuli(n_per_category = 5):
+    categories = CATEGORIES + ['object']
+    return pd.DataFrame({
+        'stim_file': [f'stimuli/main_{cat}_{n}.png' for cat in categories for n in range(n_per_category)],
+        'stim_cat': [cat for cat in categories for _ in range(n_per_category)],
+        'exp_phase': 'main'
+    })
+
+
+def test_same_seed_same_schedule():
+
+    first = compile_schedule(stimuli(), 'main', n_runs = 2, seed = 3)
+
+    assert np.array_equal(first, compile_schedule(stimuli(), 'main', n_runs = 2, seed = 3))
+    assert not np.array_equal(first, compile_schedule(stimuli(), 'main', n_runs = 2, seed = 4))
+
+
+def test_max_target_run():
+
+    schedules = compile_schedules(stimuli(), 'main', n_participants = 50, seed = 1, max_target_run = 2)
+    report = balance_report(schedules)
+
+    assert report['longest_target_run'].max() <= 2
+    # every block still shows every image once, a quarter of them targets
+    assert np.allclose(report['target_rate'], 0.25)
+
+
+def test_keys_are_counterbalanced():
+
+    schedules = compile_schedules(stimuli(), 'main', n_participants = 6, seed = 1)
+    report = balance_report(schedules)
+
+    # each category is played with each yes key equally often
+    assert (report['n_blocks'] == 6).all()
+    # and each category starts with each key for half of the participants
+    for category in CATEGORIES:
+        first_keys = [next(block['yes_key'] for block in schedule_blocks(schedule, stimuli(), 'main')
+                           if block['category'] == category) for schedule in schedules]
+        assert first_keys.count('f') == first_keys.count('j') == 3
+
+
+def test_schedule_blocks():
+
+    blocks = schedule_blocks(compile_schedule(stimuli(), 'main', seed = 1), stimuli(), 'main')
+
+    assert len(blocks) == 6
+    assert sorted((block['category'], block['yes_key']) for block in blocks) == \
+        sorted((cat, key) for cat in CATEGORIES for key in ['f', 'j'])
+    assert all(sorted(block['images']) == sorted(stimuli()['stim_file']) for block in blocks)
+    assert all(block['no_key'] != block['yes_key'] for block in blocks)
+
+
+def test_limit_target_run():
+
+    targets = np.array([True, True, True, False, True, False, False])
+
+    order = limit_target_run(targets, 2)
+
+    assert order.tolist() == [0, 1, 3, 2, 4, 5, 6]
+    assert longest_run(targets[order]) == 2
+    assert limit_target_run(targets, 3).tolist() == list(range(7))
+    with pytest.raises(ValueError):
+        limit_target_run([True, True, False], 0)
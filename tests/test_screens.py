@@ -0,0 +1,53 @@
+import os
+from scripts.cache import StimulusCache
+from scripts.screens import ScreenRenderer, task_screens
+from scripts.simulated import SimulatedWindow
+
+
+def test_a_question_screen_per_category_and_key_order():
+
+    texts = task_screens(['face', 'scene'], ['f', 'j'], folder = 'instructions')
+
+    names = sorted(os.path.basename(file) for file in texts)
+    assert names == ['break.png', 'correct.png', 'qface_f_j.png', 'qface_j_f.png',
+                     'qscene_f_j.png', 'qscene_j_f.png', 'wrong.png']
+    question = texts[os.path.join('instructions', 'qscene_j_f.png')]
+    assert '**scene**' in question and '[ **j** ] = **yes**' in question and '[ **f** ] = **no**' in question
+    assert 'correct.png' not in map(os.path.basename, task_screens(['face'], ['f', 'j'], feedback = False))
+
+
+def test_screens_are_rendered_once_and_kept_on_disk(tmp_path):
+
+    texts = task_screens(['face'], ['f', 'j'])
+    file = os.path.join('instructions', 'qface_f_j.png')
+    renderer = ScreenRenderer((320, 200), texts, folder = tmp_path)
+
+    image = renderer.get(file)
+
+    # the window size, transparent around black text
+    assert image.size == (320, 200) and image.mode == 'RGBA'
+    alpha = image.getchannel('A')
+    assert alpha.getpixel((0, 0)) == 0 and alpha.getextrema()[1] == 255
+    assert renderer.get(file) is image
+    saved = os.listdir(tmp_path)
+    assert len(saved) == 1 and saved[0].startswith('qface_f_j_320x200_')
+
+    # another session reads it back; another window size renders its own
+    again = ScreenRenderer((320, 200), texts, folder = tmp_path).get(file)
+    assert again.tobytes() == image.tobytes()
+    assert len(os.listdir(tmp_path)) == 1
+    ScreenRenderer((640, 400), texts, folder = tmp_path).get(file)
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_the_cache_takes_screens_from_the_renderer():
+
+    win = SimulatedWindow()
+    renderer = ScreenRenderer((320, 200), task_screens(['face'], ['f', 'j']))
+    cache = StimulusCache(win, screens = renderer)
+
+    # no such file on disk: the screen is generated
+    stim = cache.get(os.path.join('instructions', 'break.png'))
+
+    assert stim.image == os.path.join('instructions', 'break.png')
+    assert cache.report()['resident_mb'] * 1024**2 == 320 * 200 * 4
@@ -0,0 +1,40 @@
+import pandas as pd
+from scripts.logger import read_log
+from scripts.session import SessionState
+
+
+def plan(rng):
+    return [{'category': 'face', 'images': ['a', 'b']}, {'category': 'scene', 'images': ['b', 'a']}]
+
+
+def test_resume_skips_completed_blocks(tmp_path):
+
+    path = tmp_path / 'session.json'
+    state = SessionState(path, seed = 1)
+    blocks = state.plan_run('run1', plan)
+    state.complete_block('run1', 0)
+
+    # the session crashes during the second block, and is started again
+    resumed = SessionState(path)
+
+    assert resumed.resumed and resumed.attempt == 2 and resumed.seed == 1
+    assert resumed.plan_run('run1', lambda rng: []) == [{**blocks[0], 'done': 1}, blocks[1]]
+    assert not resumed.is_done('run1')
+    resumed.complete_block('run1', 1)
+    assert resumed.is_done('run1')
+
+    # only the trials of each block from the attempt that completed it
+    log = pd.DataFrame({'run': 1, 'block': [1, 2, 2, 2], 'attempt': [1, 1, 2, 2], 'trial_nb': [0, 0, 0, 1]})
+    kept = resumed.keep_completed(log, {1: 'run1'})
+    assert kept[['block', 'attempt']].values.tolist() == [[1, 1], [2, 2], [2, 2]]
+
+
+def test_keep_completed_with_nothing_logged(tmp_path):
+
+    state = SessionState(tmp_path / 'session.json')
+    state.plan_run('run1', plan)
+    (tmp_path / 'empty_log.csv').write_text('')
+    (tmp_path / 'header_log.csv').write_text('trial_nb,run,block,attempt\n')
+
+    for log in ['empty_log.csv', 'header_log.csv']:
+        assert state.keep_completed(read_log(tmp_path / log), {1: 'run1'}).empty
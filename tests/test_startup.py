@@ -0,0 +1,42 @@
+import json, pathlib, subprocess, sys, threading, time
+from scripts.startup import StartupClock
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def test_stages_on_both_threads(tmp_path):
+
+    clock = StartupClock()
+
+    def prepare():
+        with clock.stage('decoding'):
+            time.sleep(0.01)
+
+    # the session is prepared in the background while the dialog is shown
+    thread = threading.Thread(target = prepare, name = 'prepare')
+    thread.start()
+    with clock.stage('dialog'):
+        time.sleep(0.02)
+    thread.join()
+    clock.mark('first_screen')
+
+    report = clock.report()
+
+    assert [(stage['stage'], stage['thread']) for stage in report['stages']] == [('decoding', 'prepare'),
+                                                                                ('dialog', 'MainThread')]
+    dialog = report['stages'][1]['duration']
+    assert dialog >= 0.02
+    assert abs(report['first_screen_without_dialog'] - (report['marks']['first_screen'] - dialog)) < 1e-9
+    clock.save(tmp_path / 'startup.json')
+    assert json.loads((tmp_path / 'startup.json').read_text())['marks'] == report['marks']
+
+
+def test_light_imports():
+
+    # the clock starts before anything heavy is imported, and the session modules don't import psychopy
+    code = ('import sys; import scripts.startup; heavy = {"numpy", "pandas", "PIL"} & set(sys.modules); '
+            'import scripts.funcs, scripts.timing, scripts.cache, scripts.keyboard, scripts.calibration; '
+            'print(sorted(heavy), "psychopy" in sys.modules)')
+    result = subprocess.run([sys.executable, '-c', code], cwd = ROOT, capture_output = True, text = True, check = True)
+
+    assert result.stdout.split() == ['[]', 'False']
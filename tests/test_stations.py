@@ -0,0 +1,61 @@
+import threading, time
+from scripts.stations import Coordinator
+
+HEADER = 'trial_nb,response,rt,timeout,image,task,yes_key,run,block\n'
+
+
+def test_assign_unique_participants(tmp_path):
+
+    coordinator = Coordinator(tmp_path / 'coordinator.sqlite')
+    sessions = []
+    # stations asking at the same time
+    threads = [threading.Thread(target = lambda n = n: sessions.append(coordinator.assign(f'station {n}')))
+               for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(session['participant'] for session in sessions) == list(range(1, 9))
+    # the groups are balanced, and the station names made safe for file names
+    assert sorted(session['counterbalance'] for session in sessions) == [0] * 4 + [1] * 4
+    assert {session['session_key'].split('_')[-1] for session in sessions} == {f'station-{n}' for n in range(8)}
+
+
+def test_collect_reads_complete_rows(tmp_path):
+
+    coordinator = Coordinator(tmp_path / 'coordinator.sqlite')
+    session = coordinator.assign('vm')
+    log_path = session['out'] + '_log.csv'
+
+    # a first trial, and a second one being written
+    with open(log_path, 'w') as file:
+        file.write(HEADER + '0,f,0.5,False,main_face_1,face,f,1,1\n0,j,0.')
+    assert coordinator.collect() == 1
+    with open(log_path, 'a') as file:
+        file.write('6,False,main_face_2,face,f,1,2\n')
+    assert coordinator.collect() == 1
+    assert coordinator.collect() == 0
+
+    progress = coordinator.progress().iloc[0]
+    assert progress['trials'] == 2 and progress['accuracy'] == 0.5 and progress['block'] == 2
+    trials = coordinator.trials(session['session_key'])
+    assert trials['rt'].tolist() == [0.5, 0.6] and (trials['session_key'] == session['session_key']).all()
+
+
+def test_crashed_sessions_fail(tmp_path):
+
+    coordinator = Coordinator(tmp_path / 'coordinator.sqlite', timeout = 0.05)
+    first = coordinator.assign('vm-1')
+    # the station restarts and starts another session: the first one was cut short
+    second = coordinator.assign('vm-1')
+    other = coordinator.assign('vm-2')
+    status = coordinator.progress().set_index('session_key')['status']
+    assert status[first['session_key']] == 'failed' and status[second['session_key']] == 'running'
+
+    # a station that stops beating
+    time.sleep(0.1)
+    coordinator.heartbeat(other['session_key'])
+    assert coordinator.expire() == [second['session_key']]
+    coordinator.finish(other['session_key'])
+    assert coordinator.progress().set_index('session_key')['status'][other['session_key']] == 'done'
@@ -0,0 +1,67 @@
+import time
+import pandas as pd
+from scripts.simulated import SimulatedWindow
+from scripts.timing import TrialTimer, frame_summary
+
+
+class ReleaseKeyboard:
+
+    # a keyboard on which every key is held 1 s, waiting for the release unless told not to, as the
+    # psychopy Keyboard does by default
+    def __init__(self, keyboard):
+        self.keyboard = keyboard
+        self.clock = keyboard.clock
+
+    def clearEvents(self):
+        pass
+
+    def waitKeys(self, maxWait = float('inf'), keyList = None, waitRelease = True, **kwargs):
+        keys = self.keyboard.waitKeys(maxWait = maxWait, keyList = keyList)
+        if keys and waitRelease:
+            self.keyboard.win.now += 1.
+        return keys
+
+
+def test_response_returns_at_the_press():
+
+    win = SimulatedWindow(responder = lambda keyList: (keyList[0], 0.3))
+    timer = TrialTimer(win, keyboard = ReleaseKeyboard(win.keyboard))
+    timer.start_trial()
+    onset = timer.flip_onset()
+
+    # pressed in time, released after the deadline: still a response
+    response, rt = timer.wait_response(['f', 'j'], max_wait = 0.5)
+
+    assert response == 'f' and abs(rt - 0.3) < 1e-9
+    assert timer.stamps['poll_time'] - onset < 0.5
+
+
+def test_dropped_frames_and_their_cause():
+
+    win = SimulatedWindow()
+    timer = TrialTimer(win)
+    timer.start_trial()
+    timer.flip('fixation')
+    # the image takes two and a half frames to prepare, more than half a frame of real time too
+    with timer.section('image'):
+        win.wait(2.5 * win.monitorFramePeriod)
+        time.sleep(win.monitorFramePeriod)
+    timer.flip_onset(frames = 1)
+
+    frames = timer.trial_frames()
+
+    assert frames['dropped_frames'] == 2 and frames['late_cause'] == 'image'
+    assert abs(frames['onset_error'] - 2 * win.monitorFramePeriod) < 1e-9
+    assert abs(frames['max_flip_interval'] - 3 * win.monitorFramePeriod) < 1e-9
+
+
+def test_frame_summary():
+
+    df = pd.DataFrame({'block': [1, 1, 2], 'dropped_frames': [0, 2, 0], 'onset_error': [0., 0.002, 0.],
+                       'late_cause': ['', 'image', float('nan')]})
+
+    summary = frame_summary(df)
+
+    assert summary['late_trials'].tolist() == [1, 0] and summary['dropped_frames'].tolist() == [2, 0]
+    assert summary['main_cause'].tolist() == ['image', '']
+    assert frame_summary(df, by = []).iloc[0]['trials'] == 3
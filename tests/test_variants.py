@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from scripts.manifest import build_manifest
+from scripts.variants import build_variant_store, open_variant_store, render_image
+
+CONFIG = {'size': (800, 600), 'units': 'pix', 'screen_color': '#BABAB9', 'stim_size': (20, 20)}
+
+
+def store_folders(tmp_path):
+    stimuli, screens = tmp_path / 'stimuli', tmp_path / 'instructions'
+    stimuli.mkdir()
+    screens.mkdir()
+    Image.new('RGB', (40, 40), 'red').save(stimuli / 'main_face_1.png')
+    # transparent, so it gets the background of the window
+    Image.new('RGBA', (30, 10), (0, 0, 0, 0)).save(screens / 'cross.png')
+    return build_manifest(str(stimuli)), str(stimuli), [str(screens / 'cross.png')]
+
+
+def test_store_holds_the_rendered_images(tmp_path):
+
+    manifest, stimuli, screens = store_folders(tmp_path)
+    stim_df = manifest.assign(stim_file = [os.path.join(stimuli, name) for name in manifest['name']])
+    build_variant_store(stim_df, screens, folder = str(tmp_path / 'variants'), **CONFIG)
+
+    store = open_variant_store(stim_df, folder = str(tmp_path / 'variants'), **CONFIG)
+
+    image = store.get(stim_df['stim_file'][0])
+    assert image.size == (20, 20)
+    assert np.array_equal(np.asarray(image), np.asarray(render_image(stim_df['stim_file'][0], (20, 20), '#BABAB9')))
+    assert store.get(screens[0]).getpixel((0, 0)) == (0xBA, 0xBA, 0xB9)
+    # another window configuration has no store
+    assert open_variant_store(stim_df, folder = str(tmp_path / 'variants'), **{**CONFIG, 'size': (1024, 768)}) is None
+
+
+def test_changed_images_are_not_used(tmp_path):
+
+    manifest, stimuli, screens = store_folders(tmp_path)
+    stim_df = manifest.assign(stim_file = [os.path.join(stimuli, name) for name in manifest['name']])
+    build_variant_store(stim_df, screens, folder = str(tmp_path / 'variants'), **CONFIG)
+
+    # a changed screen is left out of the store, to be rendered again from its file
+    Image.new('RGBA', (30, 10), (0, 0, 0, 255)).save(screens[0])
+    store = open_variant_store(stim_df, folder = str(tmp_path / 'variants'), **CONFIG)
+    assert screens[0] not in store and stim_df['stim_file'][0] in store
+
+    # a changed stimulus makes the whole store stale
+    assert open_variant_store(stim_df.assign(sha256 = 'changed'), folder = str(tmp_path / 'variants'), **CONFIG) is None
+
+
+def test_only_pixel_units(tmp_path):
+
+    manifest, stimuli, screens = store_folders(tmp_path)
+
+    with pytest.raises(ValueError):
+        build_variant_store(manifest, screens, folder = str(tmp_path / 'variants'), **{**CONFIG, 'units': 'height'})
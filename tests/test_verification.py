@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from PIL import Image
+from scripts.simulated import SimulatedImageStim, SimulatedWindow
+from scripts.verification import FrameVerifier, add_frame_checks, frame_references, read_frame_checks
+
+
+def make_images(folder):
+    # a bright square in a different corner of each image
+    files = []
+    for i, name in enumerate(['a', 'b', 'c']):
+        pixels = np.zeros((60, 60, 3), dtype = np.uint8)
+        row, col = divmod(i, 2)
+        pixels[30 * row:30 * row + 30, 30 * col:30 * col + 30] = 255
+        file = str(folder / f'{name}.png')
+        Image.fromarray(pixels).save(file)
+        files.append(file)
+    return files
+
+
+def test_frames_showing_the_wrong_stimulus_are_flagged(tmp_path):
+
+    files = make_images(tmp_path)
+    win = SimulatedWindow(size = (200, 200))
+    references = frame_references(files, (100, 100), win.color)
+
+    with FrameVerifier(win, references, size = (100, 100)) as verifier:
+        verifier.set_context(block = 1)
+        # the expected stimulus, then another one drawn in its place, then nothing at all
+        for n, (expected, drawn) in enumerate([(files[0], files[0]), (files[1], files[2]), (files[2], None)]):
+            if drawn is not None:
+                SimulatedImageStim(win, image = drawn, size = (100, 100)).draw()
+            verifier.capture(expected, trial_nb = n)
+            win.flip()
+            verifier.collect()
+
+    checks = verifier.report()
+    assert checks['frame_match'].tolist() == [True, False, False]
+    assert checks['frame_nearest'][1] == files[2]
+    assert checks['frame_distance'][0] < 1 < checks['frame_distance'][1]
+    assert (checks['block'] == 1).all()
+    summary = verifier.summary()
+    assert (summary['frames'], summary['checked'], summary['mismatches']) == (3, 3, 2)
+
+    # saved with the session, then added to the trial data
+    verifier.save(tmp_path / 'frames.csv')
+    df = pd.DataFrame({'block': [1, 1, 1, 2], 'trial_nb': [0, 1, 2, 0]})
+    trials = add_frame_checks(df, read_frame_checks(tmp_path / 'frames.csv'))
+    assert trials['frame_match'].tolist()[:3] == [True, False, False]
+    assert pd.isna(trials['frame_match'][3])